@@ -0,0 +1,364 @@
+"""
+Benchmarks for the HVM panel.
+
+Run against a live panel (the background stats threads start with it), e.g.
+
+    python benchmarks.py panel --url http://127.0.0.1:3000 --duration 30 --concurrency 16
+
+or against the local Docker daemon and any running container, e.g.
+
+    python benchmarks.py exec --container <id> --calls 200 --concurrency 8
+
+or backup/restore throughput on a generated database, e.g.
+
+    python benchmarks.py backup --rows 200000
+
+or, for the Discord bot, event-loop responsiveness during a VPS create:
+
+    python benchmarks.py bot-loop --image ubuntu:22.04 --cmd "sleep 5"
+"""
+
+import argparse
+import ast
+import logging
+import os
+import statistics
+import subprocess
+import threading
+import time
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HVM_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hvm.py')
+
+
+def load_hvm(names, namespace):
+    """Execute top-level definitions of hvm.py, and those they use, into namespace.
+
+    Importing hvm would start Flask, Socket.IO and the background threads;
+    this pulls out just the code under test. Modules it needs must already
+    be in namespace.
+    """
+    with open(HVM_SOURCE) as f:
+        tree = ast.parse(f.read(), HVM_SOURCE)
+    definitions = {}
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            definitions[node.name] = node
+        elif isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    definitions.setdefault(target.id, node)
+    missing = [name for name in names if name not in definitions]
+    if missing:
+        raise SystemExit(f"hvm.py no longer defines {', '.join(missing)}")
+
+    wanted, pending = set(), list(names)
+    while pending:
+        node = definitions[pending.pop()]
+        if id(node) in wanted:
+            continue
+        wanted.add(id(node))
+        pending.extend(n.id for n in ast.walk(node) if isinstance(n, ast.Name) and n.id in definitions and n.id not in namespace)
+    for node in tree.body:
+        if id(node) in wanted:
+            exec(compile(ast.Module(body=[node], type_ignores=[]), HVM_SOURCE, 'exec'), namespace)
+    return namespace
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def report(title, samples, elapsed, errors=0):
+    print(f"\n{title}")
+    print(f"  requests:   {len(samples)} ({errors} errors) in {elapsed:.1f}s -> {len(samples) / elapsed:.1f} req/s")
+    if samples:
+        print(f"  latency ms: p50={percentile(samples, 50):.1f} p95={percentile(samples, 95):.1f} "
+              f"p99={percentile(samples, 99):.1f} max={max(samples):.1f} mean={statistics.mean(samples):.1f}")
+
+
+def login(url, username, password):
+    session = requests.Session()
+    response = session.post(f"{url}/login", data={'username': username, 'password': password}, allow_redirects=False)
+    if response.status_code not in (302, 303):
+        raise SystemExit(f"Login failed with HTTP {response.status_code}")
+    return session
+
+
+def bench_panel(args):
+    """Measure panel request latency while the stats/monitor threads keep writing."""
+    latencies = {path: [] for path in args.paths}
+    errors = {path: 0 for path in args.paths}
+    lock = threading.Lock()
+
+    # /login is rate limited, so authenticate once and share the cookie.
+    cookies = login(args.url, args.username, args.password).cookies
+    deadline = time.monotonic() + args.duration
+
+    def worker(offset):
+        session = requests.Session()
+        session.cookies.update(cookies)
+        i = offset
+        while time.monotonic() < deadline:
+            path = args.paths[i % len(args.paths)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                ok = session.get(f"{args.url}{path}", timeout=60).status_code < 500
+            except requests.RequestException:
+                ok = False
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies[path].append(elapsed_ms)
+                if not ok:
+                    errors[path] += 1
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+
+    for path in args.paths:
+        report(f"GET {path}", latencies[path], elapsed, errors[path])
+    report("all routes", [ms for samples in latencies.values() for ms in samples], elapsed, sum(errors.values()))
+
+
+def run_calls(fn, calls, concurrency):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    remaining = iter(range(calls))
+
+    def worker():
+        nonlocal errors
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            start = time.perf_counter()
+            try:
+                ok = fn()
+            except Exception:
+                ok = False
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed_ms)
+                if not ok:
+                    errors += 1
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, time.monotonic() - started, errors
+
+
+def bench_exec(args):
+    """Compare `docker exec` via the CLI with the panel's run_docker_command."""
+    import docker
+    import shlex
+    import codecs
+    import signal
+    import socket
+    import struct
+    import uuid
+    from contextlib import contextmanager
+
+    panel = load_hvm(
+        ['run_docker_command'],
+        {'os': os, 'time': time, 'threading': threading, 'contextmanager': contextmanager, 'shlex': shlex,
+         'signal': signal, 'socket': socket, 'struct': struct, 'codecs': codecs, 'uuid': uuid, 'docker_client': docker.from_env(),
+         'logger': logging.getLogger('hvm')})
+    command = args.cmd.split()
+
+    def cli():
+        return subprocess.run(['docker', 'exec', args.container] + command, capture_output=True).returncode == 0
+
+    def api():
+        return panel['run_docker_command'](args.container, command)[0]
+
+    for title, fn in (('docker exec (CLI)', cli), ('run_docker_command (Engine API socket)', api)):
+        latencies, elapsed, errors = run_calls(fn, args.calls, args.concurrency)
+        report(f"{title}: {args.cmd!r} x{args.calls}, concurrency {args.concurrency}", latencies, elapsed, errors)
+
+
+def bench_backup(args):
+    """Full, incremental and restore throughput of the panel's backup format."""
+    import datetime
+    import gzip
+    import hashlib
+    import json
+    import queue
+    import resource
+    import shutil
+    import socket
+    import sqlite3
+    import tempfile
+    from contextlib import contextmanager
+    from urllib.request import pathname2url
+    from werkzeug.security import generate_password_hash
+
+    panel = load_hvm(
+        ['Database'],
+        {'os': os, 'time': time, 'threading': threading, 'contextmanager': contextmanager, 'datetime': datetime,
+         'gzip': gzip, 'hashlib': hashlib, 'json': json, 'queue': queue, 'shutil': shutil, 'socket': socket,
+         'sqlite3': sqlite3, 'tempfile': tempfile, 'pathname2url': pathname2url, 'generate_password_hash': generate_password_hash,
+         'logging': logging})
+    workdir = tempfile.mkdtemp(prefix='hvm-backup-bench-')
+    try:
+        db = panel['Database'](os.path.join(workdir, 'source.db'))
+        start = datetime.datetime.now() - datetime.timedelta(days=2)
+        vps_count = 50
+
+        def add_history(rows, offset):
+            # One sample per VPS every 10s, spread so compaction has minutes to roll up.
+            batch = []
+            for i in range(offset, offset + rows):
+                timestamp = str(start + datetime.timedelta(seconds=10 * (i // vps_count)))
+                batch.append((f'bench{i % vps_count}', i % 100, 50.0, 20.0, i, i, timestamp))
+                if len(batch) == 10000:
+                    db._executemany('INSERT INTO resource_history (vps_id, cpu_percent, memory_percent, disk_usage, bandwidth_in, bandwidth_out, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)', batch)
+                    batch = []
+            if batch:
+                db._executemany('INSERT INTO resource_history (vps_id, cpu_percent, memory_percent, disk_usage, bandwidth_in, bandwidth_out, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)', batch)
+            db._executemany('INSERT INTO audit_logs (user_id, action, details, timestamp) VALUES (?, ?, ?, ?)',
+                            [(1, 'bench', 'x' * 64, str(start)) for _ in range(rows // 10)])
+
+        print(f"Seeding {args.rows} history rows...")
+        add_history(args.rows, 0)
+        db.compact_resource_history(now=start + datetime.timedelta(hours=args.compact_hours))
+
+        def report_backup(title, result):
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+            print(f"\n{title}: {result['rows']} rows, {result['bytes'] / 1024 / 1024:.1f} MiB in {result['seconds']:.2f}s "
+                  f"-> {result['rows'] / max(result['seconds'], 1e-6):.0f} rows/s (peak RSS {rss} MiB)")
+
+        full = db.backup_data(os.path.join(workdir, 'full.ndjson.gz'), chain='bench')
+        report_backup('full backup', full)
+        add_history(args.rows // 100, args.rows)
+        db.compact_resource_history(now=start + datetime.timedelta(hours=args.compact_hours + 1))
+        incremental = db.backup_data(os.path.join(workdir, 'incremental.ndjson.gz'), incremental=True, chain='bench')
+        report_backup('incremental backup', incremental)
+
+        restored = panel['Database'](os.path.join(workdir, 'restored.db'))
+        started = time.perf_counter()
+        if not restored.restore_data([full['path'], incremental['path']]):
+            raise SystemExit('restore failed')
+        elapsed = time.perf_counter() - started
+        rows = full['rows'] + incremental['rows']
+        print(f"\nrestore full + incremental: {rows} rows in {elapsed:.2f}s -> {rows / max(elapsed, 1e-6):.0f} rows/s")
+
+        for table in ('resource_history', 'resource_rollups', 'audit_logs'):
+            expected = db._fetchone(f'SELECT COUNT(*) FROM {table}')[0]
+            got = restored._fetchone(f'SELECT COUNT(*) FROM {table}')[0]
+            if expected != got:
+                raise SystemExit(f"{table}: restored {got} rows, expected {expected}")
+        print("restored row counts match")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_bot_loop(args):
+    """Event-loop lag during a create, blocking SDK calls vs the bot's AsyncDocker facade."""
+    import asyncio
+    import docker
+    from bot import AsyncDocker
+
+    client = docker.from_env()
+    docker_api = AsyncDocker(client)
+    run_kwargs = dict(image=args.image, command=['sleep', 'infinity'], detach=True)
+
+    async def probe(stop, lags):
+        # A heartbeat stand-in: how late does a short sleep wake up?
+        interval = args.interval / 1000
+        while not stop.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append((time.perf_counter() - start - interval) * 1000)
+
+    async def blocking():
+        container = client.containers.run(**run_kwargs)
+        container.exec_run(args.cmd)
+        return container
+
+    async def facade():
+        container = await docker_api.run_container(**run_kwargs)
+        await docker_api.exec_run(container, args.cmd)
+        return container
+
+    async def measure(create):
+        stop = asyncio.Event()
+        lags = []
+        task = asyncio.create_task(probe(stop, lags))
+        await asyncio.sleep(0)
+        started = time.perf_counter()
+        container = await create()
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await task
+        container.remove(force=True)
+        return lags, elapsed
+
+    for title, create in (('blocking SDK calls in the coroutine', blocking), ('AsyncDocker facade', facade)):
+        lags, elapsed = asyncio.run(measure(create))
+        print(f"\n{title}: create + {args.cmd!r} took {elapsed:.1f}s")
+        print(f"  loop lag ms over {len(lags)} ticks: p50={percentile(lags, 50):.1f} p99={percentile(lags, 99):.1f} "
+              f"max={max(lags, default=0):.1f}")
+
+    # lags is the facade run's; the blocking run is only the baseline.
+    if percentile(lags, 99) > args.max_p99:
+        raise SystemExit(f"FAIL: facade p99 loop lag {percentile(lags, 99):.1f}ms is over {args.max_p99}ms")
+    print(f"\nOK: facade p99 loop lag within {args.max_p99}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    panel = sub.add_parser('panel', help='HTTP latency of panel routes under concurrent load')
+    panel.add_argument('--url', default=f"http://127.0.0.1:{os.getenv('SERVER_PORT', '3000')}")
+    panel.add_argument('--username', default=os.getenv('ADMIN_USERNAME', 'admin'))
+    panel.add_argument('--password', default=os.getenv('ADMIN_PASSWORD', 'admin'))
+    panel.add_argument('--duration', type=float, default=30)
+    panel.add_argument('--concurrency', type=int, default=16)
+    panel.add_argument('--paths', nargs='+', default=['/dashboard', '/admin'])
+    panel.set_defaults(func=bench_panel)
+
+    exec_parser = sub.add_parser('exec', help='Calls per second of CLI docker exec vs run_docker_command')
+    exec_parser.add_argument('--container', required=True)
+    exec_parser.add_argument('--cmd', default='true')
+    exec_parser.add_argument('--calls', type=int, default=200)
+    exec_parser.add_argument('--concurrency', type=int, default=8)
+    exec_parser.set_defaults(func=bench_exec)
+
+    backup = sub.add_parser('backup', help='Backup and restore throughput on a generated database')
+    backup.add_argument('--rows', type=int, default=200000, help='resource_history rows to seed')
+    backup.add_argument('--compact-hours', type=int, default=6, help='hours of the seeded history rolled up before the backup')
+    backup.set_defaults(func=bench_backup)
+
+    bot_loop = sub.add_parser('bot-loop', help='Bot event-loop lag while a VPS container is created')
+    bot_loop.add_argument('--image', default='ubuntu:22.04')
+    bot_loop.add_argument('--cmd', default='sleep 5')
+    bot_loop.add_argument('--interval', type=float, default=10, help='probe interval in ms')
+    bot_loop.add_argument('--max-p99', type=float, default=50, help='fail if the facade p99 loop lag exceeds this many ms')
+    bot_loop.set_defaults(func=bench_bot_loop)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -43,7 +43,9 @@ from discord import ui
 import os
 import random
 import string
+import io
 import json
+import sqlite3
 import subprocess
 from dotenv import load_dotenv
 import asyncio
@@ -51,6 +53,9 @@ import datetime
 import docker
 import time
 import uuid
+import functools
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # Load environment variables
@@ -58,8 +63,45 @@ load_dotenv()
 
 # Bot configuration
 TOKEN = os.getenv('DISCORD_TOKEN')
-VPS_STORAGE_FILE = 'vps_data.json'
+VPS_STORAGE_FILE = 'vps_data.json'  # legacy store, migrated into VPS_DB_FILE
+VPS_DB_FILE = os.getenv('VPS_DB_FILE', 'vps_data.db')
 ADMIN_ROLE_ID = 1379417287093649488  # Your admin role ID
+# Max concurrent Docker calls per kind of operation
+DOCKER_LIMITS = {
+    'create': int(os.getenv('DOCKER_CREATE_LIMIT', '2')),
+    'exec': int(os.getenv('DOCKER_EXEC_LIMIT', '4')),
+    'lifecycle': int(os.getenv('DOCKER_LIFECYCLE_LIMIT', '4')),
+    'inspect': int(os.getenv('DOCKER_INSPECT_LIMIT', '8')),
+    'build': 1
+}
+PROVISION_WORKERS = int(os.getenv('PROVISION_WORKERS', '2'))  # VPS creations running at once
+VPS_BASE_IMAGE = 'ubuntu:22.04'
+VPS_IMAGE_VERSION = '1'
+VPS_IMAGE_TAG = f"vps-bot/{VPS_BASE_IMAGE.replace(':', '-')}:v{VPS_IMAGE_VERSION}"
+# Packages and system config every VPS used to install on create, baked
+# in once. Bump VPS_IMAGE_VERSION after editing.
+VPS_DOCKERFILE = """
+FROM {base_image}
+ENV DEBIAN_FRONTEND=noninteractive
+RUN apt-get update && \\
+    apt-get install -y systemd systemd-sysv dbus dbus-user-session tmate docker.io && \\
+    apt-get clean && rm -rf /var/lib/apt/lists/*
+RUN mkdir -p /etc/systemd/system/docker.service.d /etc/docker && \\
+    printf '[Service]\\nExecStart=\\nExecStart=/usr/bin/dockerd --containerd=/run/containerd/containerd.sock\\n' > /etc/systemd/system/docker.service.d/override.conf && \\
+    echo '{{"data-root": "/var/lib/docker", "exec-opts": ["native.cgroupdriver=systemd"]}}' > /etc/docker/daemon.json && \\
+    systemctl enable docker
+RUN printf 'PRETTY_NAME="CatHosting Vps"\\nNAME="CatHosting Vps"\\nVERSION="1.0"\\nID=cathosting\\nVERSION_ID="1.0"\\n' > /etc/os-release && \\
+    printf 'DISTRIB_ID=CatHosting\\nDISTRIB_RELEASE=1.0\\nDISTRIB_CODENAME=vps\\nDISTRIB_DESCRIPTION="CatHosting Vps"\\n' > /etc/lsb-release
+LABEL vps-bot.image_version="{image_version}"
+STOPSIGNAL SIGRTMIN+3
+CMD ["/lib/systemd/systemd"]
+"""
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', '3600'))  # seconds
+USER_FETCH_CONCURRENCY = int(os.getenv('USER_FETCH_CONCURRENCY', '5'))
+# Discord caps an embed at 25 fields and 6000 characters
+EMBED_MAX_FIELDS = 25
+EMBED_MAX_CHARS = 6000
+TMATE_SESSION_COMMAND = "tmate -S /tmp/tmate.sock new-session -d && tmate -S /tmp/tmate.sock wait tmate-ready && tmate -S /tmp/tmate.sock display -p '#{tmate_ssh}'"
 
 # Initialize bot with command prefix '!'
 class CustomBot(commands.Bot):
@@ -68,6 +110,12 @@ class CustomBot(commands.Bot):
         self._last_command = None
         self._last_command_time = 0
 
+    async def setup_hook(self):
+        # Runs once before the first connection; on_ready fires again on
+        # every gateway reconnect
+        await load_vps_data()
+        start_provisioning()
+
     async def process_commands(self, message):
         if message.author.bot:
             return
@@ -86,30 +134,323 @@ intents.message_content = True
 intents.members = True
 bot = CustomBot(command_prefix='!', intents=intents)
 
+class AsyncDocker:
+    """Async facade over the blocking Docker SDK.
+
+    Every call runs on a bounded thread pool so the event loop (heartbeats,
+    other guilds' commands) keeps running while Docker works, and each kind
+    of operation has its own concurrency limit so a burst of creates cannot
+    starve quick status lookups.
+    """
+
+    def __init__(self, docker_client, limits=DOCKER_LIMITS):
+        self.client = docker_client
+        # One thread per permit: a kind at its limit can never hold the
+        # threads another kind is waiting for.
+        self.executor = ThreadPoolExecutor(max_workers=sum(limits.values()), thread_name_prefix='docker')
+        self.limits = limits
+        self.semaphores = {}
+
+    async def call(self, kind, fn, *args, **kwargs):
+        if kind not in self.semaphores:
+            self.semaphores[kind] = asyncio.Semaphore(self.limits[kind])
+        async with self.semaphores[kind]:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def get_container(self, container_id):
+        return await self.call('inspect', self.client.containers.get, container_id)
+
+    async def list_containers(self, **kwargs):
+        # sparse skips the per-container inspect the SDK otherwise does
+        return await self.call('inspect', self.client.containers.list, all=True, sparse=True, **kwargs)
+
+    async def build_image(self, dockerfile, tag):
+        image, _ = await self.call('build', self.client.images.build, fileobj=io.BytesIO(dockerfile.encode()),
+                                   tag=tag, rm=True, forcerm=True)
+        return image
+
+    async def run_container(self, **kwargs):
+        return await self.call('create', self.client.containers.run, **kwargs)
+
+    async def exec_run(self, container, cmd, **kwargs):
+        return await self.call('exec', container.exec_run, cmd, **kwargs)
+
+    async def start(self, container):
+        return await self.call('lifecycle', container.start)
+
+    async def stop(self, container):
+        return await self.call('lifecycle', container.stop)
+
+    async def restart(self, container):
+        return await self.call('lifecycle', container.restart)
+
+    async def remove(self, container):
+        return await self.call('lifecycle', container.remove)
+
+    async def stop_and_remove(self, container_id):
+        """Stop and remove a container, ignoring one that is already gone"""
+        try:
+            container = await self.get_container(container_id)
+            await self.stop(container)
+            await self.remove(container)
+        except docker.errors.NotFound:
+            pass
+
+    async def has_image(self, tag):
+        try:
+            await self.call('inspect', self.client.images.get, tag)
+            return True
+        except docker.errors.ImageNotFound:
+            return False
+
+    async def ensure_network(self, name):
+        try:
+            await self.call('inspect', self.client.networks.get, name)
+            return False
+        except docker.errors.NotFound:
+            await self.call('create', self.client.networks.create, name, driver="bridge")
+            return True
+
 # Initialize Docker client
 try:
     client = docker.from_env()
+    docker_api = AsyncDocker(client)
 except Exception as e:
     print(f"Failed to initialize Docker client: {e}")
     client = None
+    docker_api = None
+
+class VPSStore:
+    """SQLite-backed VPS records keyed by owner id.
+
+    Every statement runs on one dedicated thread, so the event loop never
+    waits on disk, writes land in the order they were made, and each change
+    commits atomically in its own transaction.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='vps-store')
+        self.conn = None
+
+    def _connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS vps (
+                    owner_id TEXT PRIMARY KEY,
+                    vps_id TEXT,
+                    container_id TEXT,
+                    data TEXT NOT NULL,
+                    updated_at TEXT
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_vps_vps_id ON vps (vps_id)')
+        return self.conn
 
-# Store VPS data
-vps_data = {}
+    @staticmethod
+    def _row(owner_id, vps):
+        return (owner_id, vps.get('id'), vps.get('container_id'), json.dumps(vps), datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
 
-def load_vps_data():
-    global vps_data
-    if os.path.exists(VPS_STORAGE_FILE):
+    def _migrate_json(self, conn):
         with open(VPS_STORAGE_FILE, 'r') as f:
-            vps_data = json.load(f)
+            legacy = json.load(f)
+        for vps in legacy.values():
             # Fix missing created_at fields
-            for vps_id, vps in vps_data.items():
-                if 'created_at' not in vps:
-                    vps['created_at'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            save_vps_data()
+            vps.setdefault('created_at', datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO vps (owner_id, vps_id, container_id, data, updated_at) VALUES (?, ?, ?, ?, ?)',
+                             [self._row(owner_id, vps) for owner_id, vps in legacy.items()])
+        os.replace(VPS_STORAGE_FILE, f'{VPS_STORAGE_FILE}.migrated')
+        print(f"Migrated {len(legacy)} VPS records from {VPS_STORAGE_FILE} to {self.path}")
+
+    def _load(self):
+        conn = self._connect()
+        if os.path.exists(VPS_STORAGE_FILE) and not conn.execute('SELECT 1 FROM vps LIMIT 1').fetchone():
+            self._migrate_json(conn)
+        return {owner_id: json.loads(data) for owner_id, data in conn.execute('SELECT owner_id, data FROM vps')}
+
+    def _put(self, row):
+        conn = self._connect()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO vps (owner_id, vps_id, container_id, data, updated_at) VALUES (?, ?, ?, ?, ?)', row)
+
+    def _delete(self, owner_ids):
+        conn = self._connect()
+        with conn:
+            conn.executemany('DELETE FROM vps WHERE owner_id = ?', [(owner_id,) for owner_id in owner_ids])
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def load(self):
+        return await self._run(self._load)
+
+    async def put(self, owner_id, vps):
+        # Serialize on the loop thread so later in-memory edits can't race
+        # the write.
+        await self._run(self._put, self._row(owner_id, vps))
+
+    async def delete(self, *owner_ids):
+        await self._run(self._delete, owner_ids)
+
+class VPSIndex:
+    """Secondary lookups over vps_data by VPS id, container id and creator.
+
+    Every lookup returns the owner key into vps_data. The index is only
+    changed by load_vps_data, save_vps and forget_vps, the same places that
+    write the store, so the two can't drift apart.
+    """
+
+    def __init__(self):
+        self.by_vps_id = {}
+        self.by_container_id = {}
+        self.by_creator = {}
+        self.status_counts = Counter()
+        self.entries = {}
+
+    @staticmethod
+    def _entry(owner_id, vps):
+        return (vps.get('id'), vps.get('container_id'), str(vps.get('created_by', owner_id)), vps.get('status', 'unknown'))
+
+    def clear(self):
+        self.__init__()
+
+    def add(self, owner_id, vps):
+        self.discard(owner_id)
+        entry = self._entry(owner_id, vps)
+        vps_id, container_id, creator, status = entry
+        if vps_id:
+            self.by_vps_id[vps_id] = owner_id
+        if container_id:
+            self.by_container_id[container_id] = owner_id
+        self.by_creator.setdefault(creator, set()).add(owner_id)
+        self.status_counts[status] += 1
+        self.entries[owner_id] = entry
+
+    def discard(self, owner_id):
+        entry = self.entries.pop(owner_id, None)
+        if entry is None:
+            return
+        vps_id, container_id, creator, status = entry
+        if self.by_vps_id.get(vps_id) == owner_id:
+            del self.by_vps_id[vps_id]
+        if self.by_container_id.get(container_id) == owner_id:
+            del self.by_container_id[container_id]
+        owned = self.by_creator.get(creator)
+        if owned is not None:
+            owned.discard(owner_id)
+            if not owned:
+                del self.by_creator[creator]
+        self.status_counts[status] -= 1
+        if self.status_counts[status] <= 0:
+            del self.status_counts[status]
+
+    def owner_of_vps(self, vps_id):
+        return self.by_vps_id.get(vps_id)
+
+    def owner_of_container(self, container_id):
+        return self.by_container_id.get(container_id)
+
+    def count_created_by(self, user_id):
+        return len(self.by_creator.get(str(user_id), ()))
+
+vps_store = VPSStore(VPS_DB_FILE)
+
+# In-memory view of the store, keyed by owner id
+vps_data = {}
+vps_index = VPSIndex()
+
+async def load_vps_data():
+    loaded = await vps_store.load()
+    # Swap in with no await in between, so commands never see a half-loaded store
+    vps_data.clear()
+    vps_data.update(loaded)
+    vps_index.clear()
+    for owner_id, vps in vps_data.items():
+        vps_index.add(owner_id, vps)
+
+async def save_vps(owner_id):
+    """Persist one VPS record after it changed in memory"""
+    if owner_id in vps_data:
+        vps_index.add(owner_id, vps_data[owner_id])
+        await vps_store.put(owner_id, vps_data[owner_id])
+
+async def forget_vps(*owner_ids):
+    """Drop VPS records from memory and from the store"""
+    for owner_id in owner_ids:
+        vps_data.pop(owner_id, None)
+        vps_index.discard(owner_id)
+    if owner_ids:
+        await vps_store.delete(*owner_ids)
+
+# user id -> (name, expires at)
+user_name_cache = {}
+
+async def resolve_user_names(user_ids, guild=None):
+    """Map user ids to names: TTL cache, then gateway cache, then bounded fetches"""
+    now = time.monotonic()
+    names = {}
+    missing = []
+    for user_id in {str(user_id) for user_id in user_ids}:
+        cached = user_name_cache.get(user_id)
+        if cached and cached[1] > now:
+            names[user_id] = cached[0]
+            continue
+        if not user_id.isdigit():
+            names[user_id] = "Unknown User"
+            continue
+        user = (guild and guild.get_member(int(user_id))) or bot.get_user(int(user_id))
+        if user:
+            names[user_id] = user.name
+            user_name_cache[user_id] = (user.name, now + USER_CACHE_TTL)
+        else:
+            missing.append(user_id)
 
-def save_vps_data():
-    with open(VPS_STORAGE_FILE, 'w') as f:
-        json.dump(vps_data, f)
+    semaphore = asyncio.Semaphore(USER_FETCH_CONCURRENCY)
+
+    async def fetch(user_id):
+        async with semaphore:
+            try:
+                name = (await bot.fetch_user(int(user_id))).name
+            except discord.NotFound:
+                # Deleted accounts stay deleted, so cache the miss too
+                name = "Unknown User"
+            except discord.HTTPException:
+                names[user_id] = "Unknown User"
+                return
+        names[user_id] = name
+        user_name_cache[user_id] = (name, time.monotonic() + USER_CACHE_TTL)
+
+    await asyncio.gather(*(fetch(user_id) for user_id in missing))
+    return names
+
+def paginate_embeds(title, fields, color, description=None, footer=None):
+    """Spread (name, value) fields over as many embeds as Discord's limits need"""
+    pages = []
+    page, size = [], 0
+    for name, value in fields:
+        length = len(name) + len(value)
+        if page and (len(page) == EMBED_MAX_FIELDS or size + length > EMBED_MAX_CHARS - 500):
+            pages.append(page)
+            page, size = [], 0
+        page.append((name, value))
+        size += length
+    pages.append(page)
+
+    embeds = []
+    for number, page in enumerate(pages, 1):
+        page_title = title if len(pages) == 1 else f"{title} ({number}/{len(pages)})"
+        embed = discord.Embed(title=page_title, description=description if number == 1 else None, color=color)
+        for name, value in page:
+            embed.add_field(name=name, value=value, inline=False)
+        if footer:
+            embed.set_footer(text=footer)
+        embeds.append(embed)
+    return embeds
 
 def generate_vps_id():
     """Generate a unique VPS ID"""
@@ -153,13 +494,15 @@ async def send_tmate_session(interaction, container_id, vps_id):
             raise Exception("Failed to get tmate session")
 
         # Update stored session
-        if vps_id in vps_data:
-            vps_data[vps_id]['tmate_session'] = ssh_session_line
-            save_vps_data()
+        owner_id = vps_index.owner_of_vps(vps_id)
+        if owner_id is not None:
+            vps = vps_data[owner_id]
+            vps['tmate_session'] = ssh_session_line
+            await save_vps(owner_id)
             
             # Send new session to user
             try:
-                user = await bot.fetch_user(int(vps_data[vps_id]["created_by"]))
+                user = await bot.fetch_user(int(vps.get("created_by", owner_id)))
                 embed = discord.Embed(title="New VPS Session", color=discord.Color.blue())
                 embed.add_field(name="VPS ID", value=vps_id, inline=True)
                 embed.add_field(name="Tmate Session", value=f"```{ssh_session_line}```", inline=False)
@@ -172,11 +515,7 @@ async def send_tmate_session(interaction, container_id, vps_id):
         await interaction.followup.send(f"❌ Error getting new session: {str(e)}", ephemeral=True)
 
 def count_user_servers(userid):
-    count = 0
-    for vps_id, data in vps_data.items():
-        if data["created_by"] == userid:
-            count += 1
-    return count
+    return vps_index.count_created_by(userid)
 
 async def run_docker_command(container_id, command, timeout=120):
     """Run a Docker command asynchronously with timeout"""
@@ -237,54 +576,180 @@ async def wait_for_apt_lock(container_id, status_msg):
     
     return False
 
-async def setup_container(container_id, vps_id):
-    """Set up the container with required packages and configurations"""
-    try:
-        container = client.containers.get(container_id)
-        if not container.status == "running":
-            container.start()
-
-        # Update package list and install required packages
-        container.exec_run("apt-get update")
-        container.exec_run("apt-get install -y tmate docker.io systemd-sysv dbus dbus-user-session", privileged=True)
-        
-        # Configure systemd
-        container.exec_run("mkdir -p /etc/systemd/system/docker.service.d")
-        container.exec_run("echo '[Service]\nExecStart=\nExecStart=/usr/bin/dockerd --containerd=/run/containerd/containerd.sock' > /etc/systemd/system/docker.service.d/override.conf")
-        
-        # Configure Docker
-        container.exec_run("mkdir -p /etc/docker")
-        container.exec_run("echo '{\"data-root\": \"/var/lib/docker\", \"exec-opts\": [\"native.cgroupdriver=systemd\"]}' > /etc/docker/daemon.json")
-        
-        # Set hostname and system information
-        container.exec_run("hostnamectl set-hostname 'CatHosting Vps'")
-        container.exec_run("echo 'CatHosting Vps' > /etc/hostname")
-        container.exec_run("echo '127.0.0.1 CatHosting Vps' >> /etc/hosts")
-        
-        # Update system information files
-        container.exec_run("""echo 'PRETTY_NAME="CatHosting Vps"
-NAME="CatHosting Vps"
-VERSION="1.0"
-ID=cathosting
-VERSION_ID="1.0"' > /etc/os-release""")
-        
-        container.exec_run("""echo 'DISTRIB_ID=CatHosting
-DISTRIB_RELEASE=1.0
-DISTRIB_CODENAME=vps
-DISTRIB_DESCRIPTION="CatHosting Vps"' > /etc/lsb-release""")
-        
-        # Enable and start services
-        container.exec_run("systemctl daemon-reload")
-        container.exec_run("systemctl enable docker")
-        container.exec_run("systemctl start docker")
-        
-        # Restart container to apply changes
-        container.restart()
-        
+vps_image_lock = asyncio.Lock()
+
+async def ensure_vps_image():
+    """Build the systemd+tmate VPS image once; later calls reuse the local copy"""
+    async with vps_image_lock:
+        if await docker_api.has_image(VPS_IMAGE_TAG):
+            return False
+        print(f"Building VPS image {VPS_IMAGE_TAG}...")
+        dockerfile = VPS_DOCKERFILE.format(base_image=VPS_BASE_IMAGE, image_version=VPS_IMAGE_VERSION)
+        await docker_api.build_image(dockerfile, VPS_IMAGE_TAG)
+        print(f"Built VPS image {VPS_IMAGE_TAG}")
         return True
+
+class ProvisionProgress:
+    """Edits a status message with each provisioning step and how long it took"""
+
+    def __init__(self, message):
+        self.message = message
+        self.lines = []
+        self.step = None
+        self.started = self.step_started = time.perf_counter()
+
+    def _finish_step(self):
+        if self.step:
+            self.lines.append(f"✅ {self.step} ({time.perf_counter() - self.step_started:.1f}s)")
+            self.step = None
+
+    async def _edit(self, last_line):
+        await self.message.edit(content="\n".join(self.lines + [last_line]))
+
+    async def begin(self, step):
+        self._finish_step()
+        self.step = step
+        self.step_started = time.perf_counter()
+        await self._edit(f"🔄 {step}...")
+
+    async def done(self, text):
+        self._finish_step()
+        await self._edit(f"{text} ({time.perf_counter() - self.started:.1f}s total)")
+
+    async def fail(self, text):
+        self.step = None
+        await self._edit(text)
+
+provision_queue = asyncio.Queue()
+provisioning_users = set()  # owners with a create queued or running
+provision_workers = []
+
+async def provision_vps(ctx, user_id, ram, cpu, disk, progress):
+    """Create one VPS from the prebuilt image and DM the credentials"""
+    await progress.begin("Preparing VPS image")
+    if await ensure_vps_image():
+        progress.step = "Built VPS image (first run only)"
+
+    await progress.begin("Preparing network")
+    await docker_api.ensure_network("vps_network")
+
+    # Generate VPS ID and credentials
+    vps_id = str(uuid.uuid4())[:8]
+    username = f"@{ctx.author.name}"
+    password = ''.join(random.choices(string.ascii_letters + string.digits, k=12))
+
+    await progress.begin("Creating container")
+    # The image boots straight into systemd with tmate and docker installed
+    container = await docker_api.run_container(
+        image=VPS_IMAGE_TAG,
+        detach=True,
+        privileged=True,
+        cap_add=["ALL", "SYS_ADMIN"],
+        security_opt=["seccomp:unconfined"],
+        volumes={
+            '/sys/fs/cgroup': {'bind': '/sys/fs/cgroup', 'mode': 'ro'},
+            '/var/run/docker.sock': {'bind': '/var/run/docker.sock', 'mode': 'rw'},
+            '/var/lib/docker': {'bind': '/var/lib/docker', 'mode': 'rw'},
+            '/etc/docker': {'bind': '/etc/docker', 'mode': 'rw'}
+        },
+        name=f"vps_{vps_id}",
+        hostname="CatHosting Vps",
+        environment={
+            "container": "docker",
+            "DOCKER_HOST": "unix:///var/run/docker.sock"
+        },
+        network="vps_network",
+        mem_limit=f"{ram}m",
+        memswap_limit=f"{ram}m",
+        cpu_period=100000,
+        cpu_quota=int(cpu * 100000),
+        restart_policy={"Name": "unless-stopped"}
+    )
+
+    # Store VPS data
+    vps_data[user_id] = {
+        "id": vps_id,
+        "container_id": container.id,
+        "ram": ram,
+        "cpu": cpu,
+        "disk": disk,
+        "username": username,
+        "password": password,
+        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "created_by": user_id,
+        "status": "running"
+    }
+    await save_vps(user_id)
+
+    await progress.begin("Setting up SSH access")
+    try:
+        ssh_url = await new_tmate_session(container)
+        if not ssh_url:
+            await progress.fail("❌ Error getting tmate session")
+            return
     except Exception as e:
-        print(f"Error setting up container: {e}")
-        return False
+        await progress.fail(f"❌ Error getting tmate session: {str(e)}")
+        return
+
+    await progress.begin("Sending credentials")
+    # Send credentials via DM
+    try:
+        embed = discord.Embed(
+            title="🎉 VPS Created Successfully!",
+            description="Here are your VPS credentials:",
+            color=discord.Color.green()
+        )
+        embed.add_field(name="Username", value=username, inline=False)
+        embed.add_field(name="Password", value=password, inline=False)
+        embed.add_field(name="VPS ID", value=vps_id, inline=False)
+        embed.add_field(name="Resources", value=f"RAM: {ram}MB\nCPU: {cpu} cores\nDisk: {disk}GB", inline=False)
+        embed.add_field(name="Created At", value=vps_data[user_id]["created_at"], inline=False)
+        embed.add_field(name="SSH Command", value=f"```{ssh_url}```", inline=False)
+        await ctx.author.send(embed=embed)
+        await progress.done("✅ VPS created successfully! Check your DMs for credentials.")
+    except:
+        await progress.fail("❌ Could not send credentials via DM. Please enable DMs from server members.")
+
+async def provision_worker():
+    """Take create requests off the queue; PROVISION_WORKERS of these run at once"""
+    while True:
+        ctx, user_id, ram, cpu, disk, status_msg = await provision_queue.get()
+        progress = ProvisionProgress(status_msg)
+        try:
+            await provision_vps(ctx, user_id, ram, cpu, disk, progress)
+        except Exception as e:
+            try:
+                await progress.fail(f"❌ Error creating VPS: {str(e)}")
+            except Exception:
+                print(f"Error creating VPS for {user_id}: {e}")
+        finally:
+            provisioning_users.discard(user_id)
+            provision_queue.task_done()
+
+def start_provisioning():
+    """Start the provisioning workers and warm the VPS image in the background"""
+    if provision_workers:
+        return
+    for _ in range(PROVISION_WORKERS):
+        provision_workers.append(asyncio.create_task(provision_worker()))
+
+    async def warm_image():
+        try:
+            await ensure_vps_image()
+        except Exception as e:
+            print(f"Error building VPS image: {e}")
+
+    provision_workers.append(asyncio.create_task(warm_image()))
+
+async def new_tmate_session(container, install=False):
+    """Start a fresh tmate session in the container and return its SSH command"""
+    if install:
+        await docker_api.exec_run(container, ["bash", "-c", "command -v tmate || (apt-get update && apt-get install -y tmate)"], privileged=True)
+    await docker_api.exec_run(container, ["bash", "-c", "pkill tmate || true"])
+    result = await docker_api.exec_run(container, ["bash", "-c", TMATE_SESSION_COMMAND], privileged=True)
+    if result.exit_code != 0:
+        return None
+    return result.output.decode().strip()
 
 @bot.event
 async def on_ready():
@@ -309,7 +774,6 @@ async def on_ready():
     ║  • User-friendly interface                                ║
     ╚════════════════════════════════════════════════════════════╝
     """)
-    load_vps_data()
 
 @bot.command(name='commands')
 @commands.check(has_required_role)
@@ -350,27 +814,20 @@ async def list_vps_command(ctx):
                 await ctx.send("No VPS instances found.")
                 return
 
-            embed = discord.Embed(
-                title="📋 VPS List (Admin View)",
-                description="Here are all the VPS instances:",
-                color=discord.Color.blue()
-            )
-
+            usernames = await resolve_user_names(vps_data, ctx.guild)
+            fields = []
             for user_id, vps in vps_data.items():
-                try:
-                    user = await bot.fetch_user(int(user_id))
-                    username = user.name
-                except:
-                    username = "Unknown User"
-
                 status = "🟢 Running" if vps.get("status") == "running" else "🔴 Stopped"
                 created_at = vps.get("created_at", "Unknown")
-                
-                embed.add_field(
-                    name=f"VPS {vps['id']} ({username})",
-                    value=f"Status: {status}\nCreated: {created_at}\nResources: {vps['ram']}MB RAM, {vps['cpu']} CPU, {vps['disk']}GB Disk",
-                    inline=False
-                )
+                fields.append((
+                    f"VPS {vps['id']} ({usernames[user_id]})",
+                    f"Status: {status}\nCreated: {created_at}\nResources: {vps['ram']}MB RAM, {vps['cpu']} CPU, {vps['disk']}GB Disk"
+                ))
+
+            for embed in paginate_embeds("📋 VPS List (Admin View)", fields, discord.Color.blue(),
+                                         description="Here are all the VPS instances:"):
+                await ctx.send(embed=embed)
+            return
         else:
             # Regular users can only see their own VPS
             user_id = str(ctx.author.id)
@@ -406,29 +863,26 @@ async def admin_list_vps(ctx):
             await ctx.send("No VPS instances found.")
             return
 
-        embed = discord.Embed(title="All VPS Instances", color=discord.Color.blue())
-        valid_vps_count = 0
-        vps_to_remove = []  # Store VPS IDs to remove after iteration
-        
-        # Create a copy of the keys to iterate over
-        for vps_id in list(vps_data.keys()):
-            vps = vps_data[vps_id]
-            try:
-                # Get user information
-                try:
-                    user = await bot.fetch_user(int(vps.get("created_by", "0")))
-                    username = user.name
-                except:
-                    username = "Unknown User"
+        fields = []
 
-                # Check container status
-                try:
-                    container = client.containers.get(vps.get("container_id", ""))
-                    status = "🟢 Running" if container.status == "running" else "🔴 Stopped"
-                except:
-                    # Mark for removal after iteration
-                    vps_to_remove.append(vps_id)
-                    continue
+        # One listing call, matched back to records through the container index
+        container_status = {}
+        for container in await docker_api.list_containers():
+            owner_id = vps_index.owner_of_container(container.id)
+            if owner_id is not None:
+                container_status[owner_id] = container.status
+        # Records whose container is gone are removed after iteration
+        vps_to_remove = [owner_id for owner_id in vps_data if owner_id not in container_status]
+
+        usernames = await resolve_user_names(
+            (vps_data[owner_id].get("created_by", owner_id) for owner_id in container_status), ctx.guild)
+
+        for owner_id, state in container_status.items():
+            vps = vps_data[owner_id]
+            vps_id = vps.get("id", owner_id)
+            try:
+                username = usernames[str(vps.get("created_by", owner_id))]
+                status = "🟢 Running" if state == "running" else "🔴 Stopped"
 
                 # Get VPS information with safe defaults
                 vps_info = f"""
@@ -442,28 +896,22 @@ Created: {vps.get('created_at', 'Unknown')}
 VPS ID: {vps_id}
 """
 
-                embed.add_field(
-                    name=f"VPS {vps_id}",
-                    value=vps_info,
-                    inline=False
-                )
-                valid_vps_count += 1
+                fields.append((f"VPS {vps_id}", vps_info))
             except Exception as e:
                 print(f"Error processing VPS {vps_id}: {e}")
                 continue
         
         # Remove invalid VPS entries after iteration
-        for vps_id in vps_to_remove:
-            del vps_data[vps_id]
-        if vps_to_remove:
-            save_vps_data()
+        await forget_vps(*vps_to_remove)
 
-        if valid_vps_count == 0:
+        if not fields:
             await ctx.send("No valid VPS instances found.")
             return
 
-        embed.set_footer(text=f"Total VPS instances: {valid_vps_count}")
-        await ctx.send(embed=embed)
+        counts = ", ".join(f"{count} {state}" for state, count in sorted(vps_index.status_counts.items()))
+        footer = f"Total VPS instances: {len(fields)} ({counts})"
+        for embed in paginate_embeds("All VPS Instances", fields, discord.Color.blue(), footer=footer):
+            await ctx.send(embed=embed)
     except Exception as e:
         await ctx.send(f"❌ Error listing VPS instances: {str(e)}")
 
@@ -473,27 +921,19 @@ async def delete_vps(ctx, vps_id: str, username: str):
     """Delete a VPS instance"""
     try:
         # Find VPS to delete
-        vps_to_delete = None
-        for vps_id_key, vps in vps_data.items():
-            if vps_id_key == vps_id and vps["username"] == username:
-                vps_to_delete = vps_id_key
-                break
-
-        if not vps_to_delete:
+        vps_to_delete = vps_index.owner_of_vps(vps_id)
+        if vps_to_delete is None or vps_data[vps_to_delete]["username"] != username:
             await ctx.send("❌ VPS not found!")
             return
 
         # Stop and remove container
         try:
-            container = client.containers.get(vps_data[vps_to_delete]["container_id"])
-            container.stop()
-            container.remove()
-        except:
-            pass  # Container might not exist
+            await docker_api.stop_and_remove(vps_data[vps_to_delete]["container_id"])
+        except Exception as e:
+            print(f"Error removing container for VPS {vps_id}: {e}")
 
         # Remove VPS data
-        del vps_data[vps_to_delete]
-        save_vps_data()
+        await forget_vps(vps_to_delete)
 
         await ctx.send(f"✅ VPS {vps_id} has been deleted!")
     except Exception as e:
@@ -509,7 +949,7 @@ async def manage_vps_command(ctx):
             return
 
         vps = vps_data[user_id]
-        container = client.containers.get(vps["container_id"])
+        container = await docker_api.get_container(vps["container_id"])
         status = "🟢 Running" if container.status == "running" else "🔴 Stopped"
 
         embed = discord.Embed(
@@ -518,7 +958,7 @@ async def manage_vps_command(ctx):
             color=discord.Color.blue()
         )
 
-        view = VPSManagementView(ctx, vps)
+        view = VPSManagementView(ctx)
         await ctx.send(embed=embed, view=view)
     except Exception as e:
         await ctx.send(f"❌ Error managing VPS: {str(e)}")
@@ -542,11 +982,25 @@ class OSSelectionView(ui.View):
         await select_interaction.response.defer()
         self.stop()
 
+async def reply(interaction, *args, **kwargs):
+    """Answer an interaction whether or not it has already been deferred"""
+    if interaction.response.is_done():
+        await interaction.followup.send(*args, **kwargs)
+    else:
+        await interaction.response.send_message(*args, **kwargs)
+
 class VPSManagementView(discord.ui.View):
-    def __init__(self, ctx, vps):
+    def __init__(self, ctx):
         super().__init__(timeout=300)
         self.ctx = ctx
-        self.vps = vps
+        self.owner_id = str(ctx.author.id)
+
+    @property
+    def vps(self):
+        """The owner's current record; re-read so edits land on what save_vps persists"""
+        if self.owner_id not in vps_data:
+            raise Exception("VPS no longer exists")
+        return vps_data[self.owner_id]
 
     @discord.ui.button(label="Start VPS", style=discord.ButtonStyle.green)
     async def start_vps(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -555,30 +1009,22 @@ class VPSManagementView(discord.ui.View):
             return
 
         try:
-            container = client.containers.get(self.vps["container_id"])
+            container = await docker_api.get_container(self.vps["container_id"])
             if container.status == "running":
                 await interaction.response.send_message("✅ VPS is already running!", ephemeral=True)
                 return
 
-            container.start()
+            # Starting and opening a session takes longer than the 3s
+            # interaction window
+            await interaction.response.defer(ephemeral=True, thinking=True)
+            await docker_api.start(container)
             self.vps["status"] = "running"
-            save_vps_data()
+            await save_vps(self.owner_id)
 
-            # Install tmate if not installed
-            container.exec_run("apt-get update && apt-get install -y tmate", privileged=True)
-            
-            # Kill any existing tmate sessions
-            container.exec_run("pkill tmate || true")
-            
-            # Create new tmate session
-            result = container.exec_run("tmate -F", privileged=True)
-            output = result.output.decode()
-            
-            if result.exit_code != 0:
-                await interaction.response.send_message("❌ Error getting new session: Failed to get tmate session", ephemeral=True)
+            ssh_url = await new_tmate_session(container, install=True)
+            if not ssh_url:
+                await interaction.followup.send("❌ Error getting new session: Failed to get tmate session", ephemeral=True)
                 return
-
-            ssh_url = result.output.decode().strip()
             
             embed = discord.Embed(
                 title="🚀 VPS Started Successfully!",
@@ -589,9 +1035,9 @@ class VPSManagementView(discord.ui.View):
             embed.add_field(name="Username", value=self.vps["username"], inline=False)
             embed.add_field(name="Password", value=self.vps["password"], inline=False)
             
-            await interaction.response.send_message(embed=embed, ephemeral=True)
+            await interaction.followup.send(embed=embed, ephemeral=True)
         except Exception as e:
-            await interaction.response.send_message(f"❌ Error starting VPS: {str(e)}", ephemeral=True)
+            await reply(interaction, f"❌ Error starting VPS: {str(e)}", ephemeral=True)
 
     @discord.ui.button(label="Stop VPS", style=discord.ButtonStyle.red)
     async def stop_vps(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -600,17 +1046,18 @@ class VPSManagementView(discord.ui.View):
             return
 
         try:
-            container = client.containers.get(self.vps["container_id"])
+            container = await docker_api.get_container(self.vps["container_id"])
             if container.status != "running":
                 await interaction.response.send_message("✅ VPS is already stopped!", ephemeral=True)
                 return
 
-            container.stop()
+            await interaction.response.defer(ephemeral=True, thinking=True)
+            await docker_api.stop(container)
             self.vps["status"] = "stopped"
-            save_vps_data()
-            await interaction.response.send_message("✅ VPS stopped successfully!", ephemeral=True)
+            await save_vps(self.owner_id)
+            await interaction.followup.send("✅ VPS stopped successfully!", ephemeral=True)
         except Exception as e:
-            await interaction.response.send_message(f"❌ Error stopping VPS: {str(e)}", ephemeral=True)
+            await reply(interaction, f"❌ Error stopping VPS: {str(e)}", ephemeral=True)
 
     @discord.ui.button(label="Restart VPS", style=discord.ButtonStyle.blurple)
     async def restart_vps(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -619,26 +1066,16 @@ class VPSManagementView(discord.ui.View):
             return
 
         try:
-            container = client.containers.get(self.vps["container_id"])
-            container.restart()
+            await interaction.response.defer(ephemeral=True, thinking=True)
+            container = await docker_api.get_container(self.vps["container_id"])
+            await docker_api.restart(container)
             self.vps["status"] = "running"
-            save_vps_data()
+            await save_vps(self.owner_id)
 
-            # Install tmate if not installed
-            container.exec_run("apt-get update && apt-get install -y tmate", privileged=True)
-            
-            # Kill any existing tmate sessions
-            container.exec_run("pkill tmate || true")
-            
-            # Create new tmate session
-            result = container.exec_run("tmate -F", privileged=True)
-            output = result.output.decode()
-            
-            if result.exit_code != 0:
-                await interaction.response.send_message("❌ Error getting new session: Failed to get tmate session", ephemeral=True)
+            ssh_url = await new_tmate_session(container, install=True)
+            if not ssh_url:
+                await interaction.followup.send("❌ Error getting new session: Failed to get tmate session", ephemeral=True)
                 return
-
-            ssh_url = result.output.decode().strip()
             
             embed = discord.Embed(
                 title="🔄 VPS Restarted Successfully!",
@@ -649,9 +1086,9 @@ class VPSManagementView(discord.ui.View):
             embed.add_field(name="Username", value=self.vps["username"], inline=False)
             embed.add_field(name="Password", value=self.vps["password"], inline=False)
             
-            await interaction.response.send_message(embed=embed, ephemeral=True)
+            await interaction.followup.send(embed=embed, ephemeral=True)
         except Exception as e:
-            await interaction.response.send_message(f"❌ Error restarting VPS: {str(e)}", ephemeral=True)
+            await reply(interaction, f"❌ Error restarting VPS: {str(e)}", ephemeral=True)
 
     @discord.ui.button(label="Reinstall OS", style=discord.ButtonStyle.gray)
     async def reinstall_os(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -672,14 +1109,12 @@ class VPSManagementView(discord.ui.View):
             return
 
         try:
-            container = client.containers.get(self.vps["container_id"])
-            container.stop()
-            container.remove()
-            del vps_data[str(self.ctx.author.id)]
-            save_vps_data()
-            await interaction.response.send_message("✅ VPS deleted successfully!", ephemeral=True)
+            await interaction.response.defer(ephemeral=True, thinking=True)
+            await docker_api.stop_and_remove(self.vps["container_id"])
+            await forget_vps(self.owner_id)
+            await interaction.followup.send("✅ VPS deleted successfully!", ephemeral=True)
         except Exception as e:
-            await interaction.response.send_message(f"❌ Error deleting VPS: {str(e)}", ephemeral=True)
+            await reply(interaction, f"❌ Error deleting VPS: {str(e)}", ephemeral=True)
 
 @bot.command(name='delete_all')
 @commands.check(has_admin_role)
@@ -699,27 +1134,23 @@ async def delete_all_vps(ctx):
             return
 
         # Delete all VPSes
-        deleted_count = 0
+        deleted = []
         for vps_id, vps_data_item in list(vps_data.items()):
             try:
                 # Stop and remove container
                 try:
-                    container = client.containers.get(vps_data_item["container_id"])
-                    container.stop()
-                    container.remove()
-                except:
-                    pass  # Container might not exist
-
-                # Remove VPS data
-                del vps_data[vps_id]
-                deleted_count += 1
+                    await docker_api.stop_and_remove(vps_data_item["container_id"])
+                except Exception as e:
+                    print(f"Error removing container for VPS {vps_id}: {e}")
+
+                deleted.append(vps_id)
             except Exception as e:
                 print(f"Error deleting VPS {vps_id}: {e}")
 
-        # Save updated VPS data
-        save_vps_data()
+        # Remove VPS data in one transaction
+        await forget_vps(*deleted)
         
-        await ctx.send(f"✅ Successfully deleted {deleted_count} VPS instances!")
+        await ctx.send(f"✅ Successfully deleted {len(deleted)} VPS instances!")
     except Exception as e:
         await ctx.send(f"❌ Error deleting VPSes: {str(e)}")
 
@@ -734,31 +1165,21 @@ async def start_vps_command(ctx):
             return
 
         vps = vps_data[user_id]
-        container = client.containers.get(vps["container_id"])
+        container = await docker_api.get_container(vps["container_id"])
 
         if container.status == "running":
             await ctx.send("✅ VPS is already running!")
             return
 
         # Start container
-        container.start()
+        await docker_api.start(container)
         vps["status"] = "running"
-        save_vps_data()
+        await save_vps(user_id)
 
-        # Install tmate if not installed
-        container.exec_run("apt-get update && apt-get install -y tmate", privileged=True)
-        
-        # Kill any existing tmate sessions
-        container.exec_run("pkill tmate || true")
-        
-        # Create new tmate session
-        result = container.exec_run("tmate -S /tmp/tmate.sock new-session -d && tmate -S /tmp/tmate.sock wait tmate-ready && tmate -S /tmp/tmate.sock display -p '#{tmate_ssh}'", privileged=True)
-        
-        if result.exit_code != 0:
+        ssh_url = await new_tmate_session(container, install=True)
+        if not ssh_url:
             await ctx.send("❌ Error getting new session: Failed to get tmate session")
             return
-
-        ssh_url = result.output.decode().strip()
         
         embed = discord.Embed(
             title="🚀 VPS Started Successfully!",
@@ -788,115 +1209,18 @@ async def create_vps_command(ctx, ram: int, cpu: int, disk: int):
         if user_id in vps_data:
             await ctx.send("❌ You already have a VPS. Please delete your existing VPS first.")
             return
-
-        status_msg = await ctx.send("🔄 Creating VPS... Please wait.")
-
-        # Create Docker network if it doesn't exist
-        try:
-            client.networks.get("vps_network")
-        except:
-            await status_msg.edit(content="🔄 Creating Docker network...")
-            client.networks.create("vps_network", driver="bridge")
-
-        # Generate VPS ID and credentials
-        vps_id = str(uuid.uuid4())[:8]
-        username = f"@{ctx.author.name}"
-        password = ''.join(random.choices(string.ascii_letters + string.digits, k=12))
-        
-        await status_msg.edit(content="🔄 Creating container...")
-        
-        # Create container with systemd
-        container = client.containers.run(
-            image="ubuntu:22.04",
-            command="bash -c 'apt-get update && apt-get install -y systemd-sysv tmate && /lib/systemd/systemd'",
-            detach=True,
-            privileged=True,
-            cap_add=["ALL", "SYS_ADMIN"],
-            security_opt=["seccomp:unconfined"],
-            volumes={
-                '/sys/fs/cgroup': {'bind': '/sys/fs/cgroup', 'mode': 'ro'},
-                '/var/run/docker.sock': {'bind': '/var/run/docker.sock', 'mode': 'rw'},
-                '/var/lib/docker': {'bind': '/var/lib/docker', 'mode': 'rw'},
-                '/etc/docker': {'bind': '/etc/docker', 'mode': 'rw'}
-            },
-            name=f"vps_{vps_id}",
-            hostname="CatHosting Vps",
-            environment={
-                "container": "docker",
-                "DOCKER_HOST": "unix:///var/run/docker.sock"
-            },
-            network="vps_network",
-            mem_limit=f"{ram}m",
-            memswap_limit=f"{ram}m",
-            cpu_period=100000,
-            cpu_quota=int(cpu * 100000),
-            restart_policy={"Name": "unless-stopped"}
-        )
-
-        await status_msg.edit(content="🔄 Setting up container...")
-        
-        # Set up the container
-        if not await setup_container(container.id, vps_id):
-            container.stop()
-            container.remove()
-            await status_msg.edit(content="❌ Container setup failed")
+        if user_id in provisioning_users:
+            await ctx.send("❌ Your VPS is already being created. Please wait.")
             return
 
-        await status_msg.edit(content="🔄 Configuring system...")
-
-        # Store VPS data
-        vps_data[user_id] = {
-            "id": vps_id,
-            "container_id": container.id,
-            "ram": ram,
-            "cpu": cpu,
-            "disk": disk,
-            "username": username,
-            "password": password,
-            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "status": "running"
-        }
-        save_vps_data()
-
-        await status_msg.edit(content="🔄 Setting up SSH access...")
-
-        # Get tmate session
+        provisioning_users.add(user_id)
         try:
-            # Kill any existing tmate sessions
-            container.exec_run("pkill tmate || true")
-            
-            # Create new tmate session
-            result = container.exec_run("tmate -S /tmp/tmate.sock new-session -d && tmate -S /tmp/tmate.sock wait tmate-ready && tmate -S /tmp/tmate.sock display -p '#{tmate_ssh}'", privileged=True)
-            
-            if result.exit_code != 0:
-                await status_msg.edit(content="❌ Error getting tmate session")
-                return
-
-            ssh_url = result.output.decode().strip()
-        except Exception as e:
-            await status_msg.edit(content=f"❌ Error getting tmate session: {str(e)}")
-            return
-
-        await status_msg.edit(content="🔄 Sending credentials...")
-
-        # Send credentials via DM
-        try:
-            embed = discord.Embed(
-                title="🎉 VPS Created Successfully!",
-                description="Here are your VPS credentials:",
-                color=discord.Color.green()
-            )
-            embed.add_field(name="Username", value=username, inline=False)
-            embed.add_field(name="Password", value=password, inline=False)
-            embed.add_field(name="VPS ID", value=vps_id, inline=False)
-            embed.add_field(name="Resources", value=f"RAM: {ram}MB\nCPU: {cpu} cores\nDisk: {disk}GB", inline=False)
-            embed.add_field(name="Created At", value=vps_data[user_id]["created_at"], inline=False)
-            embed.add_field(name="SSH Command", value=f"```{ssh_url}```", inline=False)
-            await ctx.author.send(embed=embed)
-            await status_msg.edit(content="✅ VPS created successfully! Check your DMs for credentials.")
+            position = provision_queue.qsize() + 1
+            status_msg = await ctx.send(f"🔄 Creating VPS... Queued (position {position}).")
+            provision_queue.put_nowait((ctx, user_id, ram, cpu, disk, status_msg))
         except:
-            await status_msg.edit(content="❌ Could not send credentials via DM. Please enable DMs from server members.")
-
+            provisioning_users.discard(user_id)
+            raise
     except Exception as e:
         await ctx.send(f"❌ Error creating VPS: {str(e)}")
 
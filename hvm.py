@@ -13,14 +13,18 @@ import json
 import datetime
 import time
 import logging
+import logging.handlers
 import socket
 import paramiko
 import traceback
 import shutil
 import sqlite3
 import threading
+import queue
+from urllib.request import pathname2url
 from dotenv import load_dotenv
 from functools import wraps
+from contextlib import contextmanager
 from werkzeug.security import generate_password_hash, check_password_hash
 import psutil
 import pty
@@ -29,21 +33,27 @@ import termios
 import tty
 import fcntl
 import struct
+import codecs
+import posixpath
+import math
 import signal
 import uuid
 import concurrent.futures
 import csv
 import io
+import gzip
+import hashlib
 from werkzeug.utils import secure_filename
 import tarfile
-from io import BytesIO
+import tempfile
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 import smtplib
 from email.mime.text import MIMEText
-from collections import deque
+from collections import deque, OrderedDict
 import shlex
 import base64
+import re
 from ecdsa import VerifyingKey, BadSignatureError, NIST384p
 
 PUBLIC_HEX = 'b681f4f051055d844c3f21678db26759adacf292fc649b49e08800b316173927aa08df82ad4a9a9930e26315ddc8531671ba42cdf16e91c086ce30150b6470cb37f390da3b3ec6522bed24cb1703efff9a0c8ec8d744222657e1944f5a08d81e'
@@ -85,11 +95,20 @@ if not check_docker_installed():
 if not check_docker_running():
     subprocess.run(["systemctl", "start", "docker"], check=True)
 
+LOG_FILE = os.getenv('LOG_FILE', 'hvm_panel.log')
+LOG_TAIL_LINES = int(os.getenv('LOG_TAIL_LINES', '200'))
+LOG_TAIL_MAX_SCAN = int(os.getenv('LOG_TAIL_MAX_SCAN', str(64 * 1024 * 1024)))
+LOG_FOLLOW_INTERVAL = float(os.getenv('LOG_FOLLOW_INTERVAL', '1'))
+LOG_RECORD_START = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3} - ')
+LOG_LEVELS = {'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'}
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler('hvm_panel.log'),
+        # Reopens LOG_FILE after logrotate moves it, so follow_log keeps
+        # seeing new lines.
+        logging.handlers.WatchedFileHandler(LOG_FILE),
         logging.StreamHandler()
     ]
 )
@@ -108,11 +127,76 @@ DEFAULT_OS_IMAGE = os.getenv('DEFAULT_OS_IMAGE', 'ubuntu:22.04')
 DOCKER_NETWORK = os.getenv('DOCKER_NETWORK', 'hvm_network')
 MAX_CONTAINERS = int(os.getenv('MAX_CONTAINERS', '100'))
 DB_FILE = 'hvm_panel.db'
-BACKUP_FILE = 'hvm_panel_backup.json'
+DB_READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', '16'))
+DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', '30'))
+HISTORY_RAW_RETENTION_HOURS = int(os.getenv('HISTORY_RAW_RETENTION_HOURS', '6'))
+HISTORY_MINUTE_RETENTION_DAYS = int(os.getenv('HISTORY_MINUTE_RETENTION_DAYS', '7'))
+HISTORY_HOUR_RETENTION_DAYS = int(os.getenv('HISTORY_HOUR_RETENTION_DAYS', '90'))
+HISTORY_DAY_RETENTION_DAYS = int(os.getenv('HISTORY_DAY_RETENTION_DAYS', '730'))
+HISTORY_COMPACT_INTERVAL = int(os.getenv('HISTORY_COMPACT_INTERVAL', '600'))
+STATS_INTERVAL = int(os.getenv('STATS_INTERVAL', '5'))
+STATS_SERIES_LENGTH = int(os.getenv('STATS_SERIES_LENGTH', '120'))
+STATS_FIRST_SAMPLE_WAIT = float(os.getenv('STATS_FIRST_SAMPLE_WAIT', '3'))
+INTERNAL_STATS_TTL = float(os.getenv('INTERNAL_STATS_TTL', '5'))
+FILE_LIST_TTL = float(os.getenv('FILE_LIST_TTL', '30'))
+FILE_LIST_CACHE_DIRS = int(os.getenv('FILE_LIST_CACHE_DIRS', '32'))
+FILE_LIST_PAGE_SIZE = int(os.getenv('FILE_LIST_PAGE_SIZE', '200'))
+NODE_EXPORTER_PORT = int(os.getenv('NODE_EXPORTER_PORT', '9100'))
+METRICS_SCRAPE_INTERVAL = int(os.getenv('METRICS_SCRAPE_INTERVAL', '15'))
+METRICS_SCRAPE_WORKERS = int(os.getenv('METRICS_SCRAPE_WORKERS', '16'))
+METRICS_SERIES_LENGTH = int(os.getenv('METRICS_SERIES_LENGTH', '240'))
+METRICS_KEEP = tuple(filter(None, os.getenv('METRICS_KEEP', 'node_load,node_memory_,node_cpu_seconds_total,node_filesystem_,node_network_,node_disk_,node_procs_').split(',')))
+# Families summed at parse time: prefix[:label|label], keeping only the
+# listed labels. Inside a container node-exporter reports every host CPU,
+# disk and interface, which would otherwise be a series each per VPS.
+METRICS_AGGREGATE = [(prefix, tuple(filter(None, labels.split('|')))) for prefix, _, labels in
+                     (item.partition(':') for item in os.getenv('METRICS_AGGREGATE', 'node_cpu_seconds_total:mode,node_disk_,node_network_').split(',') if item)]
+PANEL_METRICS_TOKEN = os.getenv('PANEL_METRICS_TOKEN', '')
+# Scrapers allowed without a token. Only meaningful when Prometheus talks to
+# the panel directly: behind a reverse proxy every request comes from the
+# proxy's address, so requests carrying forwarding headers never match.
+PANEL_METRICS_ALLOWED_IPS = set(filter(None, os.getenv('PANEL_METRICS_ALLOWED_IPS', '').split(',')))
+METRICS_DEFAULT_NAMES = set(filter(None, os.getenv('METRICS_DEFAULT_NAMES', 'node_load1,node_memory_MemAvailable_bytes,node_memory_MemTotal_bytes,node_procs_running').split(',')))
+MINER_CPU_WINDOW = int(os.getenv('MINER_CPU_WINDOW', '60'))
+CONTAINER_RECONCILE_INTERVAL = int(os.getenv('CONTAINER_RECONCILE_INTERVAL', '300'))
+PREBAKE_IMAGES = [i.strip() for i in os.getenv('PREBAKE_IMAGES', DEFAULT_OS_IMAGE).split(',') if i.strip()]
+WARM_POOL_PLANS = [tuple(p.strip().split('|')) for p in os.getenv('WARM_POOL_PLANS', '').split(',') if p.strip()]
+WARM_POOL_SIZE = int(os.getenv('WARM_POOL_SIZE', '2'))
+WARM_POOL_INTERVAL = int(os.getenv('WARM_POOL_INTERVAL', '60'))
+CONTAINER_READY_TIMEOUT = int(os.getenv('CONTAINER_READY_TIMEOUT', '60'))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+DOCKER_EXEC_TIMEOUT = int(os.getenv('DOCKER_EXEC_TIMEOUT', '1200'))
+DOCKER_EXEC_PAGE_TIMEOUT = int(os.getenv('DOCKER_EXEC_PAGE_TIMEOUT', '30'))
+DOCKER_EXEC_MAX_OUTPUT = int(os.getenv('DOCKER_EXEC_MAX_OUTPUT', str(8 * 1024 * 1024)))
+CLONE_COPY_TIMEOUT = int(os.getenv('CLONE_COPY_TIMEOUT', '1800'))
+SSH_PORT_RANGE = tuple(int(p) for p in os.getenv('SSH_PORT_RANGE', '20000-30000').split('-'))
+FORWARD_PORT_RANGE = tuple(int(p) for p in os.getenv('FORWARD_PORT_RANGE', '30001-40000').split('-'))
+PORT_FORWARD_CHAIN = os.getenv('PORT_FORWARD_CHAIN', 'HVM-PORTS')
+PORT_FORWARD_FILTER_CHAIN = os.getenv('PORT_FORWARD_FILTER_CHAIN', 'HVM-FORWARD')
+BACKUP_FILE = 'hvm_panel_backup.ndjson.gz'
+BACKUP_INCREMENTAL_FILE = 'hvm_panel_backup.incremental.ndjson.gz'
+BACKUP_BATCH_SIZE = int(os.getenv('BACKUP_BATCH_SIZE', '1000'))
+# Restore order matters for the foreign keys between these.
+BACKUP_TABLES = ['users', 'vps_instances', 'usage_stats', 'system_settings', 'banned_users', 'docker_images', 'notifications', 'audit_logs',
+                 'vps_templates', 'resource_history', 'resource_rollups', 'vps_groups', 'vps_group_assignments', 'support_tickets', 'referrals', 'licenses']
+# Rows in these are only ever inserted, or deleted oldest-first by
+# compaction, so an id watermark is enough to find what changed.
+BACKUP_APPEND_TABLES = {'audit_logs', 'resource_history'}
+# Rollups are upserted in place, but every write stamps a new revision and
+# only retention deletes them, oldest buckets first per resolution.
+BACKUP_REVISION_TABLES = {'resource_rollups'}
+LEGACY_BACKUP_DEFAULTS = {
+    'users': {'theme': 'light'},
+    'vps_instances': {'additional_ports': '', 'bandwidth_limit': 0, 'tags': ''}
+}
 SERVER_IP = os.getenv('SERVER_IP', socket.gethostbyname(socket.gethostname()))
 SERVER_PORT = int(os.getenv('SERVER_PORT', '3000'))
 DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
 UPLOAD_FOLDER = 'uploads'
+FILE_STREAM_CHUNK = int(os.getenv('FILE_STREAM_CHUNK', str(1024 * 1024)))
+UPLOAD_STAGING_TTL = int(os.getenv('UPLOAD_STAGING_TTL', '86400'))
+UPLOAD_CHUNK_RATE_LIMIT = os.getenv('UPLOAD_CHUNK_RATE_LIMIT', '2000 per hour')
+UPLOAD_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
 ALLOWED_EXTENSIONS = {'tar', 'gz', 'iso', 'dockerfile'}
 SMTP_SERVER = os.getenv('SMTP_SERVER', 'smtp.example.com')
 SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
@@ -120,6 +204,10 @@ SMTP_USER = os.getenv('SMTP_USER', 'user@example.com')
 SMTP_PASS = os.getenv('SMTP_PASS', 'password')
 NOTIFICATION_EMAIL = os.getenv('NOTIFICATION_EMAIL', 'admin@example.com')
 BACKUP_SCHEDULE = os.getenv('BACKUP_SCHEDULE', 'daily')
+BACKUP_INTERVALS = {'hourly': 3600, 'daily': 86400}
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+BACKUP_RETENTION = int(os.getenv('BACKUP_RETENTION', '7'))  # full-backup generations kept; 0 or less keeps all
+BACKUP_FULL_EVERY = int(os.getenv('BACKUP_FULL_EVERY', '1'))
 VPS_HOSTNAME_PREFIX = os.getenv('VPS_HOSTNAME_PREFIX', 'hvm-')
 
 MINER_PATTERNS = [
@@ -128,6 +216,16 @@ MINER_PATTERNS = [
     'xmr-stak', 'ccminer', 'ewbf', 'lolminer', 'trex', 'nanominer'
 ]
 
+CONTAINER_EVENT_STATUS = {
+    'start': 'running',
+    'unpause': 'running',
+    'pause': 'paused',
+    'stop': 'exited',
+    'die': 'exited',
+    'destroy': 'not_found'
+}
+PANEL_MANAGED_STATUSES = ('suspended', 'expired')
+
 DOCKERFILE_TEMPLATE = """
 FROM {base_image}
 ENV DEBIAN_FRONTEND=noninteractive
@@ -147,9 +245,101 @@ RUN apt-get update && \\
                        fail2ban nmap iotop btop wireguard openvpn zabbix-agent glances iftop tcpdump samba apache2 prometheus clamav sysbench && \\
     apt-get clean && \\
     rm -rf /var/lib/apt/lists/*
+RUN apt-get update && \\
+    apt-get install -y prometheus-node-exporter && \\
+    apt-get upgrade -y && \\
+    apt-get -y autoremove && \\
+    apt-get clean && \\
+    rm -rf /var/lib/apt/lists/*
+RUN ufw allow 22 && \\
+    sed -i 's/^ENABLED=no/ENABLED=yes/' /etc/ufw/ufw.conf && \\
+    systemctl enable ufw fail2ban prometheus-node-exporter && \\
+    chmod 700 /root
+LABEL hvm.image_version="{image_version}"
 STOPSIGNAL SIGRTMIN+3
 CMD ["/sbin/init"]
 """
+IMAGE_VERSION = '2'
+
+# Everything the stats page shows from inside a VPS, gathered in one exec.
+INTERNAL_STATS_MARKER = '@@hvm:'
+INTERNAL_STATS_SCRIPT = r"""
+section() { printf '\n@@hvm:%s\n' "$1"; }
+section free; free -h 2>&1
+section df; df -h 2>&1
+section uptime; uptime 2>&1
+section neofetch; neofetch --off 2>&1
+section top; top -b -n1 2>&1
+"""
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LOOP_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, value, *labels):
+        with self.lock:
+            counts, total, count = self.series.get(labels, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.series[labels] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for labels, (counts, total, count) in self.series.items():
+                pairs = [f'{k}="{v}"' for k, v in zip(self.labelnames, labels)]
+                for bound, bucket_count in list(zip(self.buckets, counts)) + [('+Inf', count)]:
+                    bucket_labels = ','.join(pairs + [f'le="{bound}"'])
+                    lines.append(f'{self.name}_bucket{{{bucket_labels}}} {bucket_count}')
+                suffix = '{' + ','.join(pairs) + '}' if pairs else ''
+                lines.append(f'{self.name}_sum{suffix} {total}')
+                lines.append(f'{self.name}_count{suffix} {count}')
+        return lines
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for labels, value in self.values.items():
+                pairs = ','.join(f'{k}="{v}"' for k, v in zip(self.labelnames, labels))
+                lines.append(f'{self.name}{{{pairs}}} {value}' if pairs else f'{self.name} {value}')
+        return lines
+
+HTTP_REQUEST_SECONDS = Histogram('hvm_http_request_duration_seconds', 'Panel request latency by route.', ('endpoint', 'method'))
+HTTP_RESPONSES = Counter('hvm_http_responses_total', 'Panel responses by route and status.', ('endpoint', 'status'))
+DB_LOCK_WAIT_SECONDS = Histogram('hvm_db_lock_wait_seconds', 'Time spent waiting for the database write lock.', buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+DOCKER_EXEC_SECONDS = Histogram('hvm_docker_exec_duration_seconds', 'run_docker_command duration.')
+DOCKER_EXEC_FAILURES = Counter('hvm_docker_exec_failures_total', 'run_docker_command calls that failed or timed out.')
+LOOP_CYCLE_SECONDS = Histogram('hvm_loop_cycle_seconds', 'Background loop cycle time.', ('loop',), LOOP_BUCKETS)
+PANEL_METRICS = [HTTP_REQUEST_SECONDS, HTTP_RESPONSES, DB_LOCK_WAIT_SECONDS, DOCKER_EXEC_SECONDS, DOCKER_EXEC_FAILURES, LOOP_CYCLE_SECONDS]
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = SECRET_KEY
@@ -170,43 +360,164 @@ class User(UserMixin):
         self.email = email
         self.theme = theme
 
+def iter_backup_sections(path):
+    # Yields (header, rows) with rows in batches; the same header object is
+    # repeated for every batch of its table and first appears with no rows.
+    with open(path, 'rb') as probe:
+        compressed = probe.read(2) == b'\x1f\x8b'
+    with (gzip.open(path, 'rt') if compressed else open(path)) as f:
+        try:
+            meta = json.loads(f.readline())
+        except ValueError:
+            meta = None
+        if not isinstance(meta, dict) or meta.get('format') != 'hvm-backup':
+            f.seek(0)
+            yield from legacy_backup_sections(json.load(f))
+            return
+        header, batch = None, []
+        for line in f:
+            item = json.loads(line)
+            if isinstance(item, dict):
+                if header and batch:
+                    yield header, batch
+                header, batch = item, []
+                yield header, batch
+                batch = []
+            else:
+                batch.append(item)
+                if len(batch) >= BACKUP_BATCH_SIZE:
+                    yield header, batch
+                    batch = []
+        if header and batch:
+            yield header, batch
+
+def legacy_backup_sections(data):
+    # The old single-document JSON backup: lists of row dicts, plus key/value
+    # dicts and (user_id, reason) pairs for a few tables.
+    for table, value in data.items():
+        if isinstance(value, dict):
+            columns, rows = ['key', 'value'], [list(item) for item in value.items()]
+        elif table == 'banned_users':
+            columns, rows = ['user_id', 'reason'], [list(item) for item in value]
+        else:
+            defaults = dict(LEGACY_BACKUP_DEFAULTS.get(table, {}))
+            columns = list(dict.fromkeys([key for row in value for key in row] + list(defaults)))
+            if table == 'users' and 'password' not in columns:
+                columns.append('password')
+                defaults['password'] = generate_password_hash('default')
+            rows = [[row.get(col, defaults.get(col)) for col in columns] for row in value]
+        header = {'table': table, 'mode': 'replace', 'columns': columns}
+        yield header, []
+        yield header, rows
+
 class Database:
-    def __init__(self, db_file):
+    # One write connection serialized behind self.lock plus a pool of
+    # read-only connections, so WAL readers never wait for the writer.
+    def __init__(self, db_file, read_pool_size=DB_READ_POOL_SIZE):
         self.db_file = db_file
         self.lock = threading.Lock()
         self.conn = None
-        self.cursor = None
+        self.read_pool_size = read_pool_size
+        self._readers = queue.LifoQueue()
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+        self._local = threading.local()
         self._connect()
         self._create_tables()
         self._initialize_settings()
         self._migrate_database()
 
     def _connect(self):
-        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
-        self.cursor = self.conn.cursor()
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False, timeout=DB_BUSY_TIMEOUT)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(f'PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}')
+
+    def _open_reader(self):
+        uri = f"file:{pathname2url(os.path.abspath(self.db_file))}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, timeout=DB_BUSY_TIMEOUT)
+        conn.execute(f'PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}')
+        return conn
+
+    def _acquire_reader(self):
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._reader_lock:
+            if self._reader_count < self.read_pool_size:
+                self._reader_count += 1
+                try:
+                    return self._open_reader()
+                except sqlite3.Error:
+                    self._reader_count -= 1
+                    raise
+        return self._readers.get()
 
-    def _execute(self, query, params=()):
+    def _release_reader(self, conn):
+        self._readers.put(conn)
+
+    @property
+    def cursor(self):
+        # Last cursor used by the calling thread, so callers can keep reading
+        # .description and .rowcount after _fetch*/_execute.
+        return getattr(self._local, 'cursor', None)
+
+    @contextmanager
+    def _write_lock(self):
+        started = time.perf_counter()
         with self.lock:
+            DB_LOCK_WAIT_SECONDS.observe(time.perf_counter() - started)
+            yield
+
+    def _execute(self, query, params=()):
+        with self._write_lock():
+            cursor = self.conn.cursor()
             try:
-                self.cursor.execute(query, params)
+                cursor.execute(query, params)
                 self.conn.commit()
             except sqlite3.OperationalError as e:
                 if "database is locked" in str(e):
                     time.sleep(0.1)
-                    self.cursor.execute(query, params)
+                    cursor.execute(query, params)
                     self.conn.commit()
                 else:
                     raise
+            self._local.cursor = cursor
+
+    def _executemany(self, query, seq_of_params):
+        with self.transaction() as cursor:
+            cursor.executemany(query, seq_of_params)
+
+    @contextmanager
+    def transaction(self):
+        with self._write_lock():
+            cursor = self.conn.cursor()
+            try:
+                yield cursor
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            finally:
+                self._local.cursor = cursor
+
+    def _read(self, query, params, fetch):
+        conn = self._acquire_reader()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            rows = fetch(cursor)
+            self._local.cursor = cursor
+            return rows
+        finally:
+            self._release_reader(conn)
 
     def _fetchone(self, query, params=()):
-        with self.lock:
-            self.cursor.execute(query, params)
-            return self.cursor.fetchone()
+        return self._read(query, params, lambda cursor: cursor.fetchone())
 
     def _fetchall(self, query, params=()):
-        with self.lock:
-            self.cursor.execute(query, params)
-            return self.cursor.fetchall()
+        return self._read(query, params, lambda cursor: cursor.fetchall())
 
     def _create_tables(self):
         self._execute('''
@@ -254,6 +565,8 @@ class Database:
             )
         ''')
 
+        self._execute('CREATE INDEX IF NOT EXISTS idx_vps_instances_container_id ON vps_instances (container_id)')
+
         self._execute('''
             CREATE TABLE IF NOT EXISTS usage_stats (
                 key TEXT PRIMARY KEY,
@@ -332,6 +645,79 @@ class Database:
             )
         ''')
 
+        self._execute('CREATE INDEX IF NOT EXISTS idx_resource_history_vps_ts ON resource_history (vps_id, timestamp)')
+
+        self._execute('''
+            CREATE TABLE IF NOT EXISTS resource_rollups (
+                vps_id TEXT,
+                resolution TEXT,
+                bucket TEXT,
+                cpu_percent REAL,
+                memory_percent REAL,
+                disk_usage REAL,
+                bandwidth_in REAL,
+                bandwidth_out REAL,
+                samples INTEGER DEFAULT 0,
+                revision INTEGER DEFAULT 0,
+                PRIMARY KEY (vps_id, resolution, bucket)
+            )
+        ''')
+
+        self._execute('''
+            CREATE TABLE IF NOT EXISTS warm_pool (
+                container_id TEXT PRIMARY KEY,
+                vps_id TEXT UNIQUE,
+                image_tag TEXT,
+                os_image TEXT,
+                memory INTEGER,
+                cpu INTEGER,
+                port INTEGER,
+                created_at TEXT
+            )
+        ''')
+
+        self._execute('''
+            CREATE TABLE IF NOT EXISTS port_allocations (
+                host_port INTEGER NOT NULL,
+                protocol TEXT NOT NULL DEFAULT 'tcp',
+                vps_id TEXT NOT NULL,
+                purpose TEXT NOT NULL,
+                container_port INTEGER,
+                created_at TEXT,
+                PRIMARY KEY (host_port, protocol)
+            )
+        ''')
+        self._execute('CREATE INDEX IF NOT EXISTS idx_port_allocations_vps_id ON port_allocations (vps_id)')
+
+        self._execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                type TEXT NOT NULL,
+                vps_id TEXT,
+                status TEXT DEFAULT 'pending',
+                params TEXT,
+                state TEXT,
+                steps TEXT,
+                result TEXT,
+                error TEXT,
+                created_by INTEGER,
+                created_at TEXT,
+                updated_at TEXT
+            )
+        ''')
+        self._execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)')
+
+        self._execute('''
+            CREATE TABLE IF NOT EXISTS backup_state (
+                chain TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                last_id INTEGER,
+                digest TEXT,
+                updated_at TEXT,
+                PRIMARY KEY (chain, table_name)
+            )
+        ''')
+
         self._execute('''
             CREATE TABLE IF NOT EXISTS vps_groups (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -415,6 +801,11 @@ class Database:
         if 'reason' not in banned_columns:
             self._execute('ALTER TABLE banned_users ADD COLUMN reason TEXT DEFAULT "No reason provided"')
 
+        rollup_columns = [col[1] for col in self._fetchall("PRAGMA table_info(resource_rollups)")]
+        if 'revision' not in rollup_columns:
+            self._execute('ALTER TABLE resource_rollups ADD COLUMN revision INTEGER DEFAULT 0')
+        self._execute('CREATE INDEX IF NOT EXISTS idx_resource_rollups_revision ON resource_rollups (revision)')
+
     def _initialize_settings(self):
         defaults = {
             'max_containers': str(MAX_CONTAINERS),
@@ -451,6 +842,58 @@ class Database:
         current = self.get_stat(key)
         self._execute('INSERT OR REPLACE INTO usage_stats (key, value) VALUES (?, ?)', (key, current + amount))
 
+    def set_stat(self, key, value):
+        self._execute('INSERT OR REPLACE INTO usage_stats (key, value) VALUES (?, ?)', (key, value))
+
+    def add_pool_container(self, entry):
+        columns = ', '.join(entry.keys())
+        placeholders = ', '.join('?' for _ in entry)
+        self._execute(f'INSERT INTO warm_pool ({columns}) VALUES ({placeholders})', tuple(entry.values()))
+
+    def get_pool_containers(self, os_image=None, memory=None, cpu=None):
+        if os_image is None:
+            rows = self._fetchall('SELECT * FROM warm_pool')
+        else:
+            rows = self._fetchall('SELECT * FROM warm_pool WHERE os_image = ? AND memory = ? AND cpu = ?', (os_image, memory, cpu))
+        columns = [desc[0] for desc in self.cursor.description]
+        return [dict(zip(columns, row)) for row in rows]
+
+    def claim_pool_container(self, os_image, memory, cpu):
+        with self.transaction() as cursor:
+            cursor.execute('SELECT * FROM warm_pool WHERE os_image = ? AND memory = ? AND cpu = ? ORDER BY created_at LIMIT 1', (os_image, memory, cpu))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            entry = dict(zip([desc[0] for desc in cursor.description], row))
+            cursor.execute('DELETE FROM warm_pool WHERE container_id = ?', (entry['container_id'],))
+            return entry
+
+    def remove_pool_container(self, container_id):
+        self._execute('DELETE FROM warm_pool WHERE container_id = ?', (container_id,))
+
+    def get_port_allocations(self, vps_id=None):
+        if vps_id is None:
+            rows = self._fetchall('SELECT * FROM port_allocations')
+        else:
+            rows = self._fetchall('SELECT * FROM port_allocations WHERE vps_id = ?', (vps_id,))
+        columns = [desc[0] for desc in self.cursor.description]
+        return [dict(zip(columns, row)) for row in rows]
+
+    def replace_port_allocations(self, vps_id, purpose, mappings):
+        now = str(datetime.datetime.now())
+        with self.transaction() as cursor:
+            cursor.execute('DELETE FROM port_allocations WHERE vps_id = ? AND purpose = ?', (vps_id, purpose))
+            cursor.executemany(
+                'INSERT INTO port_allocations (host_port, protocol, vps_id, purpose, container_port, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                [(host, protocol, vps_id, purpose, cont, now) for host, cont, protocol in mappings]
+            )
+
+    def remove_port_allocations(self, vps_id):
+        self._execute('DELETE FROM port_allocations WHERE vps_id = ?', (vps_id,))
+
+    def clear_port_allocations(self):
+        self._execute('DELETE FROM port_allocations')
+
     def get_user(self, username):
         row = self._fetchone('SELECT * FROM users WHERE username = ?', (username,))
         if row:
@@ -506,6 +949,13 @@ class Database:
             return dict(zip(columns, row))
         return None
 
+    def get_vps_by_container_id(self, container_id):
+        row = self._fetchone('SELECT * FROM vps_instances WHERE container_id = ?', (container_id,))
+        if row:
+            columns = [desc[0] for desc in self.cursor.description]
+            return dict(zip(columns, row))
+        return None
+
     def get_user_vps_count(self, user_id):
         result = self._fetchone('SELECT COUNT(*) FROM vps_instances WHERE created_by = ?', (user_id,))
         return result[0]
@@ -605,15 +1055,96 @@ class Database:
         columns = [desc[0] for desc in self.cursor.description]
         return [dict(zip(columns, row)) for row in rows]
 
+    def add_job(self, job_data):
+        columns = ', '.join(job_data.keys())
+        placeholders = ', '.join('?' for _ in job_data)
+        self._execute(f'INSERT INTO jobs ({columns}) VALUES ({placeholders})', tuple(job_data.values()))
+
+    def get_job(self, job_id):
+        row = self._fetchone('SELECT * FROM jobs WHERE id = ?', (job_id,))
+        if row:
+            columns = [desc[0] for desc in self.cursor.description]
+            return dict(zip(columns, row))
+        return None
+
+    def get_jobs_by_status(self, statuses):
+        placeholders = ', '.join('?' for _ in statuses)
+        rows = self._fetchall(f'SELECT * FROM jobs WHERE status IN ({placeholders}) ORDER BY created_at', tuple(statuses))
+        columns = [desc[0] for desc in self.cursor.description]
+        return [dict(zip(columns, row)) for row in rows]
+
+    def update_job(self, job_id, updates):
+        updates = dict(updates, updated_at=str(datetime.datetime.now()))
+        set_clause = ', '.join(f'{k} = ?' for k in updates)
+        self._execute(f'UPDATE jobs SET {set_clause} WHERE id = ?', tuple(updates.values()) + (job_id,))
+
     def add_resource_history(self, vps_id, cpu, mem, disk, band_in, band_out):
         self._execute('INSERT INTO resource_history (vps_id, cpu_percent, memory_percent, disk_usage, bandwidth_in, bandwidth_out, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)',
                       (vps_id, cpu, mem, disk, band_in, band_out, str(datetime.datetime.now())))
 
+    def add_resource_history_batch(self, rows):
+        if rows:
+            self._executemany('INSERT INTO resource_history (vps_id, cpu_percent, memory_percent, disk_usage, bandwidth_in, bandwidth_out, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
     def get_resource_history(self, vps_id, limit=100):
         rows = self._fetchall('SELECT * FROM resource_history WHERE vps_id = ? ORDER BY timestamp DESC LIMIT ?', (vps_id, limit))
         columns = [desc[0] for desc in self.cursor.description]
         return [dict(zip(columns, row)) for row in rows]
 
+    def get_resource_rollups(self, vps_id, resolution='minute', limit=100):
+        rows = self._fetchall('SELECT * FROM resource_rollups WHERE vps_id = ? AND resolution = ? ORDER BY bucket DESC LIMIT ?', (vps_id, resolution, limit))
+        columns = [desc[0] for desc in self.cursor.description]
+        return [dict(zip(columns, row)) for row in rows]
+
+    def compact_resource_history(self, now=None):
+        # Timestamps are str(datetime) values, so a bucket is a prefix of them:
+        # 16 chars -> minute, 13 -> hour, 10 -> day. Cutoffs are aligned to the
+        # target bucket size so only complete buckets are ever rolled up.
+        now = now or datetime.datetime.now()
+        raw_cutoff = str(now - datetime.timedelta(hours=HISTORY_RAW_RETENTION_HOURS))[:16]
+        minute_cutoff = str(now - datetime.timedelta(days=HISTORY_MINUTE_RETENTION_DAYS))[:13]
+        hour_cutoff = str(now - datetime.timedelta(days=HISTORY_HOUR_RETENTION_DAYS))[:10]
+        day_cutoff = str(now - datetime.timedelta(days=HISTORY_DAY_RETENTION_DAYS))[:10]
+        upsert = '''
+            ON CONFLICT (vps_id, resolution, bucket) DO UPDATE SET
+                cpu_percent = (cpu_percent * samples + excluded.cpu_percent * excluded.samples) / (samples + excluded.samples),
+                memory_percent = (memory_percent * samples + excluded.memory_percent * excluded.samples) / (samples + excluded.samples),
+                disk_usage = (disk_usage * samples + excluded.disk_usage * excluded.samples) / (samples + excluded.samples),
+                bandwidth_in = MAX(bandwidth_in, excluded.bandwidth_in),
+                bandwidth_out = MAX(bandwidth_out, excluded.bandwidth_out),
+                samples = samples + excluded.samples,
+                revision = excluded.revision
+        '''
+        with self.transaction() as cursor:
+            # Every rollup written by this pass gets the same new revision,
+            # which incremental backups use as their watermark.
+            cursor.execute("INSERT INTO usage_stats (key, value) VALUES ('rollup_revision', 1) ON CONFLICT (key) DO UPDATE SET value = value + 1")
+            revision = cursor.execute("SELECT value FROM usage_stats WHERE key = 'rollup_revision'").fetchone()[0]
+            cursor.execute(f'''
+                INSERT INTO resource_rollups (vps_id, resolution, bucket, cpu_percent, memory_percent, disk_usage, bandwidth_in, bandwidth_out, samples, revision)
+                SELECT vps_id, 'minute', substr(timestamp, 1, 16), AVG(cpu_percent), AVG(memory_percent), AVG(disk_usage),
+                       MAX(bandwidth_in), MAX(bandwidth_out), COUNT(*), ?
+                FROM resource_history WHERE timestamp < ? GROUP BY vps_id, substr(timestamp, 1, 16)
+                {upsert}
+            ''', (revision, raw_cutoff))
+            cursor.execute('DELETE FROM resource_history WHERE timestamp < ?', (raw_cutoff,))
+            for source, target, length, cutoff in (('minute', 'hour', 13, minute_cutoff), ('hour', 'day', 10, hour_cutoff)):
+                cursor.execute(f'''
+                    INSERT INTO resource_rollups (vps_id, resolution, bucket, cpu_percent, memory_percent, disk_usage, bandwidth_in, bandwidth_out, samples, revision)
+                    SELECT vps_id, ?, substr(bucket, 1, {length}), SUM(cpu_percent * samples) / SUM(samples),
+                           SUM(memory_percent * samples) / SUM(samples), SUM(disk_usage * samples) / SUM(samples),
+                           MAX(bandwidth_in), MAX(bandwidth_out), SUM(samples), ?
+                    FROM resource_rollups WHERE resolution = ? AND bucket < ? GROUP BY vps_id, substr(bucket, 1, {length})
+                    {upsert}
+                ''', (target, revision, source, cutoff))
+                cursor.execute('DELETE FROM resource_rollups WHERE resolution = ? AND bucket < ?', (source, cutoff))
+            cursor.execute("DELETE FROM resource_rollups WHERE resolution = 'day' AND bucket < ?", (day_cutoff,))
+        # PASSIVE copies what it can without waiting on readers; TRUNCATE
+        # would hold the write lock for up to the busy timeout while a
+        # backup's snapshot is open.
+        with self.lock:
+            self.conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+
     def add_group(self, name, desc):
         self._execute('INSERT INTO vps_groups (name, description) VALUES (?, ?)', (name, desc))
 
@@ -646,128 +1177,153 @@ class Database:
     def increment_referred(self, user_id):
         self._execute('UPDATE referrals SET referred_users = referred_users + 1 WHERE user_id = ?', (user_id,))
 
-    def backup_data(self):
-        data = {
-            'users': self.get_all_users(),
-            'vps_instances': list(self.get_all_vps().values()),
-            'usage_stats': {row[0]: row[1] for row in self._fetchall('SELECT * FROM usage_stats')},
-            'system_settings': {row[0]: row[1] for row in self._fetchall('SELECT * FROM system_settings')},
-            'banned_users': [(row[0], row[1]) for row in self._fetchall('SELECT * FROM banned_users')],
-            'docker_images': [dict(zip([desc[0] for desc in self.cursor.description], row)) for row in self._fetchall('SELECT * FROM docker_images')],
-            'notifications': [dict(zip([desc[0] for desc in self.cursor.description], row)) for row in self._fetchall('SELECT * FROM notifications')],
-            'audit_logs': [dict(zip([desc[0] for desc in self.cursor.description], row)) for row in self._fetchall('SELECT * FROM audit_logs')],
-            'vps_templates': [dict(zip([desc[0] for desc in self.cursor.description], row)) for row in self._fetchall('SELECT * FROM vps_templates')],
-            'resource_history': [dict(zip([desc[0] for desc in self.cursor.description], row)) for row in self._fetchall('SELECT * FROM resource_history')],
-            'vps_groups': [dict(zip([desc[0] for desc in self.cursor.description], row)) for row in self._fetchall('SELECT * FROM vps_groups')],
-            'vps_group_assignments': [dict(zip([desc[0] for desc in self.cursor.description], row)) for row in self._fetchall('SELECT * FROM vps_group_assignments')],
-            'support_tickets': [dict(zip([desc[0] for desc in self.cursor.description], row)) for row in self._fetchall('SELECT * FROM support_tickets')],
-            'referrals': [dict(zip([desc[0] for desc in self.cursor.description], row)) for row in self._fetchall('SELECT * FROM referrals')],
-            'licenses': [dict(zip([desc[0] for desc in self.cursor.description], row)) for row in self._fetchall('SELECT * FROM licenses')]
+    @contextmanager
+    def read_snapshot(self):
+        # One read transaction on a pooled reader: every query inside sees the
+        # same WAL snapshot and writers are never blocked.
+        conn = self._acquire_reader()
+        try:
+            conn.execute('BEGIN')
+            yield conn
+        finally:
+            conn.rollback()
+            self._release_reader(conn)
+
+    def _record_throughput(self, prefix, seconds, rows, size):
+        stats = {
+            f'{prefix}_last_ms': int(seconds * 1000),
+            f'{prefix}_last_rows': rows,
+            f'{prefix}_last_bytes': size,
+            f'{prefix}_rows_per_sec': int(rows / seconds) if seconds else rows
         }
-        with open(BACKUP_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
-        return True
-
-    def restore_data(self):
-        if not os.path.exists(BACKUP_FILE):
+        self._executemany('INSERT OR REPLACE INTO usage_stats (key, value) VALUES (?, ?)', list(stats.items()))
+
+    def backup_data(self, path=BACKUP_FILE, incremental=False, chain='manual'):
+        # Streams every table as gzipped NDJSON: a header object per table
+        # followed by one JSON array per row. Incremental backups carry only
+        # new rows of the append-only tables and the other tables whose
+        # contents changed since the previous backup of the same chain.
+        started = time.perf_counter()
+        state = {row[0]: (row[1], row[2]) for row in self._fetchall('SELECT table_name, last_id, digest FROM backup_state WHERE chain = ?', (chain,))}
+        incremental = incremental and bool(state)
+        kind = 'incremental' if incremental else 'full'
+        new_state = []
+        rows_written = 0
+        tmp_path = f'{path}.tmp'
+        try:
+            with self.read_snapshot() as conn, gzip.open(tmp_path, 'wt', compresslevel=6) as f:
+                f.write(json.dumps({'format': 'hvm-backup', 'version': 1, 'kind': kind, 'created_at': str(datetime.datetime.now())}) + '\n')
+                for table in BACKUP_TABLES:
+                    last_id, digest = state.get(table, (0, None)) if incremental else (0, None)
+                    last_id = last_id or 0
+                    if table in BACKUP_APPEND_TABLES:
+                        min_id, max_id = conn.execute(f'SELECT MIN(id), MAX(id) FROM {table}').fetchone()
+                        cursor = conn.execute(f'SELECT * FROM {table} WHERE id > ? ORDER BY id', (last_id,))
+                        header = {'table': table, 'mode': 'append' if incremental else 'replace', 'min_id': min_id if min_id is not None else last_id + 1}
+                        new_state.append((chain, table, max(max_id or 0, last_id), None))
+                    elif table in BACKUP_REVISION_TABLES:
+                        max_revision = conn.execute(f'SELECT MAX(revision) FROM {table}').fetchone()[0] or 0
+                        cursor = conn.execute(f'SELECT * FROM {table} WHERE revision > ?', (last_id,))
+                        # The oldest bucket kept per resolution tells restore
+                        # what retention has pruned since the last backup.
+                        header = {'table': table, 'mode': 'upsert' if incremental else 'replace',
+                                  'min_buckets': dict(conn.execute(f'SELECT resolution, MIN(bucket) FROM {table} GROUP BY resolution').fetchall())}
+                        new_state.append((chain, table, max(max_revision, last_id), None))
+                    else:
+                        # Spool the section while hashing it row by row, and
+                        # only copy it into the backup if the digest changed.
+                        cursor = conn.execute(f'SELECT * FROM {table}')
+                        sha = hashlib.sha1()
+                        section_rows = 0
+                        with tempfile.TemporaryFile('w+') as section:
+                            for row in cursor:
+                                line = json.dumps(row) + '\n'
+                                sha.update(line.encode())
+                                section.write(line)
+                                section_rows += 1
+                            table_digest = sha.hexdigest()
+                            new_state.append((chain, table, None, table_digest))
+                            if table_digest == digest:
+                                continue
+                            header = {'table': table, 'mode': 'replace', 'columns': [desc[0] for desc in cursor.description]}
+                            f.write(json.dumps(header) + '\n')
+                            section.seek(0)
+                            shutil.copyfileobj(section, f)
+                        rows_written += section_rows
+                        continue
+                    header['columns'] = [desc[0] for desc in cursor.description]
+                    f.write(json.dumps(header) + '\n')
+                    for row in cursor:
+                        f.write(json.dumps(row) + '\n')
+                        rows_written += 1
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"Backup error: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+
+        now = str(datetime.datetime.now())
+        with self.transaction() as cursor:
+            cursor.execute('DELETE FROM backup_state WHERE chain = ?', (chain,))
+            cursor.executemany('INSERT INTO backup_state (chain, table_name, last_id, digest, updated_at) VALUES (?, ?, ?, ?, ?)',
+                               [entry + (now,) for entry in new_state])
+        seconds = time.perf_counter() - started
+        size = os.path.getsize(path)
+        self._record_throughput('backup', seconds, rows_written, size)
+        logger.info(f"{kind.capitalize()} backup: {rows_written} rows, {size} bytes in {seconds:.2f}s ({rows_written / max(seconds, 1e-6):.0f} rows/s)")
+        return {'path': path, 'kind': kind, 'rows': rows_written, 'bytes': size, 'seconds': seconds}
+
+    def restore_data(self, paths=(BACKUP_FILE,)):
+        # Applies a full backup and any incrementals after it, in order, in a
+        # single transaction.
+        if isinstance(paths, str):
+            paths = [paths]
+        if not paths or not all(os.path.exists(path) for path in paths):
             return False
-       
-        with open(BACKUP_FILE, 'r') as f:
-            data = json.load(f)
-       
+
+        started = time.perf_counter()
+        rows_restored = 0
         try:
-            self._execute('DELETE FROM users')
-            for user in data.get('users', []):
-                hashed = user.get('password', generate_password_hash('default'))
-                self._execute('INSERT INTO users (id, username, password, role, email, created_at, theme) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                              (user['id'], user['username'], hashed, user['role'], user.get('email'), user['created_at'], user.get('theme', 'light')))
-           
-            self._execute('DELETE FROM vps_instances')
-            for vps in data.get('vps_instances', []):
-                vps['additional_ports'] = vps.get('additional_ports', '')
-                vps['bandwidth_limit'] = vps.get('bandwidth_limit', 0)
-                vps['tags'] = vps.get('tags', '')
-                columns = ', '.join(vps.keys())
-                placeholders = ', '.join('?' for _ in vps)
-                self._execute(f'INSERT INTO vps_instances ({columns}) VALUES ({placeholders})', tuple(vps.values()))
-           
-            self._execute('DELETE FROM usage_stats')
-            for k, v in data.get('usage_stats', {}).items():
-                self._execute('INSERT INTO usage_stats (key, value) VALUES (?, ?)', (k, v))
-           
-            self._execute('DELETE FROM system_settings')
-            for k, v in data.get('system_settings', {}).items():
-                self._execute('INSERT INTO system_settings (key, value) VALUES (?, ?)', (k, v))
-           
-            self._execute('DELETE FROM banned_users')
-            for uid, reason in data.get('banned_users', []):
-                self._execute('INSERT INTO banned_users (user_id, reason) VALUES (?, ?)', (uid, reason))
-           
-            self._execute('DELETE FROM docker_images')
-            for img in data.get('docker_images', []):
-                columns = ', '.join(img.keys())
-                placeholders = ', '.join('?' for _ in img)
-                self._execute(f'INSERT INTO docker_images ({columns}) VALUES ({placeholders})', tuple(img.values()))
-           
-            self._execute('DELETE FROM notifications')
-            for notif in data.get('notifications', []):
-                columns = ', '.join(notif.keys())
-                placeholders = ', '.join('?' for _ in notif)
-                self._execute(f'INSERT INTO notifications ({columns}) VALUES ({placeholders})', tuple(notif.values()))
-           
-            self._execute('DELETE FROM audit_logs')
-            for log in data.get('audit_logs', []):
-                columns = ', '.join(log.keys())
-                placeholders = ', '.join('?' for _ in log)
-                self._execute(f'INSERT INTO audit_logs ({columns}) VALUES ({placeholders})', tuple(log.values()))
-           
-            self._execute('DELETE FROM vps_templates')
-            for temp in data.get('vps_templates', []):
-                columns = ', '.join(temp.keys())
-                placeholders = ', '.join('?' for _ in temp)
-                self._execute(f'INSERT INTO vps_templates ({columns}) VALUES ({placeholders})', tuple(temp.values()))
-           
-            self._execute('DELETE FROM resource_history')
-            for hist in data.get('resource_history', []):
-                columns = ', '.join(hist.keys())
-                placeholders = ', '.join('?' for _ in hist)
-                self._execute(f'INSERT INTO resource_history ({columns}) VALUES ({placeholders})', tuple(hist.values()))
-           
-            self._execute('DELETE FROM vps_groups')
-            for group in data.get('vps_groups', []):
-                columns = ', '.join(group.keys())
-                placeholders = ', '.join('?' for _ in group)
-                self._execute(f'INSERT INTO vps_groups ({columns}) VALUES ({placeholders})', tuple(group.values()))
-           
-            self._execute('DELETE FROM vps_group_assignments')
-            for assign in data.get('vps_group_assignments', []):
-                columns = ', '.join(assign.keys())
-                placeholders = ', '.join('?' for _ in assign)
-                self._execute(f'INSERT INTO vps_group_assignments ({columns}) VALUES ({placeholders})', tuple(assign.values()))
-           
-            self._execute('DELETE FROM support_tickets')
-            for ticket in data.get('support_tickets', []):
-                columns = ', '.join(ticket.keys())
-                placeholders = ', '.join('?' for _ in ticket)
-                self._execute(f'INSERT INTO support_tickets ({columns}) VALUES ({placeholders})', tuple(ticket.values()))
-
-            self._execute('DELETE FROM referrals')
-            for ref in data.get('referrals', []):
-                columns = ', '.join(ref.keys())
-                placeholders = ', '.join('?' for _ in ref)
-                self._execute(f'INSERT INTO referrals ({columns}) VALUES ({placeholders})', tuple(ref.values()))
-
-            self._execute('DELETE FROM licenses')
-            for lic in data.get('licenses', []):
-                columns = ', '.join(lic.keys())
-                placeholders = ', '.join('?' for _ in lic)
-                self._execute(f'INSERT INTO licenses ({columns}) VALUES ({placeholders})', tuple(lic.values()))
-           
-            return True
+            with self.transaction() as cursor:
+                schema = {table: [col[1] for col in cursor.execute(f'PRAGMA table_info({table})').fetchall()] for table in BACKUP_TABLES}
+                for path in paths:
+                    current, insert, keep = None, None, None
+                    for header, batch in iter_backup_sections(path):
+                        if header is not current:
+                            current = header
+                            table = header.get('table')
+                            if table not in schema:
+                                insert = None
+                                continue
+                            keep = [i for i, col in enumerate(header['columns']) if col in schema[table]]
+                            columns = [header['columns'][i] for i in keep]
+                            if header.get('mode') == 'append':
+                                cursor.execute(f'DELETE FROM {table} WHERE id < ?', (header['min_id'],))
+                            elif header.get('mode') == 'upsert':
+                                # Replay retention, then upsert the changed rows.
+                                min_buckets = header.get('min_buckets', {})
+                                cursor.execute(f"DELETE FROM {table} WHERE resolution NOT IN ({', '.join('?' for _ in min_buckets)})", tuple(min_buckets))
+                                cursor.executemany(f'DELETE FROM {table} WHERE resolution = ? AND bucket < ?', list(min_buckets.items()))
+                            else:
+                                cursor.execute(f'DELETE FROM {table}')
+                            insert = f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+                            if len(keep) == len(header['columns']):
+                                keep = None
+                        if insert and batch:
+                            cursor.executemany(insert, batch if keep is None else [[row[i] for i in keep] for row in batch])
+                            rows_restored += len(batch)
+                # Watermarks describe the data that was just replaced.
+                cursor.execute('DELETE FROM backup_state')
         except Exception as e:
             logger.error(f"Restore error: {e}")
             return False
 
+        seconds = time.perf_counter() - started
+        self._record_throughput('restore', seconds, rows_restored, sum(os.path.getsize(path) for path in paths))
+        logger.info(f"Restore: {rows_restored} rows from {len(paths)} file(s) in {seconds:.2f}s ({rows_restored / max(seconds, 1e-6):.0f} rows/s)")
+        return True
+
     def add_license(self, license_key, expires_at):
         created_at = str(datetime.datetime.now())
         self._execute('INSERT OR REPLACE INTO licenses (license_key, created_at, expires_at) VALUES (?, ?, ?)', (license_key, created_at, expires_at))
@@ -791,6 +1347,11 @@ class Database:
         return [dict(zip(columns, row)) for row in rows]
 
     def close(self):
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
         self.conn.close()
 
 db = Database(DB_FILE)
@@ -811,6 +1372,27 @@ vps_stats_cache = {}
 console_sessions = {}
 image_build_lock = threading.Lock()
 resource_history = {vps_id: deque(maxlen=3600) for vps_id in db.get_all_vps()}
+resource_history_buffer = []
+resource_history_buffer_lock = threading.Lock()
+warm_pool_event = threading.Event()
+provision_times = deque(maxlen=500)
+container_stats = {}
+stats_streams = {}
+stats_streams_lock = threading.Lock()
+stats_client = None
+stats_client_pool_size = 0
+internal_stats_cache = {}
+internal_stats_locks = {}
+file_list_cache = {}  # vps_id -> OrderedDict(path -> (expires, entries)), least recent first
+file_list_lock = threading.Lock()
+node_metrics = {}
+node_metrics_lock = threading.Lock()
+exporter_access = set()
+network_gateway = None
+job_executor = concurrent.futures.ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='hvm-job')
+vps_job_queues = {}  # vps_id -> job ids waiting behind the one running
+vps_job_queues_lock = threading.Lock()
+port_forward_lock = threading.Lock()
 
 def generate_token():
     return str(uuid.uuid4())
@@ -826,6 +1408,10 @@ def is_admin(user):
     user_data = db.get_user_by_id(user.id)
     return user_data['role'] == 'admin' if user_data else False
 
+def wants_html():
+    # Browser navigations list text/html first; fetch() and API clients send */* or JSON.
+    return request.accept_mimetypes.best_match(['application/json', 'text/html']) == 'text/html'
+
 def admin_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -847,16 +1433,102 @@ def run_command(command, timeout=30):
     except Exception as e:
         return False, "", str(e)
 
-def run_docker_command(container_id, command, timeout=1200):
+def kill_exec(container_id, exec_id, tag):
+    # The command leads its own session inside the container (see
+    # exec_in_container), so killing that session from a second exec takes
+    # its children with it. The [h] keeps pgrep from matching this script.
+    script = (f"command -v pkill >/dev/null || exit 127; "
+              f"for pid in $(pgrep -f '[h]{tag[1:]}'); do pkill -KILL -s $pid; kill -KILL $pid; done 2>/dev/null; exit 0")
+    try:
+        killer = docker_client.api.exec_create(container_id, ['sh', '-c', script])['Id']
+        docker_client.api.exec_start(killer)
+        if docker_client.api.exec_inspect(killer).get('ExitCode') == 0:
+            return
+    except Exception as e:
+        logger.warning(f"In-container kill of exec {exec_id[:12]} failed: {e}")
+    # Without pkill in the image, fall back to the host PID, but only when
+    # the panel shares the host's PID namespace and the PID is still ours.
+    try:
+        pid = docker_client.api.exec_inspect(exec_id).get('Pid')
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            if tag.encode() in f.read():
+                os.kill(pid, signal.SIGKILL)
+    except (OSError, docker.errors.APIError) as e:
+        logger.warning(f"Could not kill timed out exec {exec_id[:12]}: {e}")
+
+def run_docker_command(container_id, command, timeout=DOCKER_EXEC_TIMEOUT, max_output=DOCKER_EXEC_MAX_OUTPUT, on_output=None):
+    with DOCKER_EXEC_SECONDS.time():
+        result = exec_in_container(container_id, command, timeout, max_output, on_output)
+    if not result[0]:
+        DOCKER_EXEC_FAILURES.inc()
+    return result
+
+def exec_in_container(container_id, command, timeout, max_output, on_output):
+    # Exec through the Engine API on the client's pooled connection rather
+    # than forking the docker CLI. Output is read frame by frame as it
+    # arrives, each stream is capped at max_output bytes and the whole call
+    # is bounded by timeout seconds.
     if isinstance(command, str):
         command = shlex.split(command)
+    # Run under its own session, tagged in the leader's command line, so a
+    # timed-out command and everything it started can be killed.
+    tag = f'hvm-exec-{uuid.uuid4().hex}'
+    command = ['setsid', '-w', 'sh', '-c', '"$@"', tag] + list(command)
+    deadline = time.monotonic() + timeout
+    buffers = {1: bytearray(), 2: bytearray()}
+    # Frames split multi-byte characters; decode each stream incrementally.
+    decoders = {stream: codecs.getincrementaldecoder('utf-8')(errors='replace') for stream in buffers}
+    truncated = False
     try:
-        result = subprocess.run(["docker", "exec", container_id] + command, capture_output=True, text=True, timeout=timeout, check=True)
-        return True, result.stdout, result.stderr
-    except subprocess.CalledProcessError as e:
-        return False, e.stdout, e.stderr
-    except subprocess.TimeoutExpired:
-        return False, "", "Timeout"
+        exec_id = docker_client.api.exec_create(container_id, command, stdout=True, stderr=True)['Id']
+        sock = docker_client.api.exec_start(exec_id, socket=True)
+        raw = getattr(sock, '_sock', sock)
+        pending = bytearray()
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise socket.timeout()
+                raw.settimeout(remaining)
+                chunk = raw.recv(65536)
+                if not chunk:
+                    break
+                pending += chunk
+                # Multiplexed stream: 8-byte header (stream id, 3 pad bytes,
+                # big-endian payload length) followed by the payload.
+                while len(pending) >= 8:
+                    size = struct.unpack('>I', pending[4:8])[0]
+                    if len(pending) < 8 + size:
+                        break
+                    stream = pending[0] if pending[0] in buffers else 1
+                    payload = bytes(pending[8:8 + size])
+                    del pending[:8 + size]
+                    if on_output:
+                        text = decoders[stream].decode(payload)
+                        if text:
+                            on_output(stream, text)
+                    buf = buffers[stream]
+                    room = max_output - len(buf)
+                    if room > 0:
+                        buf += payload[:room]
+                    if len(payload) > room:
+                        truncated = True
+        except socket.timeout:
+            kill_exec(container_id, exec_id, tag)
+            return False, buffers[1].decode('utf-8', errors='replace'), "Timeout"
+        finally:
+            sock.close()
+        if on_output:
+            for stream, decoder in decoders.items():
+                text = decoder.decode(b'', final=True)
+                if text:
+                    on_output(stream, text)
+        exit_code = docker_client.api.exec_inspect(exec_id).get('ExitCode')
+        stdout = buffers[1].decode('utf-8', errors='replace')
+        stderr = buffers[2].decode('utf-8', errors='replace')
+        if truncated:
+            stderr += f"\n[output truncated at {max_output} bytes]"
+        return exit_code == 0, stdout, stderr
     except Exception as e:
         return False, "", str(e)
 
@@ -883,24 +1555,358 @@ def update_system_stats():
     except Exception as e:
         logger.error(f"System stats error: {e}")
 
+def queue_resource_history(vps_id, cpu, mem, disk, band_in, band_out):
+    with resource_history_buffer_lock:
+        resource_history_buffer.append((vps_id, cpu, mem, disk, band_in, band_out, str(datetime.datetime.now())))
+
+def flush_resource_history():
+    global resource_history_buffer
+    with resource_history_buffer_lock:
+        rows, resource_history_buffer = resource_history_buffer, []
+    try:
+        db.add_resource_history_batch(rows)
+    except sqlite3.Error as e:
+        logger.error(f"Resource history flush error ({len(rows)} rows dropped): {e}")
+
+def calculate_cpu_percent(stats):
+    cpu_stats = stats.get('cpu_stats', {})
+    precpu_stats = stats.get('precpu_stats', {})
+    cpu_delta = cpu_stats.get('cpu_usage', {}).get('total_usage', 0) - precpu_stats.get('cpu_usage', {}).get('total_usage', 0)
+    system_delta = cpu_stats.get('system_cpu_usage', 0) - precpu_stats.get('system_cpu_usage', 0)
+    online_cpus = cpu_stats.get('online_cpus') or len(cpu_stats.get('cpu_usage', {}).get('percpu_usage') or []) or 1
+    if cpu_delta <= 0 or system_delta <= 0:
+        return 0.0
+    return cpu_delta / system_delta * online_cpus * 100
+
+def calculate_memory_usage(stats):
+    # Same accounting as `docker stats`: page cache that can be reclaimed is not "used".
+    mem_stats = stats.get('memory_stats', {})
+    details = mem_stats.get('stats', {})
+    cache = details.get('inactive_file', details.get('total_inactive_file', 0))
+    usage = max(mem_stats.get('usage', 0) - cache, 0)
+    return usage, mem_stats.get('limit', 0) or 1
+
+def summarize_stats_sample(stats):
+    mem_usage, mem_limit = calculate_memory_usage(stats)
+    networks = stats.get('networks') or {}
+    blkio = (stats.get('blkio_stats') or {}).get('io_service_bytes_recursive') or []
+    return {
+        'time': time.time(),
+        'read': stats.get('read'),
+        'cpu_percent': calculate_cpu_percent(stats),
+        'memory_usage': mem_usage,
+        'memory_limit': mem_limit,
+        'net_rx': sum(iface.get('rx_bytes', 0) for iface in networks.values()),
+        'net_tx': sum(iface.get('tx_bytes', 0) for iface in networks.values()),
+        'disk_read': sum(entry.get('value', 0) for entry in blkio if entry.get('op', '').lower() == 'read'),
+        'disk_write': sum(entry.get('value', 0) for entry in blkio if entry.get('op', '').lower() == 'write')
+    }
+
+def get_stats_client():
+    # Each stats stream holds a connection for as long as the container runs,
+    # so streams get their own client rather than exhausting docker_client's
+    # pool of 10. The client is replaced with a bigger pool as the fleet grows;
+    # streams already running keep the client they started on.
+    global stats_client, stats_client_pool_size
+    needed = len(stats_streams) + 1
+    if stats_client is None or needed > stats_client_pool_size:
+        stats_client_pool_size = max(needed * 2, 32)
+        stats_client = docker.from_env(max_pool_size=stats_client_pool_size)
+    return stats_client
+
+def stream_container_stats(container_id, stop, client):
+    # Docker emits one sample per second on a stats stream, each carrying
+    # precpu_stats from the previous sample, so CPU deltas come for free.
+    # Only the compact summary is kept to bound memory across a large fleet.
+    series = container_stats.setdefault(container_id, deque(maxlen=STATS_SERIES_LENGTH))
+    try:
+        for sample in client.api.stats(container_id, stream=True, decode=True):
+            if stop.is_set():
+                break
+            series.append(summarize_stats_sample(sample))
+    except Exception as e:
+        logger.warning(f"Stats stream for {container_id[:12]} ended: {e}")
+    finally:
+        with stats_streams_lock:
+            if stats_streams.get(container_id) is stop:
+                del stats_streams[container_id]
+                container_stats.pop(container_id, None)
+
+def start_stats_stream(container_id):
+    with stats_streams_lock:
+        if container_id not in stats_streams:
+            try:
+                client = get_stats_client()
+            except Exception as e:
+                logger.error(f"Stats client init failed: {e}")
+                return
+            stop = threading.Event()
+            stats_streams[container_id] = stop
+            threading.Thread(target=stream_container_stats, args=(container_id, stop, client), daemon=True).start()
+
+def sync_stats_streams(container_ids):
+    container_ids = set(container_ids)
+    for container_id in container_ids - set(stats_streams):
+        start_stats_stream(container_id)
+    with stats_streams_lock:
+        for container_id in set(stats_streams) - container_ids:
+            stats_streams.pop(container_id).set()
+            container_stats.pop(container_id, None)
+
+def get_container_sample(container_id, wait=0):
+    # Latest stats summary for a container from the shared sampler. With
+    # wait > 0 a stream is started on demand and the first sample awaited.
+    series = container_stats.get(container_id)
+    if series:
+        return series[-1]
+    if wait <= 0:
+        return None
+    start_stats_stream(container_id)
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        series = container_stats.get(container_id)
+        if series:
+            return series[-1]
+        time.sleep(0.1)
+    return None
+
+def get_container_series(container_id, seconds=None):
+    series = list(container_stats.get(container_id) or ())
+    if seconds is not None:
+        cutoff = time.time() - seconds
+        series = [point for point in series if point['time'] >= cutoff]
+    return series
+
+def parse_internal_stats(output):
+    sections = {}
+    name = None
+    for line in output.splitlines(keepends=True):
+        if line.startswith(INTERNAL_STATS_MARKER):
+            name = line[len(INTERNAL_STATS_MARKER):].strip()
+            sections[name] = ''
+        elif name:
+            sections[name] += line
+    # Drop the blank line printed ahead of each marker.
+    return {key: value[:-1] if value.endswith('\n\n') else value for key, value in sections.items()}
+
+def get_internal_stats(vps):
+    # Single flight per VPS: concurrent pollers wait for the one collection
+    # in progress and then share its result until it expires.
+    lock = internal_stats_locks.setdefault(vps['vps_id'], threading.Lock())
+    with lock:
+        cached = internal_stats_cache.get(vps['vps_id'])
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        success, out, err = run_docker_command(vps['container_id'], ["bash", "-c", INTERNAL_STATS_SCRIPT], timeout=DOCKER_EXEC_PAGE_TIMEOUT)
+        internal = parse_internal_stats(out) if success else {}
+        if not internal:
+            internal = {name: err for name in ('free', 'df', 'uptime', 'neofetch', 'top')}
+        internal_stats_cache[vps['vps_id']] = (time.monotonic() + INTERNAL_STATS_TTL, internal)
+        return internal
+
+# NUL-separated so names with spaces, tabs or newlines survive.
+FILE_LIST_FIELDS = ('type', 'mode', 'links', 'user', 'group', 'size', 'mtime', 'target', 'name')
+FILE_LIST_FORMAT = '\\0'.join(['%y', '%M', '%n', '%u', '%g', '%s', '%T@', '%l', '%f']) + '\\0'
+FILE_LIST_SORTS = {
+    'name': lambda e: (e['type'] != 'd', e['name'].lower()),
+    'size': lambda e: e['size'],
+    'mtime': lambda e: e['mtime'],
+    'type': lambda e: (e['type'], e['name'].lower())
+}
+
+def parse_file_listing(output):
+    fields = output.split('\0')
+    width = len(FILE_LIST_FIELDS)
+    entries = []
+    for i in range(0, len(fields) - width + 1, width):
+        entry = dict(zip(FILE_LIST_FIELDS, fields[i:i + width]))
+        try:
+            entry['links'] = int(entry['links'])
+            entry['size'] = int(entry['size'])
+            entry['mtime'] = float(entry['mtime'])
+        except ValueError:
+            continue
+        entries.append(entry)
+    return entries
+
+def normalize_vps_path(path):
+    # Must be absolute so it can't reach find as an option; normalised so
+    # equivalent spellings share a cache entry.
+    if not path.startswith('/'):
+        return None
+    return posixpath.normpath(path)
+
+def list_vps_directory(vps, path):
+    # One `find` per directory, shared by every page and sort order until it
+    # expires or the VPS's files are changed through the panel.
+    with file_list_lock:
+        cache = file_list_cache.get(vps['vps_id'])
+        cached = cache.get(path) if cache else None
+        if cached and cached[0] > time.monotonic():
+            cache.move_to_end(path)
+            return cached[1]
+    success, out, err = run_docker_command(vps['container_id'], ['find', '-H', path, '-mindepth', '1', '-maxdepth', '1', '-printf', FILE_LIST_FORMAT], timeout=DOCKER_EXEC_PAGE_TIMEOUT)
+    if not success and not out:
+        return None
+    entries = parse_file_listing(out)
+    with file_list_lock:
+        cache = file_list_cache.setdefault(vps['vps_id'], OrderedDict())
+        cache[path] = (time.monotonic() + FILE_LIST_TTL, entries)
+        cache.move_to_end(path)
+        while len(cache) > FILE_LIST_CACHE_DIRS:
+            cache.popitem(last=False)
+    return entries
+
+def invalidate_file_listing(vps_id):
+    with file_list_lock:
+        file_list_cache.pop(vps_id, None)
+
+def page_file_listing(entries, sort='name', order='asc', page=1, per_page=FILE_LIST_PAGE_SIZE):
+    ordered = sorted(entries, key=FILE_LIST_SORTS.get(sort, FILE_LIST_SORTS['name']), reverse=order == 'desc')
+    page = max(page, 1)
+    per_page = min(max(per_page, 1), 1000)
+    return ordered[(page - 1) * per_page:page * per_page]
+
+def format_ls_line(entry):
+    modified = datetime.datetime.fromtimestamp(entry['mtime']).strftime('%b %d %H:%M')
+    line = f"{entry['mode']} {entry['links']:>3} {entry['user']:<8} {entry['group']:<8} {entry['size']:>10} {modified} {entry['name']}"
+    return f"{line} -> {entry['target']}" if entry['target'] else line
+
+def get_container_ips():
+    ips = {}
+    for cont in docker_client.containers.list(sparse=True):
+        networks = (cont.attrs.get('NetworkSettings') or {}).get('Networks') or {}
+        ip = (networks.get(DOCKER_NETWORK) or {}).get('IPAddress')
+        if ip:
+            ips[cont.id] = ip
+    return ips
+
+def get_network_gateway():
+    global network_gateway
+    if network_gateway is None:
+        for config in docker_client.networks.get(DOCKER_NETWORK).attrs.get('IPAM', {}).get('Config') or []:
+            if config.get('Gateway'):
+                network_gateway = config['Gateway']
+                break
+    return network_gateway
+
+def allow_exporter_scrape(container_id):
+    # The panel reaches node-exporter from the network gateway; ufw in the
+    # VPS only lets SSH in by default.
+    exporter_access.add(container_id)
+    gateway = get_network_gateway()
+    if not gateway:
+        return False
+    success, _, err = run_docker_command(container_id, ["ufw", "allow", "from", gateway, "to", "any", "port", str(NODE_EXPORTER_PORT), "proto", "tcp"], timeout=DOCKER_EXEC_PAGE_TIMEOUT)
+    if not success:
+        logger.warning(f"Could not open node-exporter port on {container_id[:12]}: {err}")
+    return success
+
+METRIC_LABEL_PAIR = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+def aggregate_metric_key(key, aggregate=METRICS_AGGREGATE):
+    name, _, labels = key.partition('{')
+    for prefix, kept in aggregate:
+        if name.startswith(prefix):
+            pairs = dict(METRIC_LABEL_PAIR.findall(labels))
+            kept_pairs = ','.join(f'{label}="{pairs[label]}"' for label in kept if label in pairs)
+            return f'{name}{{{kept_pairs}}}' if kept_pairs else name, True
+    return key, False
+
+def parse_prometheus_text(text, keep=METRICS_KEEP):
+    values = {}
+    for line in text.splitlines():
+        if not line or line[0] == '#' or (keep and not line.startswith(keep)):
+            continue
+        if '}' in line:
+            key, _, rest = line.rpartition('}')
+            key += '}'
+        else:
+            key, _, rest = line.partition(' ')
+        try:
+            value = float(rest.split()[0])
+        except (ValueError, IndexError):
+            continue
+        if math.isfinite(value):
+            key, summed = aggregate_metric_key(key)
+            values[key] = values.get(key, 0.0) + value if summed else value
+    return values
+
+def record_node_metrics(vps_id, values, now):
+    # Every series is appended once per scrape (None when missing), so each
+    # one lines up with the tail of the shared time axis.
+    with node_metrics_lock:
+        store = node_metrics.setdefault(vps_id, {'times': deque(maxlen=METRICS_SERIES_LENGTH), 'series': {}})
+        store['times'].append(now)
+        for key, series in list(store['series'].items()):
+            series.append(values.pop(key, None))
+            if series[-1] is None and series.count(None) == len(series):
+                del store['series'][key]
+        for key, value in values.items():
+            store['series'][key] = deque([value], maxlen=METRICS_SERIES_LENGTH)
+
+def query_node_metrics(vps_id, names, since=None):
+    with node_metrics_lock:
+        store = node_metrics.get(vps_id)
+        if not store:
+            return [], {}
+        times = list(store['times'])
+        start = 0 if since is None else next((i for i, t in enumerate(times) if t > since), len(times))
+        series = {}
+        for key, values in store['series'].items():
+            if key.split('{', 1)[0] in names:
+                offset = len(times) - len(values)
+                series[key] = [None] * max(0, offset - start) + list(values)[max(0, start - offset):]
+        return times[start:], series
+
+def latest_node_metrics(vps_id, names):
+    _, series = query_node_metrics(vps_id, names)
+    return {key: next((v for v in reversed(values) if v is not None), None) for key, values in series.items()}
+
+def delta_encode(values):
+    # The first value, and the first after a gap (None), is absolute; every
+    # other value is the difference from the one before it.
+    encoded = []
+    previous = None
+    for value in values:
+        if value is None:
+            encoded.append(None)
+        elif previous is None:
+            encoded.append(value)
+        else:
+            encoded.append(round(value - previous, 6))
+        previous = value
+    return encoded
+
+def scrape_node_exporter(vps, ip):
+    try:
+        response = requests.get(f"http://{ip}:{NODE_EXPORTER_PORT}/metrics", timeout=5)
+        response.raise_for_status()
+    except requests.RequestException:
+        if vps['container_id'] not in exporter_access:
+            allow_exporter_scrape(vps['container_id'])
+        return False
+    record_node_metrics(vps['vps_id'], parse_prometheus_text(response.text), int(time.time()))
+    return True
+
 def update_vps_stats():
     global vps_stats_cache
     try:
-        for vps_id, vps in db.get_all_vps().items():
+        all_vps = db.get_all_vps()
+        sync_stats_streams(vps['container_id'] for vps in all_vps.values() if vps['status'] == 'running' and vps['container_id'])
+        for vps_id, vps in all_vps.items():
             if vps['status'] != 'running':
                 vps_stats_cache[vps_id] = {'status': vps['status']}
                 continue
+            sample = get_container_sample(vps['container_id'])
+            if not sample:
+                vps_stats_cache.setdefault(vps_id, {'status': 'running'})
+                continue
             try:
-                container = docker_client.containers.get(vps['container_id'])
-                stats = container.stats(stream=False)
-                mem_stats = stats['memory_stats']
-                cpu_stats = stats['cpu_stats']
-                net_stats = stats.get('networks', {})
-                mem_usage = mem_stats.get('usage', 0) / (1024 ** 2)
-                mem_limit = mem_stats.get('limit', 1) / (1024 ** 2)
-                cpu_usage = (cpu_stats['cpu_usage']['total_usage'] / cpu_stats['system_cpu_usage']) * 100 if cpu_stats.get('system_cpu_usage') else 0
-                net_in = sum(iface['rx_bytes'] for iface in net_stats.values()) / (1024 ** 2)
-                net_out = sum(iface['tx_bytes'] for iface in net_stats.values()) / (1024 ** 2)
+                memory_percent = sample['memory_usage'] / sample['memory_limit'] * 100
+                cpu_usage = sample['cpu_percent']
+                net_in = sample['net_rx'] / (1024 ** 2)
+                net_out = sample['net_tx'] / (1024 ** 2)
                 uptime_start = datetime.datetime.fromisoformat(vps['uptime_start'])
                 uptime_seconds = (datetime.datetime.now() - uptime_start).total_seconds()
                 restart_count = vps.get('restart_count', 0)
@@ -909,7 +1915,7 @@ def update_vps_stats():
                 disk_usage = psutil.disk_usage(f'/var/lib/docker/volumes/hvm-{vps_id}/_data').percent if os.path.exists(f'/var/lib/docker/volumes/hvm-{vps_id}/_data') else 0
                 vps_stats_cache[vps_id] = {
                     'cpu_percent': round(cpu_usage, 2),
-                    'memory_percent': round((mem_usage / mem_limit) * 100, 2),
+                    'memory_percent': round(memory_percent, 2),
                     'net_in_mb': round(net_in, 2),
                     'net_out_mb': round(net_out, 2),
                     'disk_percent': round(disk_usage, 2),
@@ -917,24 +1923,28 @@ def update_vps_stats():
                     'uptime_seconds': uptime_seconds,
                     'uptime_percent': round(uptime_percent, 2)
                 }
-                db.add_resource_history(vps_id, cpu_usage, (mem_usage / mem_limit * 100), disk_usage, net_in, net_out)
-                resource_history[vps_id].append(vps_stats_cache[vps_id])
+                queue_resource_history(vps_id, cpu_usage, memory_percent, disk_usage, net_in, net_out)
+                resource_history.setdefault(vps_id, deque(maxlen=3600)).append(vps_stats_cache[vps_id])
                 socketio.emit('vps_update', vps_stats_cache[vps_id], room=vps_id, namespace='/vps')
             except Exception as e:
                 logger.error(f"VPS {vps_id} stats error: {e}")
                 vps_stats_cache[vps_id] = {'status': 'error'}
     except Exception as e:
         logger.error(f"VPS stats update error: {e}")
+    flush_resource_history()
 
 def build_custom_image(base_image=DEFAULT_OS_IMAGE, dockerfile_content=None):
     with image_build_lock:
         existing = db.get_image(base_image)
         if existing:
             try:
-                docker_client.images.get(existing['image_id'])
-                return existing['image_id']
+                image = docker_client.images.get(existing['image_id'])
+                if dockerfile_content or image.labels.get('hvm.image_version') == IMAGE_VERSION:
+                    return existing['image_id']
+                logger.info(f"Rebuilding outdated image {existing['image_id']}")
             except docker.errors.ImageNotFound:
-                db._execute('DELETE FROM docker_images WHERE os_image = ?', (base_image,))
+                pass
+            db._execute('DELETE FROM docker_images WHERE os_image = ?', (base_image,))
        
         try:
             temp_dir = f"image_cache/{base_image.replace(':', '-')}"
@@ -944,7 +1954,7 @@ def build_custom_image(base_image=DEFAULT_OS_IMAGE, dockerfile_content=None):
                 with open(os.path.join(temp_dir, 'Dockerfile'), 'w') as f:
                     f.write(dockerfile_content)
             else:
-                dockerfile = DOCKERFILE_TEMPLATE.format(base_image=base_image)
+                dockerfile = DOCKERFILE_TEMPLATE.format(base_image=base_image, image_version=IMAGE_VERSION)
                 with open(os.path.join(temp_dir, 'Dockerfile'), 'w') as f:
                     f.write(dockerfile)
            
@@ -969,12 +1979,137 @@ def build_custom_image(base_image=DEFAULT_OS_IMAGE, dockerfile_content=None):
             if os.path.exists(temp_dir):
                 shutil.rmtree(temp_dir)
 
+def wait_for_container_ready(container_id, timeout=CONTAINER_READY_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        _, out, _ = run_docker_command(container_id, ["systemctl", "is-system-running"], timeout=10)
+        if out and out.strip() in ('running', 'degraded'):
+            return True
+        time.sleep(0.5)
+    logger.warning(f"Container {container_id[:12]} not ready after {timeout}s")
+    return False
+
+def vps_cpuset(cpu):
+    return f"0-{cpu-1}" if cpu > 1 else "0"
+
+def vps_container_options(vps_id, memory, cpu, ports, labels=None):
+    cpuset = vps_cpuset(cpu)
+    prefix = db.get_setting('vps_hostname_prefix', VPS_HOSTNAME_PREFIX)
+    return dict(
+        detach=True,
+        privileged=True,
+        hostname=f"{prefix}{vps_id}",
+        mem_limit=f"{memory}g",
+        nano_cpus=cpu * 10**9,
+        cpuset_cpus=cpuset,
+        cap_add=["SYS_ADMIN", "NET_ADMIN"],
+        security_opt=["seccomp=unconfined"],
+        network=DOCKER_NETWORK,
+        volumes={f'hvm-{vps_id}': {'bind': '/data', 'mode': 'rw'}},
+        restart_policy={"Name": "always"},
+        ports=ports,
+        labels={'hvm.vps': vps_id, **(labels or {})}
+    )
+
+def run_vps_container(image, vps_id, memory, cpu, ports, labels=None):
+    return docker_client.containers.run(image, **vps_container_options(vps_id, memory, cpu, ports, labels))
+
+def container_upper_dir(container):
+    # Writable layer of an overlay2 container, if the panel can reach it.
+    driver = container.attrs.get('GraphDriver') or {}
+    upper = (driver.get('Data') or {}).get('UpperDir')
+    if driver.get('Name') != 'overlay2' or not upper or not os.path.isdir(upper):
+        return None
+    return upper
+
+def volume_mountpoint(name):
+    mountpoint = docker_client.volumes.get(name).attrs.get('Mountpoint')
+    return mountpoint if mountpoint and os.path.isdir(mountpoint) else None
+
+def snapshot_tree(source, target):
+    # Reflinks on btrfs/XFS make this a metadata-only copy sharing extents
+    # with the source; elsewhere cp falls back to a plain copy. -a keeps
+    # overlay whiteouts and xattrs intact.
+    success, _, err = run_command(['cp', '-a', '--reflink=auto', f'{source}/.', target], timeout=CLONE_COPY_TIMEOUT)
+    if not success:
+        raise Exception(f'Snapshot copy failed: {err}')
+
+reflink_support = {}  # st_dev -> bool
+
+def supports_reflink(directory):
+    # Probe with a throwaway file beside, never inside, the directory: the
+    # directory may be a live container's layer or volume.
+    parent = os.path.dirname(directory.rstrip('/'))
+    device = os.stat(parent).st_dev
+    if device not in reflink_support:
+        probe = os.path.join(parent, f'.hvm-reflink-{uuid.uuid4().hex}')
+        try:
+            with open(probe, 'wb') as f:
+                f.write(b'\0')
+            reflink_support[device] = run_command(['cp', '--reflink=always', probe, f'{probe}.copy'])[0]
+        except OSError:
+            reflink_support[device] = False
+        finally:
+            for path in (probe, f'{probe}.copy'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    return reflink_support[device]
+
+def snapshot_running(container, source, target, job):
+    # With reflinks the copy is metadata-only, so the source is paused for
+    # a consistent point-in-time snapshot. A full copy could take minutes,
+    # so it runs against the live VPS instead: files written meanwhile may
+    # be caught mid-write, like after a power cut.
+    if container.status != 'running' or not supports_reflink(target):
+        snapshot_tree(source, target)
+        return
+    container.pause()
+    job.remember(paused=container.id)
+    try:
+        snapshot_tree(source, target)
+    finally:
+        container.unpause()
+        job.remember(paused=None)
+
+def job_container_ids():
+    # Containers an unfinished job still owns: the new one before the VPS row
+    # points at it, or the parked one it may roll back to.
+    ids = set()
+    for row in db.get_jobs_by_status(('pending', 'running')):
+        state = json.loads(row['state'] or '{}')
+        ids.update(state.get(key) for key in ('container_id', 'old_container_id', 'paused'))
+    ids.discard(None)
+    return ids
+
+def is_orphan_container(cont, known):
+    # Only VPS containers the panel created are ours to remove; other
+    # containers on the host and the warm pool are left alone.
+    return 'hvm.vps' in cont.labels and cont.labels.get('hvm.pool') != '1' and cont.id not in known
+
+def gc_clone_images():
+    # Clone images only exist for VPSes cloned through the commit fallback;
+    # drop them once no VPS or in-flight clone refers to them.
+    referenced = {vps['image_id'] for vps in db.get_all_vps().values()}
+    referenced.update(json.loads(row['state'] or '{}').get('image') for row in db.get_jobs_by_status(('pending', 'running')))
+    removed = 0
+    for image in docker_client.images.list(filters={'reference': 'hvm/clone-*'}):
+        if any(tag in referenced for tag in image.tags):
+            continue
+        try:
+            docker_client.images.remove(image.id)
+            removed += 1
+        except docker.errors.APIError as e:
+            logger.warning(f"Clone image {image.id} not removed: {e}")
+    return removed
+
 def setup_container(container_id, memory, vps_id, ssh_port, root_password, watermark, welcome):
     try:
         container = docker_client.containers.get(container_id)
         if container.status != "running":
             container.start()
-            time.sleep(5)
+        wait_for_container_ready(container_id)
        
         whole = shlex.quote(f"root:{root_password}")
         cmd = f"echo {whole} | chpasswd"
@@ -1001,6 +2136,12 @@ def setup_container(container_id, memory, vps_id, ssh_port, root_password, water
         if not success:
             logger.warning(f"Watermark set failed: {stderr}")
        
+        allow_exporter_scrape(container_id)
+
+        # Images built from DOCKERFILE_TEMPLATE ship hardened already; only
+        # custom or outdated images need the slow in-container pass.
+        if container.labels.get('hvm.image_version') == IMAGE_VERSION:
+            return True, vps_id
         security_cmds = [
             "systemctl enable fail2ban && systemctl start fail2ban",
             "apt-get update && apt-get upgrade -y",
@@ -1021,6 +2162,209 @@ def setup_container(container_id, memory, vps_id, ssh_port, root_password, water
         logger.error(f"Setup failed for {container_id}: {e}")
         return False, None
 
+def parse_additional_ports(additional_ports):
+    mappings = []
+    for entry in (additional_ports or '').split(','):
+        entry = entry.strip()
+        if entry:
+            entry, _, protocol = entry.partition('/')
+            host, cont = entry.split(':')
+            mappings.append((int(host), int(cont), protocol or 'tcp'))
+    return mappings
+
+def format_port_mapping(host, cont, protocol='tcp'):
+    return f"{host}:{cont}" if protocol == 'tcp' else f"{host}:{cont}/{protocol}"
+
+def host_port_bound(port, protocol='tcp'):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM if protocol == 'tcp' else socket.SOCK_DGRAM)
+    try:
+        sock.bind(('0.0.0.0', port))
+        return False
+    except OSError:
+        return True
+    finally:
+        sock.close()
+
+class PortAllocator:
+    # port_allocations is the source of truth and its primary key makes two
+    # claims on one port impossible; the shuffled per-range free lists only
+    # make picking a port O(1) however full a range gets. Ports are taken
+    # from the right; ones skipped as busy go to the left to be retried last.
+    def __init__(self, database, ranges):
+        self.db = database
+        self.ranges = ranges
+        self.lock = threading.Lock()
+        self.owners = {}
+        self.free = {}
+        self.free_set = {}
+
+    def load(self):
+        with self.lock:
+            self.owners = {(row['host_port'], row['protocol']): row['vps_id'] for row in self.db.get_port_allocations()}
+            for name, (low, high) in self.ranges.items():
+                ports = [port for port in range(low, high + 1) if (port, 'tcp') not in self.owners]
+                random.shuffle(ports)
+                self.free[name] = deque(ports)
+                self.free_set[name] = set(ports)
+
+    def _take(self, name, protocol):
+        free = self.free[name]
+        for _ in range(len(free)):
+            port = free.pop()
+            if (port, protocol) not in self.owners and not host_port_bound(port, protocol):
+                self.free_set[name].discard(port)
+                return port
+            free.appendleft(port)
+        raise ValueError(f'No free {name} ports left')
+
+    def _release(self, keys):
+        for key in keys:
+            self.owners.pop(key, None)
+            for name, (low, high) in self.ranges.items():
+                if low <= key[0] <= high and key[0] not in self.free_set[name]:
+                    self.free[name].append(key[0])
+                    self.free_set[name].add(key[0])
+
+    def _claim(self, vps_id, purpose, mappings, previous):
+        try:
+            self.db.replace_port_allocations(vps_id, purpose, mappings)
+        except sqlite3.IntegrityError:
+            raise ValueError('Port already allocated')
+        current = {(host, protocol) for host, _, protocol in mappings}
+        self._release({(row['host_port'], row['protocol']) for row in previous if row['purpose'] == purpose} - current)
+        for key in current:
+            self.owners[key] = vps_id
+
+    def is_free(self, port, protocol='tcp', vps_id=None):
+        owner = self.owners.get((port, protocol))
+        if owner is not None:
+            return owner == vps_id
+        return not host_port_bound(port, protocol)
+
+    def allocate_ssh(self, vps_id):
+        with self.lock:
+            port = self._take('ssh', 'tcp')
+            self._claim(vps_id, 'ssh', [(port, 22, 'tcp')], self.db.get_port_allocations(vps_id))
+            return port
+
+    def set_forwards(self, vps_id, mappings):
+        # `mappings` is the complete forward list for the VPS; a host port of
+        # None is picked from the forward range.
+        with self.lock:
+            resolved = []
+            for host, cont, protocol in mappings:
+                if host is None:
+                    host = self._take('forward', protocol)
+                elif not self.is_free(host, protocol, vps_id):
+                    raise ValueError(f'Port {host} in use')
+                resolved.append((host, cont, protocol))
+            self._claim(vps_id, 'forward', resolved, self.db.get_port_allocations(vps_id))
+            return resolved
+
+    def release_vps(self, vps_id):
+        with self.lock:
+            previous = self.db.get_port_allocations(vps_id)
+            self.db.remove_port_allocations(vps_id)
+            self._release({(row['host_port'], row['protocol']) for row in previous})
+
+def rebuild_port_allocations():
+    db.clear_port_allocations()
+    owners = [(vps['vps_id'], vps['port'], vps['additional_ports']) for vps in db.get_all_vps().values()]
+    owners += [(entry['vps_id'], entry['port'], '') for entry in db.get_pool_containers()]
+    for vps_id, ssh_port, additional_ports in owners:
+        for purpose, mappings in (('ssh', [(ssh_port, 22, 'tcp')] if ssh_port else []), ('forward', parse_additional_ports(additional_ports))):
+            try:
+                db.replace_port_allocations(vps_id, purpose, mappings)
+            except sqlite3.IntegrityError:
+                logger.warning(f"VPS {vps_id} shares a {purpose} port with another VPS; not indexed")
+    port_allocator.load()
+
+port_allocator = PortAllocator(db, {'ssh': SSH_PORT_RANGE, 'forward': FORWARD_PORT_RANGE})
+if db.get_port_allocations() or not (db.get_all_vps() or db.get_pool_containers()):
+    port_allocator.load()
+else:
+    rebuild_port_allocations()
+
+def ensure_port_forward_jumps():
+    jumps = [
+        ('nat', 'PREROUTING', ['-m', 'addrtype', '--dst-type', 'LOCAL', '-j', PORT_FORWARD_CHAIN]),
+        ('nat', 'OUTPUT', ['!', '-d', '127.0.0.0/8', '-m', 'addrtype', '--dst-type', 'LOCAL', '-j', PORT_FORWARD_CHAIN]),
+        ('filter', 'DOCKER-USER', ['-j', PORT_FORWARD_FILTER_CHAIN])
+    ]
+    for table, chain, rule in jumps:
+        exists, _, _ = run_command(['iptables', '-t', table, '-C', chain] + rule)
+        if not exists:
+            success, _, err = run_command(['iptables', '-t', table, '-I', chain, '1'] + rule)
+            if not success:
+                raise Exception(f"iptables {table}/{chain}: {err.strip()}")
+
+def sync_port_forwards():
+    # Additional ports are DNATed to the container's address on
+    # DOCKER_NETWORK instead of being published by Docker, so they can change
+    # without touching the container. Both chains are rewritten atomically.
+    ips = get_container_ips()
+
+    nat_rules = [f':{PORT_FORWARD_CHAIN} - [0:0]']
+    filter_rules = [f':{PORT_FORWARD_FILTER_CHAIN} - [0:0]']
+    for vps in db.get_all_vps().values():
+        ip = ips.get(vps['container_id'])
+        if not ip:
+            continue
+        for host, cont, protocol in parse_additional_ports(vps['additional_ports']):
+            comment = f"hvm:{vps['vps_id']}"
+            nat_rules.append(f"-A {PORT_FORWARD_CHAIN} -p {protocol} --dport {host} -m comment --comment {comment} -j DNAT --to-destination {ip}:{cont}")
+            filter_rules.append(f"-A {PORT_FORWARD_FILTER_CHAIN} -d {ip}/32 -p {protocol} --dport {cont} -m conntrack --ctstate DNAT -m comment --comment {comment} -j ACCEPT")
+    rules = '*nat\n' + '\n'.join(nat_rules) + '\nCOMMIT\n*filter\n' + '\n'.join(filter_rules) + '\nCOMMIT\n'
+
+    with port_forward_lock:
+        result = subprocess.run(['iptables-restore', '--noflush'], input=rules, capture_output=True, text=True, timeout=30)
+        if result.returncode != 0:
+            raise Exception(f"iptables-restore failed: {result.stderr.strip()}")
+        ensure_port_forward_jumps()
+    return len(nat_rules) - 1
+
+def create_pool_container(os_image, memory, cpu):
+    image_tag = build_custom_image(os_image)
+    vps_id = generate_vps_id()
+    port = port_allocator.allocate_ssh(vps_id)
+    try:
+        container = run_vps_container(image_tag, vps_id, memory, cpu, {'22/tcp': port}, labels={'hvm.pool': '1'})
+    except Exception:
+        port_allocator.release_vps(vps_id)
+        raise
+    db.add_pool_container({
+        'container_id': container.id,
+        'vps_id': vps_id,
+        'image_tag': image_tag,
+        'os_image': os_image,
+        'memory': memory,
+        'cpu': cpu,
+        'port': port,
+        'created_at': str(datetime.datetime.now())
+    })
+    wait_for_container_ready(container.id)
+    logger.info(f"Warm pool: added {vps_id} for {os_image} {memory}G/{cpu}c")
+
+def discard_pool_container(entry):
+    db.remove_pool_container(entry['container_id'])
+    port_allocator.release_vps(entry['vps_id'])
+    try:
+        docker_client.containers.get(entry['container_id']).remove(force=True)
+    except docker.errors.NotFound:
+        pass
+    try:
+        docker_client.volumes.get(f"hvm-{entry['vps_id']}").remove()
+    except docker.errors.NotFound:
+        pass
+
+def record_provision_time(seconds, source):
+    provision_times.append(seconds)
+    ordered = sorted(provision_times)
+    for pct in (50, 90, 99):
+        db.set_stat(f'create_time_p{pct}_ms', int(ordered[min(len(ordered) - 1, len(ordered) * pct // 100)] * 1000))
+    db.increment_stat(f'create_count_{source}')
+    logger.info(f"VPS provisioned from {source} in {seconds:.1f}s")
+
 def get_tmate_session(container_id):
     try:
         process = subprocess.Popen(["docker", "exec", container_id, "tmate", "-F"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
@@ -1040,6 +2384,69 @@ def get_tmate_session(container_id):
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def tar_stream(name, fileobj, size, chunk_size=FILE_STREAM_CHUNK):
+    # A one-member tar built on the fly, so put_archive can send it as a
+    # chunked request body without the file ever being held in memory.
+    info = tarfile.TarInfo(name=name)
+    info.size = size
+    info.mode = 0o644
+    info.mtime = int(time.time())
+    yield info.tobuf()
+    remaining = size
+    while remaining:
+        chunk = fileobj.read(min(chunk_size, remaining))
+        if not chunk:
+            raise IOError(f'{name}: upload ended {remaining} bytes early')
+        remaining -= len(chunk)
+        yield chunk
+    yield b'\0' * (-size % tarfile.BLOCKSIZE) + b'\0' * (2 * tarfile.BLOCKSIZE)
+
+class IterStream(io.RawIOBase):
+    # File-like view over an iterator of byte chunks, for tarfile's 'r|' mode.
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.leftover = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.leftover:
+            try:
+                self.leftover = next(self.chunks)
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self.leftover))
+        buffer[:size] = self.leftover[:size]
+        self.leftover = self.leftover[size:]
+        return size
+
+def stream_archive_member(chunks, chunk_size=FILE_STREAM_CHUNK):
+    # get_archive always wraps a file in a tar; unwrap it as it arrives.
+    with tarfile.open(fileobj=io.BufferedReader(IterStream(chunks), chunk_size), mode='r|') as tar:
+        member = tar.next()
+        if member is None or not member.isfile():
+            raise ValueError('Not a regular file')
+        yield member.size
+        source = tar.extractfile(member)
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+def attachment_headers(filename, size=None):
+    headers = {'Content-Disposition': f'attachment; filename="{secure_filename(filename) or "download"}"'}
+    if size is not None:
+        headers['Content-Length'] = str(size)
+    return headers
+
+def clean_stale_uploads():
+    cutoff = time.time() - UPLOAD_STAGING_TTL
+    for entry in os.scandir(UPLOAD_FOLDER) if os.path.isdir(UPLOAD_FOLDER) else []:
+        if entry.name.endswith('.part') and entry.stat().st_mtime < cutoff:
+            os.remove(entry.path)
+
 def send_email(to_email, subject, body):
     try:
         msg = MIMEText(body)
@@ -1055,6 +2462,619 @@ def send_email(to_email, subject, body):
         logger.error(f"Email send error: {e}")
         return False
 
+def park_container(container, job=None):
+    # Set aside a container that is being replaced: stopped, renamed out of
+    # the way and kept from coming back on a daemon restart.
+    parked = {
+        'old_container_id': container.id,
+        'old_name': container.name,
+        'old_was_running': container.status == 'running'
+    }
+    if job:
+        job.remember(**parked)
+    if parked['old_was_running']:
+        container.stop()
+    container.update(restart_policy={'Name': 'no'})
+    container.rename(f"{container.name}-replaced-{uuid.uuid4().hex[:6]}")
+    return parked
+
+def unpark_container(parked, new_container_id=None):
+    if new_container_id:
+        try:
+            docker_client.containers.get(new_container_id).remove(force=True)
+        except docker.errors.NotFound:
+            pass
+    container = docker_client.containers.get(parked['old_container_id'])
+    if container.name != parked['old_name']:
+        container.rename(parked['old_name'])
+    container.update(restart_policy={'Name': 'always'})
+    if parked['old_was_running'] and container.status != 'running':
+        container.start()
+    return container
+
+def drop_parked_container(parked):
+    if not parked or not parked.get('old_container_id'):
+        return
+    try:
+        docker_client.containers.get(parked['old_container_id']).remove(force=True)
+    except docker.errors.NotFound:
+        pass
+    except Exception as e:
+        logger.warning(f"Replaced container {parked['old_container_id'][:12]} not removed: {e}")
+
+def recreate_vps_container(vps, image, memory, cpu, ports, job=None):
+    # The old container is parked rather than removed, so a failure here or
+    # later in the job can put it back. Callers drop it with
+    # drop_parked_container once the new container is committed.
+    parked = {}
+    try:
+        parked = park_container(docker_client.containers.get(vps['container_id']), job)
+    except docker.errors.NotFound:
+        pass
+
+    new_container = None
+    try:
+        new_container = run_vps_container(image, vps['vps_id'], memory, cpu, ports)
+        if job:
+            job.remember(container_id=new_container.id)
+            job.step('Configuring container')
+        new_container.reload()
+
+        watermark = db.get_setting('watermark', WATERMARK)
+        welcome = db.get_setting('welcome_message', WELCOME_MESSAGE)
+        setup_success, _ = setup_container(new_container.id, memory, vps['vps_id'], vps['port'], vps['root_password'], watermark, welcome)
+        if not setup_success:
+            raise Exception('Setup failed')
+    except Exception:
+        # Jobs restore through their rollback; direct callers get the old
+        # container back here.
+        if not job:
+            if parked:
+                unpark_container(parked, new_container.id if new_container else None)
+            elif new_container:
+                new_container.remove(force=True)
+        raise
+    return new_container, parked
+
+def update_container_limits(container_id, memory, cpu):
+    # docker-py's update() has no NanoCpus and the daemon refuses a CPU
+    # quota on containers started with one, so go through the CLI.
+    success, _, err = run_command([
+        'docker', 'update',
+        '--memory', f'{memory}g',
+        '--memory-swap', f'{memory * 2}g',
+        '--cpus', str(cpu),
+        '--cpuset-cpus', vps_cpuset(cpu),
+        container_id
+    ])
+    if not success:
+        raise Exception(err.strip() or 'docker update failed')
+
+def resize_vps(vps, memory, cpu, image=None, job=None):
+    # Limits are cgroup settings and change in place; only a different image
+    # needs a new container. Returns the container, the path taken and the
+    # parked old container to drop once the change is saved.
+    if image is None or image == vps['image_id']:
+        # A failed update is reported, never answered with a recreate: that
+        # would throw away the container's writable layer.
+        if job:
+            job.step('Resizing container')
+        container = docker_client.containers.get(vps['container_id'])
+        update_container_limits(container.id, memory, cpu)
+        return container, 'live', {}
+    if job:
+        job.step('Recreating container')
+    container, parked = recreate_vps_container(vps, image or vps['image_id'], memory, cpu, {'22/tcp': vps['port']}, job)
+    return container, 'recreate', parked
+
+class Job:
+    STEP_OUTCOME = {'succeeded': 'done', 'failed': 'failed', 'pending': 'interrupted'}
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.type = row['type']
+        self.vps_id = row['vps_id']
+        self.status = row['status']
+        self.created_by = row['created_by']
+        self.params = json.loads(row['params'] or '{}')
+        self.state = json.loads(row['state'] or '{}')
+        self.steps = json.loads(row['steps'] or '[]')
+        self.result = json.loads(row['result']) if row['result'] else None
+        self.error = row['error']
+
+    def payload(self):
+        return {
+            'id': self.id,
+            'type': self.type,
+            'vps_id': self.vps_id,
+            'status': self.status,
+            'steps': self.steps,
+            'result': self.result,
+            'error': self.error
+        }
+
+    def publish(self):
+        socketio.emit('job_update', self.payload(), room=self.id, namespace='/jobs')
+
+    def reveal(self):
+        # A new VPS's root password is handed out once, then dropped from
+        # the stored result so it doesn't sit in the jobs table.
+        payload = self.payload()
+        vps = (self.result or {}).get('vps')
+        if self.status == 'succeeded' and vps and 'password' in vps:
+            vps = {k: v for k, v in vps.items() if k not in ('password', 'root_password')}
+            self.result = dict(self.result, vps=vps)
+            db.update_job(self.id, {'result': json.dumps(self.result)})
+        return payload
+
+    def _close_step(self, outcome):
+        if self.steps and self.steps[-1]['status'] == 'running':
+            self.steps[-1]['status'] = outcome
+            self.steps[-1]['seconds'] = round(time.time() - self.steps[-1]['started'], 2)
+
+    def step(self, name):
+        self._close_step('done')
+        self.steps.append({'name': name, 'status': 'running', 'started': time.time()})
+        db.update_job(self.id, {'steps': json.dumps(self.steps)})
+        self.publish()
+
+    def remember(self, **state):
+        # Written before the work it describes continues, so a restart
+        # knows exactly which resources to undo.
+        self.state.update(state)
+        db.update_job(self.id, {'state': json.dumps(self.state)})
+
+    def set_status(self, status, result=None, error=None):
+        if status in self.STEP_OUTCOME:
+            self._close_step(self.STEP_OUTCOME[status])
+        self.status = status
+        self.result = result
+        self.error = error
+        db.update_job(self.id, {
+            'status': status,
+            'steps': json.dumps(self.steps),
+            'result': json.dumps(result) if result is not None else None,
+            'error': error
+        })
+        self.publish()
+
+def enqueue_job(job_type, params, vps_id=None, created_by=None):
+    job_id = uuid.uuid4().hex
+    now = str(datetime.datetime.now())
+    db.add_job({
+        'id': job_id,
+        'type': job_type,
+        'vps_id': vps_id,
+        'status': 'pending',
+        'params': json.dumps(params),
+        'state': '{}',
+        'steps': '[]',
+        'created_by': created_by,
+        'created_at': now,
+        'updated_at': now
+    })
+    schedule_job(job_id, vps_id)
+    return job_id
+
+def schedule_job(job_id, vps_id):
+    # Jobs touching the same VPS run one after another. Later ones wait in
+    # vps_job_queues rather than in a worker, so a busy VPS can't hold the
+    # whole pool.
+    if vps_id:
+        with vps_job_queues_lock:
+            if vps_id in vps_job_queues:
+                vps_job_queues[vps_id].append(job_id)
+                return
+            vps_job_queues[vps_id] = deque()
+    job_executor.submit(run_job, job_id)
+
+def next_vps_job(vps_id):
+    with vps_job_queues_lock:
+        waiting = vps_job_queues.get(vps_id)
+        if not waiting:
+            vps_job_queues.pop(vps_id, None)
+            return
+        job_id = waiting.popleft()
+    job_executor.submit(run_job, job_id)
+
+def run_job(job_id):
+    job = Job(db.get_job(job_id))
+    handler, rollback = JOB_HANDLERS[job.type]
+    try:
+        job.set_status('running')
+        try:
+            job.set_status('succeeded', result=handler(job))
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.type}) failed: {e}")
+            try:
+                rollback(job)
+            except Exception as rollback_error:
+                logger.error(f"Rollback of job {job.id} failed: {rollback_error}")
+            job.set_status('failed', error=str(e))
+    finally:
+        if job.vps_id:
+            next_vps_job(job.vps_id)
+
+def resume_jobs():
+    for row in db.get_jobs_by_status(('pending', 'running')):
+        job = Job(row)
+        if job.status == 'running':
+            if job.state.get('committed'):
+                drop_parked_container(job.state)
+                job.set_status('succeeded')
+                continue
+            logger.info(f"Rolling back job {job.id} ({job.type}) interrupted by restart")
+            try:
+                JOB_HANDLERS[job.type][1](job)
+            except Exception as e:
+                logger.error(f"Rollback of job {job.id} failed: {e}")
+                job.set_status('failed', error=f'Interrupted by restart, rollback failed: {e}')
+                continue
+            job.state = {}
+            db.update_job(job.id, {'state': '{}'})
+            job.set_status('pending')
+        schedule_job(job.id, job.vps_id)
+
+def get_job_vps(job):
+    token, vps = db.get_vps_by_id(job.vps_id)
+    if not vps:
+        raise ValueError('VPS not found')
+    return token, vps
+
+def remove_job_container(job):
+    if job.state.get('committed'):
+        return
+    if job.state.get('old_container_id'):
+        # Put the replaced container back in place of the new one.
+        container = unpark_container(job.state, job.state.get('container_id'))
+        token, _ = db.get_vps_by_id(job.vps_id)
+        if token:
+            db.update_vps(token, {'container_id': container.id})
+        return
+    if not job.state.get('container_id'):
+        return
+    try:
+        docker_client.containers.get(job.state['container_id']).remove(force=True)
+    except docker.errors.NotFound:
+        pass
+
+def rollback_new_vps(job):
+    remove_job_container(job)
+    if job.state.get('committed') or not job.state.get('new_vps_id'):
+        return
+    port_allocator.release_vps(job.state['new_vps_id'])
+    try:
+        docker_client.volumes.get(f"hvm-{job.state['new_vps_id']}").remove()
+    except docker.errors.NotFound:
+        pass
+
+def rollback_clone(job):
+    if job.state.get('paused'):
+        try:
+            docker_client.containers.get(job.state['paused']).unpause()
+        except docker.errors.APIError:
+            pass
+    rollback_new_vps(job)
+    if not job.state.get('committed') and job.state.get('image'):
+        try:
+            docker_client.images.remove(job.state['image'])
+        except docker.errors.APIError:
+            pass
+
+def run_create_job(job):
+    p = job.params
+    started = time.monotonic()
+    token = generate_token()
+    root_password = generate_ssh_password()
+
+    pooled = None
+    if not p['dockerfile_content']:
+        job.step('Claiming warm container')
+        pooled = db.claim_pool_container(p['os_image'], p['memory'], p['cpu'])
+
+    if pooled:
+        warm_pool_event.set()
+        vps_id = pooled['vps_id']
+        ssh_port = pooled['port']
+        image_tag = pooled['image_tag']
+        job.remember(container_id=pooled['container_id'], new_vps_id=vps_id)
+        port_allocator.set_forwards(vps_id, parse_additional_ports(p['additional_ports']))
+        container = docker_client.containers.get(pooled['container_id'])
+    else:
+        vps_id = generate_vps_id()
+        job.remember(new_vps_id=vps_id)
+        port_allocator.set_forwards(vps_id, parse_additional_ports(p['additional_ports']))
+        ssh_port = port_allocator.allocate_ssh(vps_id)
+
+        job.step('Building image')
+        image_tag = build_custom_image(p['os_image'], p['dockerfile_content'])
+        job.step('Starting container')
+        container = run_vps_container(image_tag, vps_id, p['memory'], p['cpu'], {'22/tcp': ssh_port})
+        job.remember(container_id=container.id)
+        container.reload()
+
+    job.step('Configuring container')
+    watermark = db.get_setting('watermark', WATERMARK)
+    welcome = db.get_setting('welcome_message', WELCOME_MESSAGE)
+    setup_success, _ = setup_container(container.id, p['memory'], vps_id, ssh_port, root_password, watermark, welcome)
+    if not setup_success:
+        raise Exception('Setup failed')
+
+    job.step('Starting tmate session')
+    tmate = get_tmate_session(container.id)
+
+    job.step('Saving VPS')
+    now = datetime.datetime.now()
+    expires_at = now + datetime.timedelta(days=p['expires_days'], hours=p['expires_hours'], minutes=p['expires_minutes'])
+    vps_data = {
+        'token': token,
+        'vps_id': vps_id,
+        'container_id': container.id,
+        'memory': p['memory'],
+        'cpu': p['cpu'],
+        'disk': p['disk'],
+        'bandwidth_limit': p['bandwidth_limit'],
+        'username': 'root',
+        'password': root_password,
+        'root_password': root_password,
+        'created_by': p['user_id'],
+        'created_at': str(now),
+        'tmate_session': tmate,
+        'watermark': watermark,
+        'os_image': p['os_image'],
+        'restart_count': 0,
+        'last_restart': None,
+        'status': 'running',
+        'port': ssh_port,
+        'image_id': image_tag,
+        'expires_at': str(expires_at),
+        'expires_days': p['expires_days'],
+        'expires_hours': p['expires_hours'],
+        'expires_minutes': p['expires_minutes'],
+        'additional_ports': p['additional_ports'],
+        'uptime_start': str(now),
+        'tags': p['tags']
+    }
+    if not db.add_vps(vps_data):
+        raise Exception('DB add failed')
+    job.remember(committed=True)
+    if vps_data['additional_ports']:
+        sync_port_forwards()
+
+    db.log_action(job.created_by, 'create_vps', f'Created VPS {vps_id}')
+    db.add_notification(p['user_id'], f'New VPS {vps_id} created')
+    user = db.get_user_by_id(p['user_id'])
+    if user.get('email'):
+        send_email(user['email'], 'VPS Created', f'Your new VPS {vps_id} is ready.')
+    resource_history[vps_id] = deque(maxlen=3600)
+    record_provision_time(time.monotonic() - started, 'pool' if pooled else 'cold')
+    return {'vps': vps_data, 'server_ip': db.get_setting('server_ip', SERVER_IP)}
+
+def run_clone_job(job):
+    token, vps = get_job_vps(job)
+    container = docker_client.containers.get(vps['container_id'])
+
+    new_vps_id = generate_vps_id()
+    new_token = generate_token()
+    new_root_password = generate_ssh_password()
+
+    job.remember(new_vps_id=new_vps_id)
+    new_ssh_port = port_allocator.allocate_ssh(new_vps_id)
+    new_mappings = port_allocator.set_forwards(new_vps_id, [(None, cont, protocol) for _, cont, protocol in parse_additional_ports(vps['additional_ports'])])
+    new_additional = ','.join(format_port_mapping(*m) for m in new_mappings)
+    options = vps_container_options(new_vps_id, vps['memory'], vps['cpu'], {'22/tcp': new_ssh_port})
+
+    # Preferred path: create the clone on the source's own image and copy
+    # only its writable layer, so no image is committed and, with reflinks,
+    # the copy shares extents with the source. Anything other than a
+    # reachable overlay2 layer falls back to committing an image.
+    job.step('Snapshotting source VPS')
+    source_upper = container_upper_dir(container)
+    new_container = None
+    if source_upper:
+        try:
+            docker_client.images.get(vps['image_id'])
+            new_container = docker_client.containers.create(vps['image_id'], **options)
+            job.remember(container_id=new_container.id)
+            new_container.reload()
+        except docker.errors.ImageNotFound:
+            source_upper = None
+    target_upper = container_upper_dir(new_container) if new_container else None
+    if new_container and not target_upper:
+        new_container.remove(force=True)
+        new_container = None
+
+    if new_container:
+        snapshot_running(container, source_upper, target_upper, job)
+        new_image_tag = vps['image_id']
+    else:
+        # docker commit pauses the container itself for the duration.
+        new_image_tag = f"hvm/clone-{generate_vps_id().lower()}:latest"
+        job.remember(image=new_image_tag)
+        container.commit(repository=new_image_tag.split(':')[0], tag=new_image_tag.split(':')[1])
+        new_container = docker_client.containers.create(new_image_tag, **options)
+        job.remember(container_id=new_container.id)
+    # The hvm-<vps_id> data volume is not part of the container layer, and
+    # is snapshotted separately after the layer.
+    source_volume = volume_mountpoint(f"hvm-{vps['vps_id']}")
+    target_volume = volume_mountpoint(f'hvm-{new_vps_id}')
+    if source_volume and target_volume:
+        job.step('Copying data volume')
+        snapshot_running(container, source_volume, target_volume, job)
+
+    job.step('Starting clone')
+    new_container.start()
+    new_container.reload()
+
+    job.step('Configuring clone')
+    watermark = db.get_setting('watermark', WATERMARK)
+    welcome = db.get_setting('welcome_message', WELCOME_MESSAGE)
+    setup_success, _ = setup_container(new_container.id, vps['memory'], new_vps_id, new_ssh_port, new_root_password, watermark, welcome)
+    if not setup_success:
+        raise Exception('Setup failed')
+
+    job.step('Starting tmate session')
+    new_tmate = get_tmate_session(new_container.id)
+
+    job.step('Saving VPS')
+    now = datetime.datetime.now()
+    new_expires = now + datetime.timedelta(days=vps['expires_days'], hours=vps['expires_hours'], minutes=vps['expires_minutes'])
+    new_vps_data = {
+        'token': new_token,
+        'vps_id': new_vps_id,
+        'container_id': new_container.id,
+        'memory': vps['memory'],
+        'cpu': vps['cpu'],
+        'disk': vps['disk'],
+        'bandwidth_limit': vps['bandwidth_limit'],
+        'username': 'root',
+        'password': new_root_password,
+        'root_password': new_root_password,
+        'created_by': job.created_by,
+        'created_at': str(now),
+        'tmate_session': new_tmate,
+        'watermark': watermark,
+        'os_image': vps['os_image'],
+        'restart_count': 0,
+        'last_restart': None,
+        'status': 'running',
+        'port': new_ssh_port,
+        'image_id': new_image_tag,
+        'expires_at': str(new_expires),
+        'expires_days': vps['expires_days'],
+        'expires_hours': vps['expires_hours'],
+        'expires_minutes': vps['expires_minutes'],
+        'additional_ports': new_additional,
+        'uptime_start': str(now),
+        'tags': vps['tags']
+    }
+    if not db.add_vps(new_vps_data):
+        raise Exception('DB add failed')
+    job.remember(committed=True)
+    if new_additional:
+        sync_port_forwards()
+    db.log_action(job.created_by, 'clone_vps', f'Cloned VPS {vps["vps_id"]} to {new_vps_id}')
+    resource_history[new_vps_id] = deque(maxlen=3600)
+    return {'vps': new_vps_data, 'server_ip': db.get_setting('server_ip', SERVER_IP)}
+
+def run_upgrade_job(job):
+    token, vps = get_job_vps(job)
+    p = job.params
+
+    new_container, path, _ = resize_vps(vps, p['memory'], p['cpu'], job=job)
+
+    job.step('Saving VPS')
+    updates = {
+        'container_id': new_container.id,
+        'memory': p['memory'],
+        'cpu': p['cpu'],
+        'disk': p['disk'],
+        'bandwidth_limit': p['bandwidth_limit']
+    }
+    if path == 'recreate':
+        updates.update(status='running', uptime_start=str(datetime.datetime.now()))
+    db.update_vps(token, updates)
+    job.remember(committed=True)
+    drop_parked_container(job.state)
+    if path == 'recreate':
+        sync_port_forwards()
+    db.log_action(job.created_by, 'upgrade_vps', f'Upgraded VPS {vps["vps_id"]} ({path})')
+    return {'message': 'Upgraded', 'path': path}
+
+def run_edit_job(job):
+    token, vps = get_job_vps(job)
+    p = job.params
+    ports_changed = p['additional_ports'] != vps['additional_ports']
+
+    updates = {
+        'disk': p['disk'],
+        'bandwidth_limit': p['bandwidth_limit'],
+        'additional_ports': p['additional_ports'],
+        'tags': p['tags'],
+        'created_by': p['user_id']
+    }
+    path = None
+    image = vps['image_id']
+    if p['os_image'] != vps['os_image'] or p['cpu'] != vps['cpu'] or p['memory'] != vps['memory']:
+        if p['os_image'] != vps['os_image']:
+            job.step('Building image')
+            image = build_custom_image(p['os_image'])
+        new_container, path, _ = resize_vps(vps, p['memory'], p['cpu'], image, job)
+        updates.update(container_id=new_container.id, memory=p['memory'], cpu=p['cpu'], os_image=p['os_image'], image_id=image)
+        if path == 'recreate':
+            updates.update(status='running', uptime_start=str(datetime.datetime.now()))
+
+    job.step('Saving VPS')
+    if ports_changed:
+        port_allocator.set_forwards(vps['vps_id'], parse_additional_ports(p['additional_ports']))
+    db.update_vps(token, updates)
+    job.remember(committed=True)
+    drop_parked_container(job.state)
+    if path == 'recreate' and image != vps['image_id']:
+        try:
+            docker_client.images.remove(vps['image_id'])
+        except:
+            pass
+    if path == 'recreate' or ports_changed:
+        sync_port_forwards()
+    db.log_action(job.created_by, 'edit_vps', f'Edited VPS {vps["vps_id"]}' + (f' ({path} resize)' if path else ''))
+    return {'message': 'Saved', 'path': path}
+
+def apply_port_mappings(token, vps, mappings):
+    port_allocator.set_forwards(vps['vps_id'], mappings)
+    db.update_vps(token, {'additional_ports': ','.join(format_port_mapping(*m) for m in mappings)})
+    try:
+        sync_port_forwards()
+    except Exception:
+        port_allocator.set_forwards(vps['vps_id'], parse_additional_ports(vps['additional_ports']))
+        db.update_vps(token, {'additional_ports': vps['additional_ports']})
+        raise
+
+def run_add_port_job(job):
+    token, vps = get_job_vps(job)
+    p = job.params
+
+    job.step('Updating port forwards')
+    mappings = parse_additional_ports(vps['additional_ports']) + [(p['host_port'], int(p['cont_port']), p['protocol'])]
+    apply_port_mappings(token, vps, mappings)
+    job.remember(committed=True)
+    db.log_action(job.created_by, 'add_port', f"Added port {p['host_port']} to VPS {vps['vps_id']}")
+    return {'message': 'Port added'}
+
+def run_remove_port_job(job):
+    token, vps = get_job_vps(job)
+    host_port = int(job.params['host_port'])
+    mappings = parse_additional_ports(vps['additional_ports'])
+    removed = [m for m in mappings if m[0] == host_port]
+    if not removed:
+        raise ValueError('Port not mapped')
+
+    # Containers created before DNAT forwarding publish their extra ports
+    # through Docker; those bindings only go away with the container.
+    container = docker_client.containers.get(vps['container_id'])
+    bindings = container.attrs.get('HostConfig', {}).get('PortBindings') or {}
+    if any(f'{cont}/{protocol}' in bindings for _, cont, protocol in removed):
+        job.step('Recreating container')
+        new_container, _ = recreate_vps_container(vps, vps['image_id'], vps['memory'], vps['cpu'], {'22/tcp': vps['port']}, job)
+        db.update_vps(token, {'container_id': new_container.id, 'status': 'running'})
+        vps = dict(vps, container_id=new_container.id)
+
+    job.step('Updating port forwards')
+    apply_port_mappings(token, vps, [m for m in mappings if m[0] != host_port])
+    job.remember(committed=True)
+    drop_parked_container(job.state)
+    db.log_action(job.created_by, 'remove_port', f'Removed port {host_port} from VPS {vps["vps_id"]}')
+    return {'message': 'Port removed'}
+
+JOB_HANDLERS = {
+    'create': (run_create_job, rollback_new_vps),
+    'clone': (run_clone_job, rollback_clone),
+    'upgrade': (run_upgrade_job, remove_job_container),
+    'edit': (run_edit_job, remove_job_container),
+    'add_port': (run_add_port_job, remove_job_container),
+    'remove_port': (run_remove_port_job, remove_job_container)
+}
+
 limiter = Limiter(
     get_remote_address,
     app=app,
@@ -1080,6 +3100,19 @@ def validate_license(key):
     except (BadSignatureError, ValueError, KeyError, json.JSONDecodeError) as e:
         return False, str(e)
 
+@app.before_request
+def start_request_timer():
+    flask.g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = getattr(flask.g, 'request_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint, request.method)
+        HTTP_RESPONSES.inc(endpoint, response.status_code)
+    return response
+
 @app.before_request
 def check_maintenance():
     if request.path.startswith('/static') or request.endpoint in ['login', 'logout']:
@@ -1240,124 +3273,32 @@ def create_vps():
             if db.get_user_vps_count(user_id) >= int(db.get_setting('max_vps_per_user', MAX_VPS_PER_USER)):
                 raise ValueError('Max VPS reached')
 
-            if len(docker_client.containers.list(all=True)) >= int(db.get_setting('max_containers', MAX_CONTAINERS)):
+            if len(docker_client.containers.list(all=True)) - len(db.get_pool_containers()) >= int(db.get_setting('max_containers', MAX_CONTAINERS)):
                 raise ValueError('Max containers reached')
 
-            vps_id = generate_vps_id()
-            token = generate_token()
-            root_password = generate_ssh_password()
-
-            used_ports = set()
-            for v in db.get_all_vps().values():
-                used_ports.add(v['port'])
-                for p in v.get('additional_ports', '').split(','):
-                    if p:
-                        used_ports.add(int(p.split(':')[0]))
-
-            ssh_port = random.randint(20000, 30000)
-            while ssh_port in used_ports:
-                ssh_port = random.randint(20000, 30000)
-
-            ports = {'22/tcp': ssh_port}
-            for port_str in additional_ports.split(','):
-                if port_str.strip():
-                    host, cont = port_str.strip().split(':')
-                    host_p = int(host)
-                    if host_p in used_ports:
-                        raise ValueError(f"Port {host_p} in use")
-                    ports[f'{cont}/tcp'] = host_p
-                    used_ports.add(host_p)
-
             dockerfile_content = None
             if 'custom_dockerfile' in request.files:
                 file = request.files['custom_dockerfile']
                 if file and allowed_file(file.filename):
                     dockerfile_content = file.read().decode('utf-8')
 
-            image_tag = build_custom_image(os_image, dockerfile_content)
-
-            cpuset = f"0-{cpu-1}" if cpu > 1 else "0"
-            prefix = db.get_setting('vps_hostname_prefix', VPS_HOSTNAME_PREFIX)
-            container = docker_client.containers.run(
-                image_tag,
-                detach=True,
-                privileged=True,
-                hostname=f"{prefix}{vps_id}",
-                mem_limit=f"{memory}g",
-                nano_cpus=cpu * 10**9,
-                cpuset_cpus=cpuset,
-                cap_add=["SYS_ADMIN", "NET_ADMIN"],
-                security_opt=["seccomp=unconfined"],
-                network=DOCKER_NETWORK,
-                volumes={f'hvm-{vps_id}': {'bind': '/data', 'mode': 'rw'}},
-                restart_policy={"Name": "always"},
-                ports=ports
-            )
-
-            time.sleep(5)
-            container.reload()
-
-            watermark = db.get_setting('watermark', WATERMARK)
-            welcome = db.get_setting('welcome_message', WELCOME_MESSAGE)
-            setup_success, _ = setup_container(container.id, memory, vps_id, ssh_port, root_password, watermark, welcome)
-            if not setup_success:
-                container.stop()
-                container.remove()
-                raise Exception('Setup failed')
-
-            tmate = get_tmate_session(container.id)
-
-            now = datetime.datetime.now()
-            expires_at = now + datetime.timedelta(days=expires_days, hours=expires_hours, minutes=expires_minutes)
-
-            vps_data = {
-                'token': token,
-                'vps_id': vps_id,
-                'container_id': container.id,
+            job_id = enqueue_job('create', {
                 'memory': memory,
                 'cpu': cpu,
                 'disk': disk,
-                'bandwidth_limit': bandwidth_limit,
-                'username': 'root',
-                'password': root_password,
-                'root_password': root_password,
-                'created_by': user_id,
-                'created_at': str(now),
-                'tmate_session': tmate,
-                'watermark': watermark,
                 'os_image': os_image,
-                'restart_count': 0,
-                'last_restart': None,
-                'status': 'running',
-                'port': ssh_port,
-                'image_id': image_tag,
-                'expires_at': str(expires_at),
+                'additional_ports': additional_ports,
                 'expires_days': expires_days,
                 'expires_hours': expires_hours,
                 'expires_minutes': expires_minutes,
-                'additional_ports': additional_ports,
-                'uptime_start': str(now),
-                'tags': tags
-            }
-
-            if db.add_vps(vps_data):
-                db.log_action(current_user.id, 'create_vps', f'Created VPS {vps_id}')
-                db.add_notification(user_id, f'New VPS {vps_id} created')
-                user = db.get_user_by_id(user_id)
-                if user.get('email'):
-                    send_email(user['email'], 'VPS Created', f'Your new VPS {vps_id} is ready.')
-                resource_history[vps_id] = deque(maxlen=3600)
-                return render_template(
-                    'vps_created.html',
-                    vps=vps_data,
-                    server_ip=db.get_setting('server_ip', SERVER_IP),
-                    panel_name=db.get_setting('panel_name', PANEL_NAME),
-                    theme=current_user.theme
-                )
-            else:
-                container.stop()
-                container.remove()
-                raise Exception('DB add failed')
+                'bandwidth_limit': bandwidth_limit,
+                'tags': tags,
+                'user_id': user_id,
+                'dockerfile_content': dockerfile_content
+            }, created_by=current_user.id)
+            if wants_html():
+                return redirect(url_for('job_status', job_id=job_id))
+            return jsonify({'job_id': job_id, 'status_url': url_for('job_status', job_id=job_id)}), 202
 
         except Exception as e:
             logger.error(f"Create VPS error: {e}")
@@ -1406,80 +3347,26 @@ def edit_vps(vps_id):
             if new_user != vps['created_by'] and db.get_user_vps_count(new_user) >= int(db.get_setting('max_vps_per_user', MAX_VPS_PER_USER)):
                 raise ValueError('User max VPS reached')
            
-            recreate = new_os != vps['os_image'] or new_cpu != vps['cpu'] or new_memory != vps['memory'] or new_disk != vps['disk'] or new_ports != vps['additional_ports'] or new_bandwidth != vps['bandwidth_limit']
-           
-            if recreate:
-                container = docker_client.containers.get(vps['container_id'])
-                was_running = container.status == 'running'
-                if was_running:
-                    container.stop()
-                container.remove()
-               
-                new_image_tag = build_custom_image(new_os)
-               
-                ports = {'22/tcp': vps['port']}
-                for p in new_ports.split(','):
-                    if p.strip():
-                        h, c = p.strip().split(':')
-                        ports[f'{c}/tcp'] = int(h)
-               
-                cpuset = f"0-{new_cpu-1}" if new_cpu > 1 else "0"
-                prefix = db.get_setting('vps_hostname_prefix', VPS_HOSTNAME_PREFIX)
-                new_container = docker_client.containers.run(
-                    new_image_tag,
-                    detach=True,
-                    privileged=True,
-                    hostname=f"{prefix}{vps_id}",
-                    mem_limit=f"{new_memory}g",
-                    nano_cpus=new_cpu * 10**9,
-                    cpuset_cpus=cpuset,
-                    cap_add=["SYS_ADMIN", "NET_ADMIN"],
-                    security_opt=["seccomp=unconfined"],
-                    network=DOCKER_NETWORK,
-                    volumes={f'hvm-{vps_id}': {'bind': '/data', 'mode': 'rw'}},
-                    restart_policy={"Name": "always"},
-                    ports=ports
-                )
-               
-                time.sleep(5)
-                new_container.reload()
-               
-                watermark = db.get_setting('watermark', WATERMARK)
-                welcome = db.get_setting('welcome_message', WELCOME_MESSAGE)
-                setup_success, _ = setup_container(new_container.id, new_memory, vps_id, vps['port'], vps['root_password'], watermark, welcome)
-                if not setup_success:
-                    new_container.stop()
-                    new_container.remove()
-                    raise Exception('Setup failed')
-               
-                updates = {
-                    'container_id': new_container.id,
-                    'memory': new_memory,
-                    'cpu': new_cpu,
-                    'disk': new_disk,
-                    'bandwidth_limit': new_bandwidth,
-                    'os_image': new_os,
-                    'image_id': new_image_tag,
-                    'additional_ports': new_ports,
-                    'tags': new_tags,
-                    'created_by': new_user,
-                    'status': 'running'
-                }
-               
-                if vps['image_id'] != new_image_tag:
-                    try:
-                        docker_client.images.remove(vps['image_id'])
-                    except:
-                        pass
-            else:
-                updates = {
-                    'created_by': new_user,
-                    'tags': new_tags
-                }
-           
-            db.update_vps(token, updates)
-            db.log_action(current_user.id, 'edit_vps', f'Edited VPS {vps_id}')
-            return redirect(url_for('admin_panel'))
+            new_mappings = parse_additional_ports(new_ports)
+            new_ports = ','.join(format_port_mapping(*m) for m in new_mappings)
+            if new_ports != vps['additional_ports']:
+                for host, _, protocol in new_mappings:
+                    if not port_allocator.is_free(host, protocol, vps_id):
+                        raise ValueError(f"Port {host} in use")
+
+            # Applied on the VPS's job queue so it can't interleave with an
+            # upgrade or port change that is already running.
+            job_id = enqueue_job('edit', {
+                'memory': new_memory,
+                'cpu': new_cpu,
+                'disk': new_disk,
+                'os_image': new_os,
+                'additional_ports': new_ports,
+                'bandwidth_limit': new_bandwidth,
+                'tags': new_tags,
+                'user_id': new_user
+            }, vps_id=vps_id, created_by=current_user.id)
+            return redirect(url_for('job_status', job_id=job_id))
        
         except Exception as e:
             logger.error(f"Edit VPS error: {e}")
@@ -1589,6 +3476,18 @@ def delete_vps(vps_id):
         pass
    
     db.remove_vps(token)
+    port_allocator.release_vps(vps['vps_id'])
+    invalidate_file_listing(vps['vps_id'])
+    if vps['additional_ports']:
+        try:
+            sync_port_forwards()
+        except Exception as e:
+            logger.error(f"Port forward sync error: {e}")
+    if vps['image_id'] and vps['image_id'].startswith('hvm/clone-'):
+        try:
+            gc_clone_images()
+        except Exception as e:
+            logger.error(f"Clone image cleanup error: {e}")
     db.log_action(current_user.id, 'delete_vps', f'Deleted VPS {vps_id}')
     return jsonify({'message': 'Deleted'})
 
@@ -1619,114 +3518,33 @@ def clone_vps(vps_id):
     token, vps = db.get_vps_by_id(vps_id)
     if not vps:
         return jsonify({'error': 'Access denied'}), 403
-   
-    try:
-        container = docker_client.containers.get(vps['container_id'])
-        was_running = container.status == 'running'
-        if was_running:
-            container.pause()
-       
-        new_image_tag = f"hvm/clone-{generate_vps_id().lower()}:latest"
-        new_image = container.commit(repository=new_image_tag.split(':')[0], tag=new_image_tag.split(':')[1])
-       
-        if was_running:
-            container.unpause()
-       
-        new_vps_id = generate_vps_id()
-        new_token = generate_token()
-        new_root_password = generate_ssh_password()
-       
-        used_ports = set(v['port'] for v in db.get_all_vps().values())
-        for v in db.get_all_vps().values():
-            for p in v.get('additional_ports', '').split(','):
-                if p:
-                    used_ports.add(int(p.split(':')[0]))
-       
-        new_ssh_port = random.randint(20000, 30000)
-        while new_ssh_port in used_ports:
-            new_ssh_port = random.randint(20000, 30000)
-       
-        ports = {'22/tcp': new_ssh_port}
-        new_additional = ''
-        for p in vps['additional_ports'].split(','):
-            if p.strip():
-                h = random.randint(30001, 40000)
-                while h in used_ports:
-                    h = random.randint(30001, 40000)
-                c = p.split(':')[1]
-                ports[f'{c}/tcp'] = h
-                new_additional += f",{h}:{c}" if new_additional else f"{h}:{c}"
-       
-        cpuset = f"0-{vps['cpu']-1}" if vps['cpu'] > 1 else "0"
-        prefix = db.get_setting('vps_hostname_prefix', VPS_HOSTNAME_PREFIX)
-        new_container = docker_client.containers.run(
-            new_image.id,
-            detach=True,
-            privileged=True,
-            hostname=f"{prefix}{new_vps_id}",
-            mem_limit=f"{vps['memory']}g",
-            nano_cpus=vps['cpu'] * 10**9,
-            cpuset_cpus=cpuset,
-            cap_add=["SYS_ADMIN", "NET_ADMIN"],
-            security_opt=["seccomp=unconfined"],
-            network=DOCKER_NETWORK,
-            volumes={f'hvm-{new_vps_id}': {'bind': '/data', 'mode': 'rw'}},
-            restart_policy={"Name": "always"},
-            ports=ports
-        )
-       
-        time.sleep(5)
-        new_container.reload()
-       
-        watermark = db.get_setting('watermark', WATERMARK)
-        welcome = db.get_setting('welcome_message', WELCOME_MESSAGE)
-        setup_success, _ = setup_container(new_container.id, vps['memory'], new_vps_id, new_ssh_port, new_root_password, watermark, welcome)
-        if not setup_success:
-            new_container.stop()
-            new_container.remove()
-            raise Exception('Setup failed')
-       
-        new_tmate = get_tmate_session(new_container.id)
-        now = datetime.datetime.now()
-        new_expires = now + datetime.timedelta(days=vps['expires_days'], hours=vps['expires_hours'], minutes=vps['expires_minutes'])
-       
-        new_vps_data = {
-            'token': new_token,
-            'vps_id': new_vps_id,
-            'container_id': new_container.id,
-            'memory': vps['memory'],
-            'cpu': vps['cpu'],
-            'disk': vps['disk'],
-            'bandwidth_limit': vps['bandwidth_limit'],
-            'username': 'root',
-            'password': new_root_password,
-            'root_password': new_root_password,
-            'created_by': current_user.id,
-            'created_at': str(now),
-            'tmate_session': new_tmate,
-            'watermark': watermark,
-            'os_image': vps['os_image'],
-            'restart_count': 0,
-            'last_restart': None,
-            'status': 'running',
-            'port': new_ssh_port,
-            'image_id': new_image_tag,
-            'expires_at': str(new_expires),
-            'expires_days': vps['expires_days'],
-            'expires_hours': vps['expires_hours'],
-            'expires_minutes': vps['expires_minutes'],
-            'additional_ports': new_additional,
-            'uptime_start': str(now),
-            'tags': vps['tags']
-        }
-       
-        db.add_vps(new_vps_data)
-        db.log_action(current_user.id, 'clone_vps', f'Cloned VPS {vps_id} to {new_vps_id}')
-        return render_template('vps_created.html', vps=new_vps_data, server_ip=db.get_setting('server_ip', SERVER_IP), panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
-   
-    except Exception as e:
-        logger.error(f"Clone VPS error: {e}")
-        return render_template('error.html', error=str(e), panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
+
+    job_id = enqueue_job('clone', {}, vps_id=vps_id, created_by=current_user.id)
+    return jsonify({'job_id': job_id, 'status_url': url_for('job_status', job_id=job_id)}), 202
+
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    row = db.get_job(job_id)
+    if not row or (row['created_by'] != current_user.id and not is_admin(current_user)):
+        if wants_html():
+            return render_template('error.html', error='Job not found', panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
+        return jsonify({'error': 'Not found'}), 404
+    job = Job(row)
+    payload = job.reveal()
+    if not wants_html():
+        return jsonify(payload)
+    if job.status == 'failed':
+        return render_template('error.html', error=job.error, panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
+    result = payload['result'] or {}
+    if job.status == 'succeeded' and result.get('vps'):
+        if 'password' not in result['vps']:
+            # Credentials were already shown once.
+            return redirect(url_for('vps_details', vps_id=result['vps']['vps_id']))
+        return render_template('vps_created.html', vps=result['vps'], server_ip=result['server_ip'], panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
+    if job.status == 'succeeded' and job.vps_id:
+        return redirect(url_for('vps_details', vps_id=job.vps_id))
+    return render_template('job.html', job=payload, panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
 
 ssh_clients = {}  # sid -> (ssh, chan)
 
@@ -1803,43 +3621,29 @@ def vps_stats(vps_id):
         if container.status != 'running':
             return jsonify({'error': 'Not running'}), 400
        
-        stats = container.stats(stream=False)
-        mem_stats = stats['memory_stats']
-        cpu_stats = stats['cpu_stats']
-        blkio = stats['blkio_stats']
-        net = stats.get('networks', {})
-       
-        mem_usage = mem_stats.get('usage', 0) / (1024 ** 2)
-        mem_limit = mem_stats.get('limit', 1) / (1024 ** 2)
-        cpu_usage = (cpu_stats['cpu_usage']['total_usage'] / cpu_stats['system_cpu_usage']) * len(cpu_stats['cpu_usage']['percpu_usage']) if 'system_cpu_usage' in cpu_stats else 0
+        sample = get_container_sample(vps['container_id'], wait=STATS_FIRST_SAMPLE_WAIT)
+        if not sample:
+            return jsonify({'error': 'Stats not available yet'}), 503
        
-        disk_read = sum(s['value'] for s in blkio.get('io_service_bytes_recursive', []) if s['op'] == 'Read') / (1024 ** 2)
-        disk_write = sum(s['value'] for s in blkio.get('io_service_bytes_recursive', []) if s['op'] == 'Write') / (1024 ** 2)
+        mem_usage = sample['memory_usage'] / (1024 ** 2)
+        mem_limit = sample['memory_limit'] / (1024 ** 2)
+        cpu_usage = sample['cpu_percent']
        
-        net_in = sum(i['rx_bytes'] for i in net.values()) / (1024 ** 2)
-        net_out = sum(i['tx_bytes'] for i in net.values()) / (1024 ** 2)
+        disk_read = sample['disk_read'] / (1024 ** 2)
+        disk_write = sample['disk_write'] / (1024 ** 2)
        
-        internal = {}
-        cmds = [
-            ('free', ["free", "-h"]),
-            ('df', ["df", "-h"]),
-            ('uptime', ["uptime"]),
-            ('neofetch', ["neofetch", "--off"]),
-            ('top', ["top", "-b", "-n1"])
-        ]
-        for name, cmd in cmds:
-            success, out, err = run_docker_command(vps['container_id'], cmd)
-            internal[name] = out if success else err
+        net_in = sample['net_rx'] / (1024 ** 2)
+        net_out = sample['net_tx'] / (1024 ** 2)
        
-        success, out, err = run_docker_command(vps['container_id'], ["curl", "http://localhost:9100/metrics"])
-        metrics = out if success else ''
+        internal = dict(get_internal_stats(vps))
+        metrics = latest_node_metrics(vps_id, METRICS_DEFAULT_NAMES)
        
         return jsonify({
             'memory': {'used_mb': round(mem_usage, 2), 'limit_mb': round(mem_limit, 2), 'percent': round(mem_usage / mem_limit * 100, 2)},
             'cpu': {'percent': round(cpu_usage, 2)},
             'disk': {'read_mb': round(disk_read, 2), 'write_mb': round(disk_write, 2), 'total_gb': vps['disk']},
             'network': {'in_mb': round(net_in, 2), 'out_mb': round(net_out, 2)},
-            'uptime': stats['read'],
+            'uptime': sample['read'],
             'configured': {
     'memory': f"{vps['memory']}GB",
     'cpu': f"{vps['cpu']} cores",
@@ -1853,6 +3657,66 @@ def vps_stats(vps_id):
         logger.error(f"VPS stats error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/vps/<vps_id>/metrics')
+@login_required
+def vps_metrics(vps_id):
+    token, vps = db.get_vps_by_id(vps_id)
+    if not vps or (vps['created_by'] != current_user.id and not is_admin(current_user)):
+        return jsonify({'error': 'Access denied'}), 403
+
+    names = set(filter(None, request.args.get('names', '').split(','))) or METRICS_DEFAULT_NAMES
+    since = request.args.get('since', type=float)
+    times, series = query_node_metrics(vps_id, names, since)
+    if request.args.get('encoding') == 'delta':
+        return jsonify({
+            'encoding': 'delta',
+            'times': delta_encode(times),
+            'series': {key: delta_encode(values) for key, values in series.items()}
+        })
+    return jsonify({'times': times, 'series': series})
+
+def render_gauge(name, help_text, samples):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+    for labels, value in samples:
+        pairs = ','.join(f'{k}="{v}"' for k, v in labels.items())
+        lines.append(f'{name}{{{pairs}}} {value}' if pairs else f'{name} {value}')
+    return lines
+
+def socketio_room_counts():
+    # The manager keeps one room per connected sid plus the None room listing
+    # every sid in the namespace; only the named rooms are interesting.
+    connections, rooms = [], []
+    for namespace, namespace_rooms in list(socketio.server.manager.rooms.items()):
+        named = [room for room, members in list(namespace_rooms.items()) if room is not None and room not in members]
+        connections.append(({'namespace': namespace}, len(namespace_rooms.get(None, {}))))
+        rooms.append(({'namespace': namespace}, len(named)))
+    return connections, rooms
+
+@app.route('/metrics')
+@limiter.exempt
+def panel_metrics():
+    auth = request.headers.get('Authorization', '')
+    proxied = any(h in request.headers for h in ('X-Forwarded-For', 'X-Real-IP', 'Forwarded'))
+    allowed = ((request.remote_addr in PANEL_METRICS_ALLOWED_IPS and not proxied)
+               or (PANEL_METRICS_TOKEN and auth == f'Bearer {PANEL_METRICS_TOKEN}')
+               or (current_user.is_authenticated and is_admin(current_user)))
+    if not allowed:
+        return jsonify({'error': 'Access denied'}), 403
+
+    lines = []
+    for metric in PANEL_METRICS:
+        lines.extend(metric.render())
+    try:
+        connections, rooms = socketio_room_counts()
+    except Exception as e:
+        logger.error(f"Socket.IO room count error: {e}")
+        connections, rooms = [], []
+    lines.extend(render_gauge('hvm_socketio_connections', 'Connected Socket.IO clients by namespace.', connections))
+    lines.extend(render_gauge('hvm_socketio_rooms', 'Joined Socket.IO rooms by namespace.', rooms))
+    lines.extend(render_gauge('hvm_console_sessions', 'Open web console sessions.', [({}, len(console_sessions))]))
+    lines.extend(render_gauge('hvm_ssh_sessions', 'Open web SSH sessions.', [({}, len(ssh_clients))]))
+    return flask.Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
 @app.route('/vps/<vps_id>/change_password', methods=['POST'])
 @login_required
 def change_vps_password(vps_id):
@@ -1895,59 +3759,14 @@ def upgrade_vps(vps_id):
        
         if new_memory < 1 or new_memory > 512 or new_cpu < 1 or new_cpu > 32 or new_disk < 10 or new_disk > 1000:
             return jsonify({'error': 'Invalid values'}), 400
-       
-        container = docker_client.containers.get(vps['container_id'])
-        was_running = container.status == 'running'
-        if was_running:
-            container.stop()
-        container.remove()
-       
-        ports = {'22/tcp': vps['port']}
-        for p in vps['additional_ports'].split(','):
-            if p.strip():
-                h, c = p.split(':')
-                ports[f'{c}/tcp'] = int(h)
-       
-        cpuset = f"0-{new_cpu-1}" if new_cpu > 1 else "0"
-        prefix = db.get_setting('vps_hostname_prefix', VPS_HOSTNAME_PREFIX)
-        new_container = docker_client.containers.run(
-            vps['image_id'],
-            detach=True,
-            privileged=True,
-            hostname=f"{prefix}{vps_id}",
-            mem_limit=f"{new_memory}g",
-            nano_cpus=new_cpu * 10**9,
-            cpuset_cpus=cpuset,
-            cap_add=["SYS_ADMIN", "NET_ADMIN"],
-            security_opt=["seccomp=unconfined"],
-            network=DOCKER_NETWORK,
-            volumes={f'hvm-{vps_id}': {'bind': '/data', 'mode': 'rw'}},
-            restart_policy={"Name": "always"},
-            ports=ports
-        )
-       
-        time.sleep(5)
-        new_container.reload()
-       
-        watermark = db.get_setting('watermark', WATERMARK)
-        welcome = db.get_setting('welcome_message', WELCOME_MESSAGE)
-        setup_success, _ = setup_container(new_container.id, new_memory, vps_id, vps['port'], vps['root_password'], watermark, welcome)
-        if not setup_success:
-            new_container.stop()
-            new_container.remove()
-            return jsonify({'error': 'Setup failed'}), 500
-       
-        db.update_vps(token, {
-            'container_id': new_container.id,
+
+        job_id = enqueue_job('upgrade', {
             'memory': new_memory,
             'cpu': new_cpu,
             'disk': new_disk,
-            'bandwidth_limit': new_bandwidth,
-            'status': 'running',
-            'uptime_start': str(datetime.datetime.now()) if was_running else vps['uptime_start']
-        })
-        db.log_action(current_user.id, 'upgrade_vps', f'Upgraded VPS {vps_id}')
-        return jsonify({'message': 'Upgraded'})
+            'bandwidth_limit': new_bandwidth
+        }, vps_id=vps_id, created_by=current_user.id)
+        return jsonify({'job_id': job_id, 'status_url': url_for('job_status', job_id=job_id)}), 202
     except Exception as e:
         logger.error(f"Upgrade VPS error: {e}")
         return jsonify({'error': str(e)}), 500
@@ -1983,6 +3802,7 @@ def run_vps_command(vps_id):
    
     cmd_list = shlex.split(command)
     success, out, err = run_docker_command(vps['container_id'], cmd_list)
+    invalidate_file_listing(vps_id)
     db.log_action(current_user.id, 'run_command', f'Ran command on VPS {vps_id}: {command}')
     return jsonify({'success': success, 'output': out, 'error': err})
 
@@ -2005,7 +3825,7 @@ def vps_firewall(vps_id):
             return render_template('firewall.html', vps=vps, error=err, status='', panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
         return render_template('firewall.html', vps=vps, success='Executed', status='', panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
    
-    success, out, err = run_docker_command(vps['container_id'], ["ufw", "status", "verbose"])
+    success, out, err = run_docker_command(vps['container_id'], ["ufw", "status", "verbose"], timeout=DOCKER_EXEC_PAGE_TIMEOUT)
     status = out if success else err
     return render_template('firewall.html', vps=vps, status=status, panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
 
@@ -2020,72 +3840,15 @@ def add_vps_port(vps_id):
     cont_port = request.form.get('cont_port', '80')
     protocol = request.form.get('protocol', 'tcp')
    
-    if not host_port.isdigit():
+    if not host_port.isdigit() or not cont_port.isdigit() or protocol not in ('tcp', 'udp'):
         return jsonify({'error': 'Invalid port'}), 400
    
     host_p = int(host_port)
-    used_ports = set()
-    for v in db.get_all_vps().values():
-        used_ports.add(v['port'])
-        for p in v.get('additional_ports', '').split(','):
-            if p:
-                used_ports.add(int(p.split(':')[0]))
-   
-    if host_p in used_ports:
+    if not port_allocator.is_free(host_p, protocol):
         return jsonify({'error': 'Port in use'}), 400
-   
-    try:
-        container = docker_client.containers.get(vps['container_id'])
-        was_running = container.status == 'running'
-        if was_running:
-            container.stop()
-        container.remove()
-       
-        ports = {'22/tcp': vps['port']}
-        for p in vps['additional_ports'].split(','):
-            if p.strip():
-                h, c = p.split(':')
-                ports[f'{c}/tcp'] = int(h)
-       
-        ports[f'{cont_port}/{protocol}'] = host_p
-       
-        cpuset = f"0-{vps['cpu']-1}" if vps['cpu'] > 1 else "0"
-        prefix = db.get_setting('vps_hostname_prefix', VPS_HOSTNAME_PREFIX)
-        new_container = docker_client.containers.run(
-            vps['image_id'],
-            detach=True,
-            privileged=True,
-            hostname=f"{prefix}{vps_id}",
-            mem_limit=f"{vps['memory']}g",
-            nano_cpus=vps['cpu'] * 10**9,
-            cpuset_cpus=cpuset,
-            cap_add=["SYS_ADMIN", "NET_ADMIN"],
-            security_opt=["seccomp=unconfined"],
-            network=DOCKER_NETWORK,
-            volumes={f'hvm-{vps_id}': {'bind': '/data', 'mode': 'rw'}},
-            restart_policy={"Name": "always"},
-            ports=ports
-        )
-       
-        time.sleep(5)
-        new_container.reload()
-       
-        watermark = db.get_setting('watermark', WATERMARK)
-        welcome = db.get_setting('welcome_message', WELCOME_MESSAGE)
-        setup_success, _ = setup_container(new_container.id, vps['memory'], vps_id, vps['port'], vps['root_password'], watermark, welcome)
-        if not setup_success:
-            new_container.stop()
-            new_container.remove()
-            return jsonify({'error': 'Setup failed'}), 500
-       
-        new_additional = vps['additional_ports'] + f",{host_p}:{cont_port}" if vps['additional_ports'] else f"{host_p}:{cont_port}"
-       
-        db.update_vps(token, {'container_id': new_container.id, 'additional_ports': new_additional, 'status': 'running'})
-        db.log_action(current_user.id, 'add_port', f'Added port {host_p} to VPS {vps_id}')
-        return jsonify({'message': 'Port added'})
-    except Exception as e:
-        logger.error(f"Add port error: {e}")
-        return jsonify({'error': str(e)}), 500
+
+    job_id = enqueue_job('add_port', {'host_port': host_p, 'cont_port': cont_port, 'protocol': protocol}, vps_id=vps_id, created_by=current_user.id)
+    return jsonify({'job_id': job_id, 'status_url': url_for('job_status', job_id=job_id)}), 202
 
 @app.route('/vps/<vps_id>/remove_port', methods=['POST'])
 @login_required
@@ -2098,58 +3861,9 @@ def remove_vps_port(vps_id):
    
     if not host_port.isdigit():
         return jsonify({'error': 'Invalid port'}), 400
-   
-    try:
-        container = docker_client.containers.get(vps['container_id'])
-        was_running = container.status == 'running'
-        if was_running:
-            container.stop()
-        container.remove()
-       
-        ports = {'22/tcp': vps['port']}
-        new_additional = []
-        for p in vps['additional_ports'].split(','):
-            if p.strip():
-                h, c = p.split(':')
-                if h != host_port:
-                    ports[f'{c}/tcp'] = int(h)
-                    new_additional.append(f"{h}:{c}")
-       
-        cpuset = f"0-{vps['cpu']-1}" if vps['cpu'] > 1 else "0"
-        prefix = db.get_setting('vps_hostname_prefix', VPS_HOSTNAME_PREFIX)
-        new_container = docker_client.containers.run(
-            vps['image_id'],
-            detach=True,
-            privileged=True,
-            hostname=f"{prefix}{vps_id}",
-            mem_limit=f"{vps['memory']}g",
-            nano_cpus=vps['cpu'] * 10**9,
-            cpuset_cpus=cpuset,
-            cap_add=["SYS_ADMIN", "NET_ADMIN"],
-            security_opt=["seccomp=unconfined"],
-            network=DOCKER_NETWORK,
-            volumes={f'hvm-{vps_id}': {'bind': '/data', 'mode': 'rw'}},
-            restart_policy={"Name": "always"},
-            ports=ports
-        )
-       
-        time.sleep(5)
-        new_container.reload()
-       
-        watermark = db.get_setting('watermark', WATERMARK)
-        welcome = db.get_setting('welcome_message', WELCOME_MESSAGE)
-        setup_success, _ = setup_container(new_container.id, vps['memory'], vps_id, vps['port'], vps['root_password'], watermark, welcome)
-        if not setup_success:
-            new_container.stop()
-            new_container.remove()
-            return jsonify({'error': 'Setup failed'}), 500
-       
-        db.update_vps(token, {'container_id': new_container.id, 'additional_ports': ','.join(new_additional), 'status': 'running'})
-        db.log_action(current_user.id, 'remove_port', f'Removed port {host_port} from VPS {vps_id}')
-        return jsonify({'message': 'Port removed'})
-    except Exception as e:
-        logger.error(f"Remove port error: {e}")
-        return jsonify({'error': str(e)}), 500
+
+    job_id = enqueue_job('remove_port', {'host_port': host_port}, vps_id=vps_id, created_by=current_user.id)
+    return jsonify({'job_id': job_id, 'status_url': url_for('job_status', job_id=job_id)}), 202
 
 
 @app.route('/vps/<vps_id>/file_manager')
@@ -2159,10 +3873,54 @@ def vps_file_manager(vps_id):
     if not vps or (vps['created_by'] != current_user.id and not is_admin(current_user)):
         return render_template('error.html', error='Access denied', panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
    
-    path = request.args.get('path', '/')
-    success, out, err = run_docker_command(vps['container_id'], ["ls", "-la", path])
-    files = out.splitlines() if success else []
-    return render_template('file_manager.html', vps=vps, path=path, files=files, panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
+    path = normalize_vps_path(request.args.get('path', '/'))
+    if not path:
+        return render_template('error.html', error='Invalid path', panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
+    page = request.args.get('page', 1, type=int)
+    entries = list_vps_directory(vps, path) or []
+    files = [format_ls_line(entry) for entry in page_file_listing(entries, request.args.get('sort', 'name'), request.args.get('order', 'asc'), page)]
+    return render_template('file_manager.html', vps=vps, path=path, files=files, page=page, total_files=len(entries), per_page=FILE_LIST_PAGE_SIZE, panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
+
+@app.route('/vps/<vps_id>/files')
+@login_required
+def list_files(vps_id):
+    token, vps = db.get_vps_by_id(vps_id)
+    if not vps or (vps['created_by'] != current_user.id and not is_admin(current_user)):
+        return jsonify({'error': 'Access denied'}), 403
+
+    path = normalize_vps_path(request.args.get('path', '/'))
+    if not path:
+        return jsonify({'error': 'Invalid path'}), 400
+    if request.args.get('refresh') == '1':
+        invalidate_file_listing(vps_id)
+    entries = list_vps_directory(vps, path)
+    if entries is None:
+        return jsonify({'error': 'Cannot list directory'}), 404
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', FILE_LIST_PAGE_SIZE, type=int)
+    return jsonify({
+        'path': path,
+        'total': len(entries),
+        'page': page,
+        'per_page': per_page,
+        'entries': page_file_listing(entries, request.args.get('sort', 'name'), request.args.get('order', 'asc'), page, per_page)
+    })
+
+@app.route('/vps/<vps_id>/delete_file', methods=['POST'])
+@login_required
+def delete_file(vps_id):
+    token, vps = db.get_vps_by_id(vps_id)
+    if not vps or (vps['created_by'] != current_user.id and not is_admin(current_user)):
+        return jsonify({'error': 'Access denied'}), 403
+
+    path = request.form.get('path', '')
+    if not path.startswith('/') or os.path.normpath(path) == '/':
+        return jsonify({'error': 'Invalid path'}), 400
+    success, out, err = run_docker_command(vps['container_id'], ['rm', '-rf', '--', path])
+    invalidate_file_listing(vps_id)
+    if success:
+        db.log_action(current_user.id, 'delete_file', f'Deleted {path} from VPS {vps_id}')
+    return jsonify({'success': success, 'error': err})
 
 @app.route('/vps/<vps_id>/upload', methods=['POST'])
 @login_required
@@ -2179,29 +3937,77 @@ def upload_file(vps_id):
    
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(temp_path)
-       
         try:
-            with open(temp_path, 'rb') as f:
-                data = f.read()
-            tar_stream = BytesIO()
-            with tarfile.open(fileobj=tar_stream, mode='w') as tar:
-                tarinfo = tarfile.TarInfo(name=filename)
-                tarinfo.size = len(data)
-                tar.addfile(tarinfo, BytesIO(data))
-            tar_stream.seek(0)
-            docker_client.containers.get(vps['container_id']).put_archive(path, tar_stream)
-            os.remove(temp_path)
+            # Werkzeug has already spooled the part to a temp file; stream it
+            # from there instead of copying it into memory.
+            file.stream.seek(0, os.SEEK_END)
+            size = file.stream.tell()
+            file.stream.seek(0)
+            if not docker_client.containers.get(vps['container_id']).put_archive(path, tar_stream(filename, file.stream, size)):
+                raise Exception('put_archive failed')
+            invalidate_file_listing(vps_id)
             db.log_action(current_user.id, 'upload_file', f'Uploaded {filename} to VPS {vps_id}')
             return jsonify({'message': 'Uploaded'})
         except Exception as e:
-            os.remove(temp_path)
             logger.error(f"Upload file error: {e}")
             return jsonify({'error': str(e)}), 500
    
     return jsonify({'error': 'Invalid file'}), 400
 
+@app.route('/vps/<vps_id>/upload_chunk', methods=['GET', 'POST'])
+@login_required
+@limiter.limit(UPLOAD_CHUNK_RATE_LIMIT)
+def upload_chunk(vps_id):
+    # Resumable upload: the raw request body is appended at ?offset= to a
+    # staging file; GET reports how much has arrived so a client can resume
+    # after a dropped connection. The last chunk ships the file.
+    token, vps = db.get_vps_by_id(vps_id)
+    if not vps or (vps['created_by'] != current_user.id and not is_admin(current_user)):
+        return jsonify({'error': 'Access denied'}), 403
+
+    upload_id = request.args.get('upload_id', '')
+    if not UPLOAD_ID_PATTERN.match(upload_id):
+        return jsonify({'error': 'Invalid upload id'}), 400
+    staging = os.path.join(app.config['UPLOAD_FOLDER'], f'{vps_id}-{current_user.id}-{upload_id}.part')
+    received = os.path.getsize(staging) if os.path.exists(staging) else 0
+    if request.method == 'GET':
+        return jsonify({'upload_id': upload_id, 'received': received})
+
+    offset = request.args.get('offset', type=int)
+    total = request.args.get('total', type=int)
+    filename = secure_filename(request.args.get('filename', ''))
+    path = request.args.get('path', '/')
+    if offset is None or total is None or total < 0 or not filename or not allowed_file(filename):
+        return jsonify({'error': 'Invalid upload'}), 400
+    if offset != received:
+        return jsonify({'error': 'Offset mismatch', 'received': received}), 409
+
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    with open(staging, 'ab') as f:
+        while True:
+            chunk = request.stream.read(FILE_STREAM_CHUNK)
+            if not chunk:
+                break
+            if received + len(chunk) > total:
+                f.truncate(offset)
+                return jsonify({'error': 'Chunk exceeds total size', 'received': offset}), 400
+            f.write(chunk)
+            received += len(chunk)
+    if received < total:
+        return jsonify({'upload_id': upload_id, 'received': received})
+
+    try:
+        with open(staging, 'rb') as f:
+            if not docker_client.containers.get(vps['container_id']).put_archive(path, tar_stream(filename, f, total)):
+                raise Exception('put_archive failed')
+        os.remove(staging)
+        invalidate_file_listing(vps_id)
+        db.log_action(current_user.id, 'upload_file', f'Uploaded {filename} to VPS {vps_id}')
+        return jsonify({'message': 'Uploaded', 'received': received})
+    except Exception as e:
+        logger.error(f"Upload file error: {e}")
+        return jsonify({'error': str(e), 'received': received}), 500
+
 @app.route('/vps/<vps_id>/download')
 @login_required
 def download_file(vps_id):
@@ -2214,12 +4020,15 @@ def download_file(vps_id):
         return jsonify({'error': 'No path'}), 400
    
     try:
-        data, stat = docker_client.containers.get(vps['container_id']).get_archive(path)
-        f = BytesIO(b''.join(data))
-        with tarfile.open(fileobj=f) as tar:
-            file_data = tar.extractfile(tar.getmembers()[0]).read()
+        data, stat = docker_client.containers.get(vps['container_id']).get_archive(path, chunk_size=FILE_STREAM_CHUNK)
+        name = os.path.basename(path.rstrip('/')) or 'root'
         db.log_action(current_user.id, 'download_file', f'Downloaded {path} from VPS {vps_id}')
-        return send_file(BytesIO(file_data), download_name=os.path.basename(path), as_attachment=True)
+        # Go's os.ModeDir: directories are sent as the tar Docker produced.
+        if stat['mode'] & (1 << 31):
+            return flask.Response(data, mimetype='application/x-tar', headers=attachment_headers(f'{name}.tar'))
+        stream = stream_archive_member(data)
+        size = next(stream)
+        return flask.Response(stream, mimetype='application/octet-stream', headers=attachment_headers(name, size))
     except Exception as e:
         logger.error(f"Download file error: {e}")
         return jsonify({'error': str(e)}), 500
@@ -2269,7 +4078,7 @@ def vps_processes(vps_id):
                 db.log_action(current_user.id, 'kill_process', f'Killed process {pid} in VPS {vps_id}')
             return jsonify({'success': success, 'output': out, 'error': err})
    
-    success, out, err = run_docker_command(vps['container_id'], ["ps", "aux"])
+    success, out, err = run_docker_command(vps['container_id'], ["ps", "aux"], timeout=DOCKER_EXEC_PAGE_TIMEOUT)
     processes = out.splitlines() if success else []
     return render_template('processes.html', vps=vps, processes=processes, panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
 
@@ -2289,7 +4098,7 @@ def vps_services(vps_id):
                 db.log_action(current_user.id, f'{action}_service', f'{action.capitalize()}ed service {service} in VPS {vps_id}')
             return jsonify({'success': success, 'output': out, 'error': err})
    
-    success, out, err = run_docker_command(vps['container_id'], ["systemctl", "list-units", "--type=service"])
+    success, out, err = run_docker_command(vps['container_id'], ["systemctl", "list-units", "--type=service"], timeout=DOCKER_EXEC_PAGE_TIMEOUT)
     services = out.splitlines() if success else []
     return render_template('services.html', vps=vps, services=services, panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
 
@@ -2310,7 +4119,7 @@ def vps_packages(vps_id):
                 db.log_action(current_user.id, f'{action}_package', f'{action.capitalize()}ed package {package} in VPS {vps_id}')
             return jsonify({'success': success, 'output': out, 'error': err})
    
-    success, out, err = run_docker_command(vps['container_id'], ["apt", "list", "--installed"])
+    success, out, err = run_docker_command(vps['container_id'], ["apt", "list", "--installed"], timeout=DOCKER_EXEC_PAGE_TIMEOUT)
     packages = out.splitlines() if success else []
     return render_template('packages.html', vps=vps, packages=packages, panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
 
@@ -2337,7 +4146,7 @@ def vps_users(vps_id):
                 db.log_action(current_user.id, 'delete_vps_user', f'Deleted user {username} from VPS {vps_id}')
             return jsonify({'success': success, 'output': out, 'error': err})
    
-    success, out, err = run_docker_command(vps['container_id'], ["cat", "/etc/passwd"])
+    success, out, err = run_docker_command(vps['container_id'], ["cat", "/etc/passwd"], timeout=DOCKER_EXEC_PAGE_TIMEOUT)
     users = [line.split(':')[0] for line in out.splitlines() if success]
     return render_template('vps_users.html', vps=vps, users=users, panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
 
@@ -2357,7 +4166,7 @@ def vps_cron(vps_id):
                 db.log_action(current_user.id, 'add_cron', f'Added cron job to VPS {vps_id}')
             return jsonify({'success': success, 'output': out, 'error': err})
    
-    success, out, err = run_docker_command(vps['container_id'], ["crontab", "-l"])
+    success, out, err = run_docker_command(vps['container_id'], ["crontab", "-l"], timeout=DOCKER_EXEC_PAGE_TIMEOUT)
     crons = out.splitlines() if success else []
     return render_template('cron.html', vps=vps, crons=crons, panel_name=db.get_setting('panel_name', PANEL_NAME), theme=current_user.theme)
 
@@ -2372,7 +4181,7 @@ def vps_view_logs(vps_id):
     search_term = request.form.get('search_term', '')
    
     cmd = ["cat", log_path]
-    success, out, err = run_docker_command(vps['container_id'], cmd)
+    success, out, err = run_docker_command(vps['container_id'], cmd, timeout=DOCKER_EXEC_PAGE_TIMEOUT)
     logs = out if success else err
    
     if search_term:
@@ -2495,12 +4304,14 @@ def admin_panel():
         'total_users': len(all_users),
         'total_banned': len(banned),
         'total_restarts': db.get_stat('total_restarts'),
-        'total_vps_created': db.get_stat('total_vps_created')
+        'total_vps_created': db.get_stat('total_vps_created'),
+        'backup_last_ms': db.get_stat('backup_last_ms'),
+        'backup_last_bytes': db.get_stat('backup_last_bytes'),
+        'backup_generations': db.get_stat('scheduled_backup_generations')
     }
    
     audit_logs = db.get_audit_logs()
-    with open('hvm_panel.log', 'r') as f:
-        logs = ''.join(f.readlines()[-200:])
+    logs = ''.join(record + '\n' for record in tail_log())
    
     groups = db.get_groups()
     return render_template('admin.html', system_stats=system_stats, vps_list=all_vps, vps_stats=vps_stats_cache, users=all_users, banned_users=banned, audit_logs=audit_logs, groups=groups, **settings, **stats, recent_logs=logs, theme=current_user.theme)
@@ -2644,28 +4455,65 @@ def admin_unsuspend_vps(vps_id):
 @login_required
 @admin_required
 def admin_backup():
-    if db.backup_data():
-        db.log_action(current_user.id, 'backup_system', 'Performed system backup')
-        return send_file(BACKUP_FILE, as_attachment=True)
+    incremental = request.args.get('incremental') == '1'
+    backup = db.backup_data(BACKUP_INCREMENTAL_FILE if incremental else BACKUP_FILE, incremental=incremental)
+    if backup:
+        db.log_action(current_user.id, 'backup_system', f"Performed {backup['kind']} system backup ({backup['rows']} rows, {backup['bytes']} bytes)")
+        return send_file(backup['path'], as_attachment=True)
     return jsonify({'error': 'Backup failed'}), 500
 
+@app.route('/admin/logs')
+@login_required
+@admin_required
+def admin_logs():
+    filters = parse_log_filters({'levels': request.args.getlist('level'), 'vps_id': request.args.get('vps_id')})
+    count = min(max(request.args.get('lines', LOG_TAIL_LINES, type=int), 1), 5000)
+    return jsonify({'lines': tail_log(count, filters)})
+
+@app.route('/admin/backups')
+@login_required
+@admin_required
+def admin_backups():
+    backups = []
+    for name in list_backups():
+        info = os.stat(os.path.join(BACKUP_DIR, name))
+        backups.append({'name': name, 'bytes': info.st_size, 'modified': datetime.datetime.fromtimestamp(info.st_mtime).isoformat()})
+    stats = {key: db.get_stat(key) for key in ('backup_last_ms', 'backup_last_bytes', 'backup_last_rows', 'backup_rows_per_sec', 'scheduled_backup_last_at', 'scheduled_backup_generations')}
+    return jsonify({'schedule': BACKUP_SCHEDULE, 'retention': BACKUP_RETENTION, 'backups': backups, 'stats': stats})
+
+@app.route('/admin/backups/<name>')
+@login_required
+@admin_required
+def admin_download_backup(name):
+    if name not in list_backups():
+        return jsonify({'error': 'Not found'}), 404
+    return send_file(os.path.join(os.path.abspath(BACKUP_DIR), name), as_attachment=True)
+
 @app.route('/admin/restore', methods=['POST'])
 @login_required
 @admin_required
 def admin_restore():
-    if 'backup_file' not in request.files:
+    # A full backup optionally followed by incrementals, in upload order.
+    files = [file for file in request.files.getlist('backup_file') if file.filename]
+    if not files:
         return jsonify({'error': 'No file'}), 400
-   
-    file = request.files['backup_file']
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
-   
-    if file and file.filename.endswith('.json'):
-        file.save(BACKUP_FILE)
-        if db.restore_data():
-            db.log_action(current_user.id, 'restore_system', 'Restored system from backup')
-            return jsonify({'message': 'Restored'})
-   
+    if not all(file.filename.endswith(('.json', '.ndjson', '.gz')) for file in files):
+        return jsonify({'error': 'Unsupported backup file'}), 400
+
+    paths = []
+    try:
+        for i, file in enumerate(files):
+            path = f'{BACKUP_FILE}.restore-{i}'
+            file.save(path)
+            paths.append(path)
+        if db.restore_data(paths):
+            rebuild_port_allocations()
+            db.log_action(current_user.id, 'restore_system', f'Restored system from {len(paths)} backup file(s)')
+            return jsonify({'message': 'Restored', 'rows_per_sec': db.get_stat('restore_rows_per_sec')})
+    finally:
+        for path in paths:
+            os.remove(path)
+
     return jsonify({'error': 'Failed'}), 500
 
 @app.route('/admin/docker_prune')
@@ -2784,6 +4632,118 @@ def resize_handler(data):
         winsize = struct.pack("HHHH", data['rows'], data['cols'], 0, 0)
         fcntl.ioctl(fd, termios.TIOCSWINSZ, winsize)
 
+def log_record_matches(record, filters):
+    # Records look like "<asctime> - <name> - <LEVEL> - <message>".
+    if not filters:
+        return True
+    if filters.get('levels'):
+        parts = record.split(' - ', 3)
+        if len(parts) < 4 or parts[2] not in filters['levels']:
+            return False
+    if filters.get('vps_id') and filters['vps_id'] not in record:
+        return False
+    return True
+
+def read_lines_reversed(f, max_bytes=LOG_TAIL_MAX_SCAN, block_size=65536):
+    f.seek(0, os.SEEK_END)
+    position = f.tell()
+    limit = max(0, position - max_bytes)
+    partial = b''
+    while position > limit:
+        size = min(block_size, position - limit)
+        position -= size
+        f.seek(position)
+        lines = (f.read(size) + partial).split(b'\n')
+        partial = lines.pop(0)
+        yield from reversed(lines)
+    if position == 0 and partial:
+        yield partial
+
+def tail_log(count=LOG_TAIL_LINES, filters=None, path=LOG_FILE):
+    # Seeks backwards from the end, so the cost is the size of the tail
+    # rather than of the file. Multi-line records (tracebacks) are kept
+    # together and filtered as a whole.
+    records, pending = [], []
+    try:
+        with open(path, 'rb') as f:
+            for raw in read_lines_reversed(f):
+                line = raw.decode('utf-8', 'replace')
+                if not line:
+                    continue
+                pending.append(line)
+                if not LOG_RECORD_START.match(line):
+                    continue
+                record = '\n'.join(reversed(pending))
+                pending = []
+                if log_record_matches(record, filters):
+                    records.append(record)
+                    if len(records) >= count:
+                        break
+    except FileNotFoundError:
+        return []
+    records.reverse()
+    return records
+
+def parse_log_filters(data):
+    levels = {level.upper() for level in (data.get('levels') or [])} & LOG_LEVELS
+    return {'levels': levels, 'vps_id': (data.get('vps_id') or '').strip()}
+
+log_subscribers = {}  # sid -> filters
+
+def follow_log(path=LOG_FILE):
+    # Polls the log for appended lines and pushes them to subscribed admin
+    # sockets. Follows logrotate in both modes: a moved file is drained and
+    # the new one opened, a truncated one is re-read from the start.
+    f, inode, buffered = None, None, b''
+    decisions = {}
+    while True:
+        time.sleep(LOG_FOLLOW_INTERVAL)
+        if not log_subscribers:
+            if f:
+                f.close()
+                f = None
+            continue
+        try:
+            if f is None:
+                f = open(path, 'rb')
+                f.seek(0, os.SEEK_END)
+                inode, buffered, decisions = os.fstat(f.fileno()).st_ino, b'', {}
+            try:
+                current = os.stat(path)
+            except FileNotFoundError:
+                current = None
+            if current and current.st_ino == inode and current.st_size < f.tell():
+                f.seek(0)
+                buffered = b''
+            chunk = f.read()
+            if current and current.st_ino != inode:
+                f.close()
+                f = open(path, 'rb')
+                inode = current.st_ino
+                chunk += f.read()
+        except OSError as e:
+            logger.warning(f"Log follow error: {e}")
+            f = None
+            continue
+
+        lines = (buffered + chunk).split(b'\n')
+        buffered = lines.pop()
+        if not lines:
+            continue
+        outgoing = {}
+        for sid, filters in list(log_subscribers.items()):
+            for raw in lines:
+                line = raw.decode('utf-8', 'replace')
+                # Continuation lines go wherever their record's header went.
+                if LOG_RECORD_START.match(line):
+                    decisions[sid] = log_record_matches(line, filters)
+                if decisions.get(sid):
+                    outgoing.setdefault(sid, []).append(line)
+        for sid in set(decisions) - set(log_subscribers):
+            del decisions[sid]
+        for sid, matched in outgoing.items():
+            socketio.emit('log_lines', {'lines': matched}, room=sid, namespace='/admin')
+
 @socketio.on('connect', namespace='/admin')
 def handle_admin_connect():
     emit('system_stats', system_stats)
@@ -2791,7 +4751,24 @@ def handle_admin_connect():
 
 @socketio.on('disconnect', namespace='/admin')
 def handle_admin_disconnect():
-    pass
+    log_subscribers.pop(request.sid, None)
+
+@socketio.on('subscribe_logs', namespace='/admin')
+def subscribe_logs(data):
+    if not current_user.is_authenticated or not is_admin(current_user):
+        emit('error', 'Access denied')
+        return
+    filters = parse_log_filters(data or {})
+    try:
+        count = min(max(int((data or {}).get('lines', LOG_TAIL_LINES)), 1), 5000)
+    except (TypeError, ValueError):
+        count = LOG_TAIL_LINES
+    emit('log_lines', {'lines': tail_log(count, filters), 'backlog': True})
+    log_subscribers[request.sid] = filters
+
+@socketio.on('unsubscribe_logs', namespace='/admin')
+def unsubscribe_logs():
+    log_subscribers.pop(request.sid, None)
 
 @socketio.on('connect', namespace='/vps')
 def handle_vps_connect():
@@ -2809,6 +4786,19 @@ def leave_vps(data):
     vps_id = data['vps_id']
     leave_room(vps_id)
 
+@socketio.on('join_job', namespace='/jobs')
+def join_job(data):
+    row = db.get_job(data.get('job_id'))
+    if not row or not current_user.is_authenticated or (row['created_by'] != current_user.id and not is_admin(current_user)):
+        emit('error', 'Access denied')
+        return
+    join_room(row['id'])
+    emit('job_update', Job(row).reveal())
+
+@socketio.on('leave_job', namespace='/jobs')
+def leave_job(data):
+    leave_room(data.get('job_id'))
+
 @login_manager.user_loader
 def load_user(user_id):
     user_data = db.get_user_by_id(int(user_id))
@@ -2823,40 +4813,59 @@ def system_stats_updater():
         time.sleep(10)
 
 def vps_stats_updater():
+    next_tick = time.monotonic()
     while True:
-        update_vps_stats()
+        with LOOP_CYCLE_SECONDS.time('update_vps_stats'):
+            update_vps_stats()
         socketio.emit('vps_stats', vps_stats_cache, namespace='/admin')
-        time.sleep(5)
+        next_tick += STATS_INTERVAL
+        delay = next_tick - time.monotonic()
+        if delay < 0:
+            logger.warning(f"VPS stats cycle overran its {STATS_INTERVAL}s interval by {-delay:.1f}s")
+            next_tick = time.monotonic()
+            delay = 0
+        time.sleep(delay)
 
 def anti_miner_monitor():
     while True:
-        for token, vps in db.get_all_vps().items():
-            if vps['status'] != 'running':
-                continue
-            container = docker_client.containers.get(vps['container_id'])
-            stats = container.stats(stream=False)
-            cpu = (stats['cpu_stats']['cpu_usage']['total_usage'] / stats['cpu_stats']['system_cpu_usage']) * 100 if 'system_cpu_usage' in stats['cpu_stats'] else 0
-            if cpu > 95:
-                container.stop()
-                db.update_vps(token, {'status': 'suspended'})
-                db.add_notification(vps['created_by'], f'VPS {vps["vps_id"]} suspended due to high CPU')
-                continue
-            success, out, _ = run_docker_command(vps['container_id'], ["ps", "aux"])
-            if success:
-                for pattern in MINER_PATTERNS:
-                    if pattern in out.lower():
-                        container.stop()
-                        db.update_vps(token, {'status': 'suspended'})
-                        db.add_notification(vps['created_by'], f'VPS {vps["vps_id"]} suspended due to mining activity')
-                        break
+        with LOOP_CYCLE_SECONDS.time('anti_miner_monitor'):
+            scan_for_miners()
         time.sleep(120)
 
+def scan_for_miners():
+    for vps_id, vps in db.get_all_vps().items():
+        if vps['status'] != 'running':
+            continue
+        token = vps['token']
+        # Judge sustained load over the sampler window rather than one
+        # sample, normalized to the cores the VPS was given.
+        series = get_container_series(vps['container_id'], seconds=MINER_CPU_WINDOW)
+        cpu = sum(point['cpu_percent'] for point in series) / len(series) / max(vps['cpu'] or 1, 1) if series else 0
+        if cpu > 95:
+            docker_client.containers.get(vps['container_id']).stop()
+            db.update_vps(token, {'status': 'suspended'})
+            db.add_notification(vps['created_by'], f'VPS {vps["vps_id"]} suspended due to high CPU')
+            continue
+        success, out, _ = run_docker_command(vps['container_id'], ["ps", "aux"], timeout=DOCKER_EXEC_PAGE_TIMEOUT)
+        if success:
+            for pattern in MINER_PATTERNS:
+                if pattern in out.lower():
+                    docker_client.containers.get(vps['container_id']).stop()
+                    db.update_vps(token, {'status': 'suspended'})
+                    db.add_notification(vps['created_by'], f'VPS {vps["vps_id"]} suspended due to mining activity')
+                    break
+
 def clean_stopped_containers():
     while True:
-        stopped = docker_client.containers.list(filters={"status": "exited"})
-        for cont in stopped:
-            if cont.id not in [v['container_id'] for v in db.get_all_vps().values()]:
-                cont.remove()
+        try:
+            known = {v['container_id'] for v in db.get_all_vps().values()} | job_container_ids()
+            for cont in docker_client.containers.list(filters={"status": "exited", "label": "hvm.vps"}):
+                if is_orphan_container(cont, known):
+                    cont.remove()
+            gc_clone_images()
+            clean_stale_uploads()
+        except Exception as e:
+            logger.error(f"Container cleanup error: {e}")
         time.sleep(600)
 
 def check_expired_vps():
@@ -2879,35 +4888,202 @@ def check_expired_vps():
                         pass
         time.sleep(60)
 
+def set_vps_status(vps, status):
+    # suspended/expired are decided by the panel; only a container coming
+    # back up may override them.
+    if status == vps['status'] or (vps['status'] in PANEL_MANAGED_STATUSES and status != 'running'):
+        return False
+    db.update_vps(vps['token'], {'status': status})
+    socketio.emit('vps_status', {'vps_id': vps['vps_id'], 'status': status}, namespace='/admin')
+    return True
+
+def remove_orphan_container(container_id):
+    try:
+        cont = docker_client.containers.get(container_id)
+        if cont.status == 'exited' and is_orphan_container(cont, job_container_ids()):
+            cont.remove()
+            logger.info(f"Removed orphan container {container_id[:12]}")
+    except docker.errors.NotFound:
+        pass
+    except Exception as e:
+        logger.warning(f"Orphan cleanup for {container_id[:12]} failed: {e}")
+
+def handle_container_event(event):
+    action = event.get('Action') or event.get('status')
+    container_id = event.get('id') or event.get('Actor', {}).get('ID')
+    if not container_id:
+        return
+    vps = db.get_vps_by_container_id(container_id)
+    if not vps:
+        attributes = event.get('Actor', {}).get('Attributes', {})
+        if action == 'die' and 'hvm.vps' in attributes and attributes.get('hvm.pool') != '1':
+            remove_orphan_container(container_id)
+        return
+    if action == 'oom':
+        logger.warning(f"VPS {vps['vps_id']} hit its memory limit")
+        db.add_notification(vps['created_by'], f'VPS {vps["vps_id"]} ran out of memory')
+        socketio.emit('vps_event', {'vps_id': vps['vps_id'], 'event': 'oom'}, namespace='/admin')
+        return
+    status = CONTAINER_EVENT_STATUS.get(action)
+    if status:
+        set_vps_status(vps, status)
+    if action == 'start':
+        start_stats_stream(container_id)
+        # The container may come back with a different address.
+        if vps['additional_ports']:
+            sync_port_forwards()
+
+def container_event_listener():
+    since = None
+    while True:
+        try:
+            # Resuming with `since` replays anything missed while reconnecting.
+            for event in docker_client.events(decode=True, since=since, filters={'type': 'container', 'event': list(CONTAINER_EVENT_STATUS) + ['oom']}):
+                since = event.get('time', since)
+                try:
+                    handle_container_event(event)
+                except Exception as e:
+                    logger.error(f"Container event error: {e}")
+        except Exception as e:
+            logger.error(f"Docker events stream error: {e}")
+        time.sleep(5)
+
 def monitor_containers():
+    # Safety net for the events stream: one list call per sweep instead of
+    # one inspect per VPS.
     while True:
-        for token, vps in db.get_all_vps().items():
-            try:
-                cont = docker_client.containers.get(vps['container_id'])
-                status = cont.status
-                expires = datetime.datetime.fromisoformat(vps['expires_at'])
-                if datetime.datetime.now() > expires and status == 'running':
-                    cont.stop()
-                    db.update_vps(token, {'status': 'expired'})
-                    socketio.emit('vps_status', {'vps_id': vps['vps_id'], 'status': 'expired'}, namespace='/admin')
-                    continue
-                if status != vps['status']:
-                    db.update_vps(token, {'status': status})
-                    socketio.emit('vps_status', {'vps_id': vps['vps_id'], 'status': status}, namespace='/admin')
-            except docker.errors.NotFound:
-                if vps['status'] != 'not_found':
-                    db.update_vps(token, {'status': 'not_found'})
-                    socketio.emit('vps_status', {'vps_id': vps['vps_id'], 'status': 'not_found'}, namespace='/admin')
-        time.sleep(15)
+        try:
+            with LOOP_CYCLE_SECONDS.time('monitor_containers'):
+                reconcile_containers()
+        except Exception as e:
+            logger.error(f"Container reconcile error: {e}")
+        time.sleep(CONTAINER_RECONCILE_INTERVAL)
+
+def reconcile_containers():
+    statuses = {cont.id: cont.status for cont in docker_client.containers.list(all=True)}
+    now = datetime.datetime.now()
+    for vps_id, vps in db.get_all_vps().items():
+        status = statuses.get(vps['container_id'], 'not_found')
+        expires = datetime.datetime.fromisoformat(vps['expires_at']) if vps.get('expires_at') else None
+        if expires and now > expires and status == 'running':
+            docker_client.containers.get(vps['container_id']).stop()
+            db.update_vps(vps['token'], {'status': 'expired'})
+            socketio.emit('vps_status', {'vps_id': vps_id, 'status': 'expired'}, namespace='/admin')
+            continue
+        set_vps_status(vps, status)
+    sync_port_forwards()
+
+def warm_pool_maintainer():
+    for os_image in dict.fromkeys(PREBAKE_IMAGES + [plan[0] for plan in WARM_POOL_PLANS]):
+        try:
+            build_custom_image(os_image)
+        except Exception as e:
+            logger.error(f"Prebake of {os_image} failed: {e}")
+    while True:
+        try:
+            live = {c.id for c in docker_client.containers.list(filters={'label': 'hvm.pool=1', 'status': 'running'})}
+            for os_image, memory, cpu in WARM_POOL_PLANS:
+                entries = db.get_pool_containers(os_image, int(memory), int(cpu))
+                for entry in entries:
+                    if entry['container_id'] not in live:
+                        discard_pool_container(entry)
+                ready = sum(1 for entry in entries if entry['container_id'] in live)
+                for _ in range(WARM_POOL_SIZE - ready):
+                    create_pool_container(os_image, int(memory), int(cpu))
+        except Exception as e:
+            logger.error(f"Warm pool error: {e}")
+        warm_pool_event.wait(WARM_POOL_INTERVAL)
+        warm_pool_event.clear()
+
+def metrics_scraper():
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=METRICS_SCRAPE_WORKERS, thread_name_prefix='hvm-scrape')
+    while True:
+        started = time.monotonic()
+        try:
+            ips = get_container_ips()
+            all_vps = db.get_all_vps()
+            targets = [(vps, ips[vps['container_id']]) for vps in all_vps.values() if vps['status'] == 'running' and vps['container_id'] in ips]
+            list(pool.map(lambda target: scrape_node_exporter(*target), targets))
+            with node_metrics_lock:
+                for vps_id in set(node_metrics) - set(all_vps):
+                    del node_metrics[vps_id]
+        except Exception as e:
+            logger.error(f"Metrics scrape error: {e}")
+        time.sleep(max(0, METRICS_SCRAPE_INTERVAL - (time.monotonic() - started)))
+
+def history_compactor():
+    while True:
+        time.sleep(HISTORY_COMPACT_INTERVAL)
+        try:
+            db.compact_resource_history()
+        except Exception as e:
+            logger.error(f"History compaction error: {e}")
+
+def list_backups():
+    # Names sort chronologically: hvm-backup-<timestamp>-<kind>.ndjson.gz
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    return sorted(name for name in os.listdir(BACKUP_DIR) if name.startswith('hvm-backup-') and name.endswith('.ndjson.gz'))
+
+def rotate_backups():
+    # A generation is a full backup plus the incrementals taken after it;
+    # only whole generations are dropped so every kept chain restores.
+    names = list_backups()
+    fulls = [name for name in names if name.endswith('-full.ndjson.gz')]
+    if BACKUP_RETENTION <= 0 or len(fulls) <= BACKUP_RETENTION:
+        return len(fulls)
+    oldest_kept = fulls[-BACKUP_RETENTION]
+    for name in names:
+        if name >= oldest_kept:
+            break
+        os.remove(os.path.join(BACKUP_DIR, name))
+        logger.info(f"Rotated out backup {name}")
+    return min(len(fulls), BACKUP_RETENTION)
+
+def run_scheduled_backup(runs):
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    incremental = BACKUP_FULL_EVERY > 1 and runs % BACKUP_FULL_EVERY != 0 and any(name.endswith('-full.ndjson.gz') for name in list_backups())
+    kind = 'incremental' if incremental else 'full'
+    path = os.path.join(BACKUP_DIR, f"hvm-backup-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}-{kind}.ndjson.gz")
+    # Without a previous scheduled backup backup_data falls back to a full
+    # one; name the file after what was actually written.
+    backup = db.backup_data(path, incremental=incremental, chain='scheduled')
+    if not backup:
+        return None
+    if backup['kind'] != kind:
+        final_path = path.replace(f'-{kind}.', f"-{backup['kind']}.")
+        os.replace(path, final_path)
+        backup['path'] = final_path
+    generations = rotate_backups()
+    db._executemany('INSERT OR REPLACE INTO usage_stats (key, value) VALUES (?, ?)', [
+        ('scheduled_backup_last_at', int(time.time())),
+        ('scheduled_backup_generations', generations)
+    ])
+    return backup
 
 def scheduled_backups():
+    interval = BACKUP_INTERVALS.get(BACKUP_SCHEDULE)
+    if not interval:
+        logger.info(f"Scheduled backups disabled (BACKUP_SCHEDULE={BACKUP_SCHEDULE})")
+        return
+    runs = 0
+    # Fixed cadence regardless of how long each dump takes.
+    next_run = time.monotonic() + interval
     while True:
-        if BACKUP_SCHEDULE == 'daily':
-            time.sleep(86400)
-        elif BACKUP_SCHEDULE == 'hourly':
-            time.sleep(3600)
-        db.backup_data()
-        logger.info("Scheduled backup performed")
+        time.sleep(max(0, next_run - time.monotonic()))
+        next_run += interval
+        try:
+            backup = run_scheduled_backup(runs)
+            if backup:
+                runs += 1
+                logger.info(f"Scheduled {backup['kind']} backup {backup['path']}: {backup['bytes']} bytes in {backup['seconds']:.1f}s")
+        except Exception as e:
+            logger.error(f"Scheduled backup error: {e}")
+
+# Before anything else can enqueue or clean up: jobs left over from the
+# last run are rolled back and requeued while nothing new is running.
+if docker_client:
+    resume_jobs()
 
 threading.Thread(target=system_stats_updater, daemon=True).start()
 threading.Thread(target=vps_stats_updater, daemon=True).start()
@@ -2915,7 +5091,12 @@ threading.Thread(target=anti_miner_monitor, daemon=True).start()
 threading.Thread(target=clean_stopped_containers, daemon=True).start()
 threading.Thread(target=check_expired_vps, daemon=True).start()
 threading.Thread(target=monitor_containers, daemon=True).start()
+threading.Thread(target=container_event_listener, daemon=True).start()
 threading.Thread(target=scheduled_backups, daemon=True).start()
+threading.Thread(target=history_compactor, daemon=True).start()
+threading.Thread(target=metrics_scraper, daemon=True).start()
+threading.Thread(target=warm_pool_maintainer, daemon=True).start()
+threading.Thread(target=follow_log, daemon=True).start()
 
 
 __version__ = "3.1"